@@ -1,15 +1,35 @@
+import time
+# 启动计时起点，须在导入 gradio 之前
+_PROCESS_START = time.perf_counter()
 import gradio as gr
 import os
 import tempfile
-import time
 import requests
 import sys
 import io
 import base64
 import mimetypes
-from contextlib import redirect_stdout, redirect_stderr
+import threading
+import functools
+import json
+import random
+import shutil
+import subprocess
+import multiprocessing
+import sqlite3
+import hashlib
+import math
+import inspect
+import traceback
+import socket
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 from PIL import Image
-from typing import Optional, Dict, Any, List
+from types import SimpleNamespace
+from typing import Optional, Dict, Any, List, Callable
+
+import postprocess
 
 # 模型API调用时使用的内部ID常量 - 从环境变量获取，带默认值
 
@@ -17,212 +37,1690 @@ MODEL_SEEDANCE_PRO_API = os.getenv("MODEL_SEEDANCE_PRO_API", "seedance-1-0-pro-2
 MODEL_SEEDANCE_LITE_T2V_API = os.getenv("MODEL_SEEDANCE_LITE_T2V_API", "seedance-1-0-lite-t2v-250428")
 MODEL_SEEDANCE_LITE_I2V_API = os.getenv("MODEL_SEEDANCE_LITE_I2V_API", "seedance-1-0-lite-i2v-250428")
 
-class BytePlusVideoClient:
-    """BytePlus ModelArk video generation client"""
-    
-    def __init__(self, api_key: str = None, base_url: str = None):
-        """
-        Initialize BytePlus video client
-        
-        Args:
-            api_key: BytePlus API key
-            base_url: BytePlus API base URL
-        """
-        self.api_key = api_key
-        self.base_url = base_url
-        
-        # Debug: Print API configuration status
+# ARK API 熔断器配置 - 连续失败或响应过慢时快速失败，冷却后半开探测
+ARK_BREAKER_FAILURE_THRESHOLD = int(os.getenv("ARK_BREAKER_FAILURE_THRESHOLD", "5"))
+ARK_BREAKER_LATENCY_THRESHOLD = float(os.getenv("ARK_BREAKER_LATENCY_THRESHOLD", "20"))
+ARK_BREAKER_RECOVERY_TIMEOUT = float(os.getenv("ARK_BREAKER_RECOVERY_TIMEOUT", "30"))
+ARK_BREAKER_HALF_OPEN_PROBES = int(os.getenv("ARK_BREAKER_HALF_OPEN_PROBES", "3"))
 
+# 任务完成回调配置 - ARK_CALLBACK_URL 为公网可访问的 /ark/callback 地址
+ARK_CALLBACK_URL = os.getenv("ARK_CALLBACK_URL")
+ARK_CALLBACK_TOKEN = os.getenv("ARK_CALLBACK_TOKEN")
+# 必须同时配置地址和令牌才启用回调；未启用时 /ark/callback 返回 404
+ARK_CALLBACK_ENABLED = bool(ARK_CALLBACK_URL and ARK_CALLBACK_TOKEN)
+# 启用回调后，轮询仅作为丢失回调时的兜底
+ARK_CALLBACK_SAFETY_POLL_INTERVAL = float(os.getenv("ARK_CALLBACK_SAFETY_POLL_INTERVAL", "15"))
+
+# 多种子变体：一次提交的最大任务数
+SEEDANCE_MAX_VARIANTS = int(os.getenv("SEEDANCE_MAX_VARIANTS", "4"))
+
+# 本地 ffmpeg，用于提取尾帧与无损拼接等视频处理
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+SEEDANCE_MAX_STORYBOARD_SEGMENTS = int(os.getenv("SEEDANCE_MAX_STORYBOARD_SEGMENTS", "8"))
+
+# 后处理：下载成片并生成封面、动图预览和可选的低码率版本
+SEEDANCE_OUTPUT_DIR = os.getenv("SEEDANCE_OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "seedance-outputs"))
+# auto: 找到本地 ffmpeg 时才启用 (true 时缺少 ffmpeg 会告警并关闭)
+SEEDANCE_POSTPROCESS = os.getenv("SEEDANCE_POSTPROCESS", "auto").lower()
+SEEDANCE_POSTPROCESS_DIR = os.getenv("SEEDANCE_POSTPROCESS_DIR", os.path.join(SEEDANCE_OUTPUT_DIR, "videos"))
+SEEDANCE_POSTPROCESS_WORKERS = int(os.getenv("SEEDANCE_POSTPROCESS_WORKERS", "2"))
+SEEDANCE_POSTPROCESS_MAX_PENDING = int(os.getenv("SEEDANCE_POSTPROCESS_MAX_PENDING", "16"))
+SEEDANCE_POSTPROCESS_TRANSCODE = os.getenv("SEEDANCE_POSTPROCESS_TRANSCODE", "false").lower() == "true"
+SEEDANCE_PREVIEW_BITRATE = os.getenv("SEEDANCE_PREVIEW_BITRATE", "600k")
+# 后处理产物的保留上限：超过总大小或保存时间后从最旧的任务开始删除 (History 回退到远程链接)
+SEEDANCE_POSTPROCESS_MAX_MB = int(os.getenv("SEEDANCE_POSTPROCESS_MAX_MB", "2048"))
+SEEDANCE_POSTPROCESS_MAX_AGE = float(os.getenv("SEEDANCE_POSTPROCESS_MAX_AGE", str(7 * 86400)))
+
+# 生成历史记录数据库 (SQLite)
+SEEDANCE_HISTORY_DB = os.getenv("SEEDANCE_HISTORY_DB", os.path.join(SEEDANCE_OUTPUT_DIR, "history.db"))
+SEEDANCE_HISTORY_PAGE_SIZE = int(os.getenv("SEEDANCE_HISTORY_PAGE_SIZE", "24"))
+# 历史记录与延后作业按用户隔离：已登录用户按用户名，否则按浏览器 Cookie；单用户部署可设为 true 共享全部记录
+SEEDANCE_HISTORY_SHARED = os.getenv("SEEDANCE_HISTORY_SHARED", "false").lower() == "true"
+SEEDANCE_USER_COOKIE = "seedance_uid"
+
+# 延后队列：标记为"不急"的任务存入 SQLite，仅在交互负载 (进行中的交互任务 + Gradio 排队事件) 低于阈值
+# 或处于空闲时段 (本地时间，如 "22:00-06:00,12:00-13:30") 时提交；每个进程最多同时运行 CONCURRENCY 个
+SEEDANCE_DEFERRED_DB = os.getenv("SEEDANCE_DEFERRED_DB", SEEDANCE_HISTORY_DB)
+SEEDANCE_DEFERRED_DIR = os.getenv("SEEDANCE_DEFERRED_DIR", os.path.join(SEEDANCE_OUTPUT_DIR, "deferred"))
+SEEDANCE_DEFERRED_MAX_LOAD = int(os.getenv("SEEDANCE_DEFERRED_MAX_LOAD", "2"))
+SEEDANCE_DEFERRED_WINDOWS = os.getenv("SEEDANCE_DEFERRED_WINDOWS", "")
+SEEDANCE_DEFERRED_CONCURRENCY = int(os.getenv("SEEDANCE_DEFERRED_CONCURRENCY", "2"))
+SEEDANCE_DEFERRED_INTERVAL = float(os.getenv("SEEDANCE_DEFERRED_INTERVAL", "15"))
+SEEDANCE_DEFERRED_MAX_ATTEMPTS = int(os.getenv("SEEDANCE_DEFERRED_MAX_ATTEMPTS", "3"))
+
+# 用量统计：记录每个成功任务返回的 token 用量，按会话/模型/分辨率/时长汇总；
+# SEEDANCE_USAGE_PRICES 为 "model_id=每百万 tokens 价格" 列表，配置后汇总中显示估算费用
+SEEDANCE_USAGE_DB = os.getenv("SEEDANCE_USAGE_DB", SEEDANCE_HISTORY_DB)
+SEEDANCE_USAGE_PRICES = os.getenv("SEEDANCE_USAGE_PRICES", "")
+# 软限制：会话在 WINDOW 秒内用量超过 SOFT_LIMIT tokens (0 为关闭) 时不拒绝请求，
+# 而是先等待 THROTTLE_SECONDS × 用量/限额 秒 (最多 THROTTLE_MAX 秒) 再提交
+SEEDANCE_USAGE_WINDOW = float(os.getenv("SEEDANCE_USAGE_WINDOW", "3600"))
+SEEDANCE_USAGE_SOFT_LIMIT = int(os.getenv("SEEDANCE_USAGE_SOFT_LIMIT", "0"))
+SEEDANCE_USAGE_THROTTLE_SECONDS = float(os.getenv("SEEDANCE_USAGE_THROTTLE_SECONDS", "30"))
+SEEDANCE_USAGE_THROTTLE_MAX = float(os.getenv("SEEDANCE_USAGE_THROTTLE_MAX", "300"))
+
+# 相同请求合并：并发的相同提交共享同一个上游任务
+SEEDANCE_SINGLE_FLIGHT = os.getenv("SEEDANCE_SINGLE_FLIGHT", "true").lower() == "true"
+
+# 按模型分道：每个模型独立的并发上限与提交速率 (次/秒)，避免 Pro 长任务阻塞 Lite
+# 按模型覆盖的格式为 "模型ID=数值,模型ID=数值"
+SEEDANCE_LANE_LIMITS = os.getenv("SEEDANCE_LANE_LIMITS", "")
+SEEDANCE_LANE_RATES = os.getenv("SEEDANCE_LANE_RATES", "")
+SEEDANCE_LANE_DEFAULT_LIMIT = int(os.getenv("SEEDANCE_LANE_DEFAULT_LIMIT", "4"))
+SEEDANCE_LANE_DEFAULT_RATE = float(os.getenv("SEEDANCE_LANE_DEFAULT_RATE", "1"))
+SEEDANCE_LANE_BURST = int(os.getenv("SEEDANCE_LANE_BURST", "4"))
+SEEDANCE_LANE_MAX_WAIT = float(os.getenv("SEEDANCE_LANE_MAX_WAIT", "300"))
+# Gradio 每个事件的并发处理数；真正的上游并发由模型分道控制
+SEEDANCE_QUEUE_CONCURRENCY = int(os.getenv("SEEDANCE_QUEUE_CONCURRENCY", "32"))
+
+# "Auto" 模型选择：Pro 近期排队时间超过 SLO (秒) 时改用 Lite
+AUTO_MODEL = "Auto (Pro, Lite when busy)"
+SEEDANCE_ROUTER_QUEUE_SLO = float(os.getenv("SEEDANCE_ROUTER_QUEUE_SLO", "60"))
+
+# 预计耗时：按 (模型, 分辨率, 时长, 模式) 统计排队与渲染时间分位数，
+# 用于进度提示、轮询间隔以及每个任务的自适应超时 (秒)
+SEEDANCE_ETA_WINDOW = int(os.getenv("SEEDANCE_ETA_WINDOW", "200"))
+SEEDANCE_DEADLINE_FACTOR = float(os.getenv("SEEDANCE_DEADLINE_FACTOR", "2"))
+SEEDANCE_MIN_WAIT = float(os.getenv("SEEDANCE_MIN_WAIT", "180"))
+SEEDANCE_MAX_WAIT = float(os.getenv("SEEDANCE_MAX_WAIT", "1800"))
+
+# 批量查询任务状态：同一时刻的轮询合并为一次列表请求，不支持时回退为有限并发的单任务查询
+ARK_STATUS_BATCH = os.getenv("ARK_STATUS_BATCH", "true").lower() == "true"
+ARK_STATUS_BATCH_WINDOW = float(os.getenv("ARK_STATUS_BATCH_WINDOW", "0.25"))
+ARK_STATUS_PAGE_SIZE = int(os.getenv("ARK_STATUS_PAGE_SIZE", "100"))
+ARK_STATUS_FETCH_CONCURRENCY = int(os.getenv("ARK_STATUS_FETCH_CONCURRENCY", "8"))
+
+# ARK HTTP 连接：连接池大小；ARK_HTTP2=true 时通过 httpx 使用 HTTP/2 多路复用 (需 pip install "httpx[http2]")，
+# 服务端不支持或连续出现协议错误时回退到 HTTP/1.1
+ARK_HTTP_POOL_SIZE = int(os.getenv("ARK_HTTP_POOL_SIZE", "32"))
+ARK_HTTP2 = os.getenv("ARK_HTTP2", "false").lower() == "true"
+ARK_HTTP2_MAX_PROTOCOL_ERRORS = int(os.getenv("ARK_HTTP2_MAX_PROTOCOL_ERRORS", "3"))
+# HTTP/2 同时在途的流数上限，需低于服务端 SETTINGS_MAX_CONCURRENT_STREAMS (常见为 100)
+ARK_HTTP2_MAX_STREAMS = int(os.getenv("ARK_HTTP2_MAX_STREAMS", "64"))
+
+# 图片内存预算 (MB)：按解码尺寸估算每个请求的峰值内存，超出预算的请求排队等待 (秒)
+SEEDANCE_MEMORY_BUDGET_MB = int(os.getenv("SEEDANCE_MEMORY_BUDGET_MB", "1024"))
+SEEDANCE_MEMORY_WAIT = float(os.getenv("SEEDANCE_MEMORY_WAIT", "120"))
+
+# 上传图片预处理：长边与文件大小都在范围内的 JPEG/PNG/WebP 原样发送，其余按长边上限降采样解码
+SEEDANCE_IMAGE_MAX_SIDE = int(os.getenv("SEEDANCE_IMAGE_MAX_SIDE", "2560"))
+SEEDANCE_IMAGE_MAX_BYTES = int(os.getenv("SEEDANCE_IMAGE_MAX_MB", "10")) * 1024 * 1024
+
+# 浏览器端预缩放：上传前在 canvas 中把图片缩到长边上限并压缩为 WebP (浏览器不支持 WebP 编码时用 JPEG)，
+# 减少上传带宽；结果符合要求时服务端原样转发，不再重新编码
+SEEDANCE_CLIENT_RESIZE = os.getenv("SEEDANCE_CLIENT_RESIZE", "true").lower() == "true"
+SEEDANCE_CLIENT_RESIZE_MAX_SIDE = min(int(os.getenv("SEEDANCE_CLIENT_RESIZE_MAX_SIDE", "1920")), SEEDANCE_IMAGE_MAX_SIDE)
+SEEDANCE_CLIENT_RESIZE_QUALITY = float(os.getenv("SEEDANCE_CLIENT_RESIZE_QUALITY", "0.9"))
+
+# 临时文件空间：每个请求一个目录，配额 (MB) 之外的分配会被拒绝，后台线程回收孤儿目录 (秒)
+# SEEDANCE_SCRATCH_TMPFS=true 时放在内存文件系统 /dev/shm 上
+SEEDANCE_SCRATCH_TMPFS = os.getenv("SEEDANCE_SCRATCH_TMPFS", "false").lower() == "true"
+SEEDANCE_SCRATCH_DIR = os.getenv(
+    "SEEDANCE_SCRATCH_DIR",
+    os.path.join("/dev/shm" if SEEDANCE_SCRATCH_TMPFS and os.path.isdir("/dev/shm") else tempfile.gettempdir(), "seedance-scratch")
+)
+SEEDANCE_SCRATCH_QUOTA_MB = int(os.getenv("SEEDANCE_SCRATCH_QUOTA_MB", "2048"))
+SEEDANCE_SCRATCH_MAX_AGE = float(os.getenv("SEEDANCE_SCRATCH_MAX_AGE", "3600"))
+SEEDANCE_SCRATCH_SWEEP_INTERVAL = float(os.getenv("SEEDANCE_SCRATCH_SWEEP_INTERVAL", "300"))
+SEEDANCE_SCRATCH_OUTPUT_LINGER = float(os.getenv("SEEDANCE_SCRATCH_OUTPUT_LINGER", "600"))
+
+# 多进程部署：SEEDANCE_WORKERS 个进程分别监听 SEEDANCE_PORT 起的连续端口，需在前面放置会话粘滞的负载均衡
+# 共享状态后端："local" (单进程)、"sqlite:///path/state.db" (同机多进程) 或 "redis://host:6379/0"
+SEEDANCE_HOST = os.getenv("SEEDANCE_HOST", "127.0.0.1")
+SEEDANCE_PORT = int(os.getenv("SEEDANCE_PORT", "7860"))
+SEEDANCE_WORKERS = int(os.getenv("SEEDANCE_WORKERS", "1"))
+SEEDANCE_STATE_BACKEND = os.getenv(
+    "SEEDANCE_STATE_BACKEND",
+    "local" if SEEDANCE_WORKERS <= 1 else "sqlite://" + os.path.join(SEEDANCE_OUTPUT_DIR, "state.db")
+)
+
+# 滚动发布：SIGTERM 后停止接收新任务，最多等待进行中的任务 SEEDANCE_DRAIN_TIMEOUT 秒，
+# 未完成的任务记入历史库，重启后继续跟踪 (超过 SEEDANCE_RESUME_MAX_AGE 秒的不再恢复)
+SEEDANCE_DRAIN_TIMEOUT = float(os.getenv("SEEDANCE_DRAIN_TIMEOUT", "600"))
+SEEDANCE_RESUME_MAX_AGE = float(os.getenv("SEEDANCE_RESUME_MAX_AGE", "86400"))
+# /readyz 对 ARK 连通性检查结果的缓存时间 (秒)
+SEEDANCE_READY_CHECK_TTL = float(os.getenv("SEEDANCE_READY_CHECK_TTL", "30"))
+
+# ARK 客户端在首次使用时创建，创建失败后间隔多少秒再重试
+SEEDANCE_CLIENT_RETRY_INTERVAL = float(os.getenv("SEEDANCE_CLIENT_RETRY_INTERVAL", "30"))
+
+# 管理端点 (/admin/...) 的访问令牌，通过 X-Admin-Token 请求头传入；未设置时管理端点不存在
+SEEDANCE_ADMIN_TOKEN = os.getenv("SEEDANCE_ADMIN_TOKEN")
+# 性能剖析结果的保存目录，只保留最新的 SEEDANCE_PROFILE_KEEP 个文件
+SEEDANCE_PROFILE_DIR = os.getenv("SEEDANCE_PROFILE_DIR", os.path.join(SEEDANCE_OUTPUT_DIR, "profiles"))
+SEEDANCE_PROFILE_KEEP = int(os.getenv("SEEDANCE_PROFILE_KEEP", "50"))
+
+# 慢处理监控：处理函数运行超过 SEEDANCE_SLOW_HANDLER_SECONDS 秒时打印其调用栈 (之后每隔同样时长再打印)，
+# 每 SEEDANCE_WATCHDOG_INTERVAL 秒检查一次
+SEEDANCE_SLOW_HANDLER_SECONDS = float(os.getenv("SEEDANCE_SLOW_HANDLER_SECONDS", "600"))
+SEEDANCE_WATCHDOG_INTERVAL = float(os.getenv("SEEDANCE_WATCHDOG_INTERVAL", "10"))
+
+
+def _log(message: str):
+    """Print to the real stdout so background threads don't leak into captured handler logs"""
+    print(message, file=sys.__stdout__, flush=True)
+
+
+class _ThreadRoutedStream:
+    """Stand-in for sys.stdout/sys.stderr that sends writes from a capturing thread to that thread's buffer"""
+
+    def __init__(self, stream, local: threading.local):
+        self._stream = stream
+        self._local = local
+
+    def _target(self):
+        return getattr(self._local, "buffer", None) or self._stream
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class ThreadOutputCapture:
+    """Per-thread capture of print output for concurrent handlers
+
+    contextlib.redirect_stdout swaps the process-wide sys.stdout, so with several handlers running at once
+    one user's output would land in another's logs. Instead sys.stdout/sys.stderr are replaced once by
+    routing proxies, and each capturing thread registers its own buffer.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _install(self):
+        # 只安装一次；若其它代码 (如测试框架) 替换了 sys.stdout，则包装新的流
+        with self._lock:
+            for name in ("stdout", "stderr"):
+                stream = getattr(sys, name)
+                if not isinstance(stream, _ThreadRoutedStream):
+                    setattr(sys, name, _ThreadRoutedStream(stream, self._local))
+
+    @contextmanager
+    def capture(self, buffer):
+        self._install()
+        previous = getattr(self._local, "buffer", None)
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = previous
+
+
+OUTPUT_CAPTURE = ThreadOutputCapture()
+
+
+class MetricsRegistry:
+    """Minimal in-process metrics registry rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+
+    def inc(self, name: str, value: float = 1.0, help_text: str = "", **labels):
+        """Increment a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+            if help_text:
+                self._help[name] = help_text
+
+    def gauge(self, name: str, fn, help_text: str = ""):
+        """Register a gauge callback returning a number or a list of (labels, value) pairs"""
+        with self._lock:
+            self._gauges[name] = fn
+            if help_text:
+                self._help[name] = help_text
+
+    @staticmethod
+    def _format(name: str, labels, value) -> str:
+        if labels:
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+            return f"{name}{{{label_str}}} {float(value)}"
+        return f"{name} {float(value)}"
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus exposition format"""
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            help_texts = dict(self._help)
+
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen:
+                seen.add(name)
+                if name in help_texts:
+                    lines.append(f"# HELP {name} {help_texts[name]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(self._format(name, labels, value))
+
+        for name, fn in sorted(gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                _log(f"⚠️ Gauge {name} failed: {e}")
+                continue
+            if value is None:
+                continue
+            if name in help_texts:
+                lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, list):
+                for labels, item_value in value:
+                    lines.append(self._format(name, sorted(labels.items()), item_value))
+            else:
+                lines.append(self._format(name, None, value))
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+class StartupTimer:
+    """Seconds from process start to each startup milestone, exported as metrics and logged once serving"""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.phases = {}
+
+    def mark(self, phase: str, seconds: Optional[float] = None):
+        self.phases[phase] = time.perf_counter() - self.started_at if seconds is None else seconds
+
+    def summary(self) -> str:
+        return ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())
+
+
+STARTUP = StartupTimer(_PROCESS_START)
+STARTUP.mark("imports")
+METRICS.gauge(
+    "seedance_startup_seconds",
+    lambda: [({"phase": phase}, seconds) for phase, seconds in STARTUP.phases.items()],
+    "Seconds from process start to each startup phase (first_request is that request's own latency)"
+)
+
+
+class FirstRequestTimer:
+    """ASGI middleware that times the first HTTP request served and then logs the startup summary"""
+
+    def __init__(self, app):
+        self.app = app
+        self.done = False
+
+    async def __call__(self, scope, receive, send):
+        if self.done or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.done = True
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            STARTUP.mark("first_request", time.perf_counter() - start)
+            _log(f"🚀 Startup: {STARTUP.summary()} ({scope['method']} {scope['path']})")
+
+
+class BrowserIdCookie:
+    """ASGI middleware that gives each browser a long-lived random id cookie, used to keep History private to it
+
+    A request arriving without the cookie sees the new id as if it had been sent, so the first page load already has one.
+    """
+
+    MAX_AGE = 365 * 86400
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = list(scope.get("headers") or [])
+        cookie_header = b"; ".join(value for name, value in headers if name == b"cookie")
+        if f"{SEEDANCE_USER_COOKIE}=".encode() in cookie_header:
+            await self.app(scope, receive, send)
+            return
         
-        if not self.api_key or not self.base_url:
-            error_msg = f"API key and base URL are required. Current: API_KEY={'PROVIDED' if self.api_key else 'MISSING'}, BASE_URL={self.base_url or 'MISSING'}"
-            raise ValueError(error_msg)
-        
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        # Model configuration - Updated based on official documentation
-        self.models = {
-            "text_to_video": {
-                "Bytedance-Seedance-1.0-pro": MODEL_SEEDANCE_PRO_API,
-                "Bytedance-Seedance-1.0-Lite-t2v": MODEL_SEEDANCE_LITE_T2V_API
-            },
-            "image_to_video": {
-                "Bytedance-Seedance-1.0-pro": MODEL_SEEDANCE_PRO_API, 
-                "Bytedance-Seedance-1.0-Lite-i2v": MODEL_SEEDANCE_LITE_I2V_API
-            },
-            "first_last_frame": {
-                "Bytedance-Seedance-1.0-Lite-i2v": MODEL_SEEDANCE_LITE_I2V_API
-            },
-            "image_refs": {
-                "Bytedance-Seedance-1.0-Lite-i2v": MODEL_SEEDANCE_LITE_I2V_API
-            }
-        }
-    
-    def encode_image_to_base64(self, image_path: str) -> str:
-        """Encode image to base64 format"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    
-    def create_text_to_video_task(self, 
-                                  prompt: str, 
-                                  model: str = "Bytedance-Seedance-1.0-Lite-t2v",
-                                  resolution: str = "720p",
-                                  duration: int = 5,
-                                  ratio: str = "16:9",
-                                  seed: Optional[int] = None,
-                                  watermark: bool = True) -> Dict[str, Any]:
-        """Create text-to-video task"""
-        
-        # Build complete prompt with parameters
-        full_prompt = f"{prompt} --resolution {resolution} --duration {duration} --ratio {ratio}"
-        
-        # Add seed parameter if provided
-        if seed is not None:
-            full_prompt += f" --seed {seed}"
-        
-        # Add watermark parameter
-        if not watermark:
-            full_prompt += " --no-watermark"
-        
-        # Get model ID from model name
-        model_id = self.models["text_to_video"].get(model, self.models["text_to_video"]["Bytedance-Seedance-1.0-Lite-t2v"])
+        user_id = os.urandom(16).hex()
+        cookie = f"{SEEDANCE_USER_COOKIE}={user_id}".encode()
+        headers = [(name, value) for name, value in headers if name != b"cookie"]
+        headers.append((b"cookie", cookie_header + b"; " + cookie if cookie_header else cookie))
+        scope = dict(scope, headers=headers)
         
-        payload = {
-            "model": model_id,
-            "content": [
-                {
-                    "type": "text",
-                    "text": full_prompt
-                }
-            ]
-        }
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers") or []) + [(
+                    b"set-cookie",
+                    cookie + f"; Max-Age={self.MAX_AGE}; Path=/; HttpOnly; SameSite=Lax".encode()
+                )])
+            await send(message)
         
+        await self.app(scope, receive, send_with_cookie)
+
+
+class Profiler:
+    """On-demand diagnostics written to files: stack sampling, cProfile of handler calls, tracemalloc around image encoding
+
+    Nothing is installed until an admin arms it; when idle, the hooks cost one attribute check.
+    """
+
+    def __init__(self, output_dir: str, keep: int):
+        self.output_dir = output_dir
+        self.keep = keep
+        self.handler_names = set()
+        self.handler_calls = {}  # handler name -> calls still to profile
+        self.memory_calls = 0
+        self._lock = threading.Lock()
+        self._sampling = False
+        self._profiling = False
+        self._memory_active = 0
+
+    def _new_file(self, prefix: str, suffix: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        # 超出保留数量时删除最旧的结果
+        for entry in self.files()[self.keep - 1:]:
+            try:
+                os.remove(os.path.join(self.output_dir, entry["name"]))
+            except OSError:
+                pass
+        name = f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{random.randrange(16 ** 4):04x}{suffix}"
+        return os.path.join(self.output_dir, name)
+
+    def files(self) -> List[Dict[str, Any]]:
+        """Result files, newest first"""
         try:
-            response = requests.post(
-                f"{self.base_url}/contents/generations/tasks",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"error": f"Failed to create text-to-video task: {str(e)}"}
-    
-    def create_image_to_video_task(self, 
-                                   image_url: str = None,
-                                   image_path: str = None,
-                                   prompt: str = "",
-                                   model: str = "Bytedance-Seedance-1.0-Lite-i2v",
-                                   resolution: str = "720p", 
-                                   duration: int = 5,
-                                   ratio: str = "16:9",
-                                   seed: Optional[int] = None,
-                                   watermark: bool = True) -> Dict[str, Any]:
-        """Create image-to-video task"""
-        
-        content = []
+            entries = [entry for entry in os.scandir(self.output_dir) if entry.is_file()]
+        except FileNotFoundError:
+            return []
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        return [{"name": entry.name, "bytes": entry.stat().st_size, "modified": entry.stat().st_mtime} for entry in entries]
+
+    def file_path(self, name: str) -> Optional[str]:
+        """Path of a result file by bare name, or None"""
+        path = os.path.join(self.output_dir, os.path.basename(name))
+        return path if os.path.isfile(path) else None
+
+    def sample(self, seconds: float, interval: float) -> str:
+        """Sample every thread's stack for a while; writes collapsed stacks (flamegraph.pl / speedscope input)"""
+        with self._lock:
+            if self._sampling:
+                raise RuntimeError("A sampling run is already in progress")
+            self._sampling = True
+        counts = {}
+        samples = 0
+        try:
+            me = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    key = ";".join([names.get(ident, str(ident))] + stack[::-1])
+                    counts[key] = counts.get(key, 0) + 1
+                samples += 1
+                time.sleep(interval)
+        finally:
+            self._sampling = False
         
-        # 添加文本prompt（如果提供）
-        # Note: image-to-video only supports --ratio adaptive
-        if prompt:
-            full_prompt = f"{prompt} --resolution {resolution} --duration {duration} --ratio adaptive"
-        else:
-            # 只有参数的情况
-            full_prompt = f"--resolution {resolution} --duration {duration} --ratio adaptive"
+        path = self._new_file("sample", ".collapsed")
+        with open(path, "w") as f:
+            for key, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write(f"{key} {count}\n")
+        _log(f"🔬 Sampled {samples} times over {seconds:.0f}s -> {path}")
+        return path
+
+    def arm_handler(self, name: str, calls: int):
+        """Profile the next `calls` calls of a handler"""
+        with self._lock:
+            self.handler_calls[name] = calls
+
+    def _claim_handler(self, name: str) -> bool:
+        # 同一时间只剖析一个调用：cProfile 只覆盖当前线程，并发剖析会互相干扰
+        with self._lock:
+            if self._profiling or self.handler_calls.get(name, 0) <= 0:
+                return False
+            self.handler_calls[name] -= 1
+            if not self.handler_calls[name]:
+                del self.handler_calls[name]
+            self._profiling = True
+            return True
+
+    def call(self, func, *args, **kwargs):
+        """Run a handler, under cProfile if it is armed"""
+        if not self.handler_calls or not self._claim_handler(func.__name__):
+            return func(*args, **kwargs)
+        import cProfile
+        import pstats
         
-        # Add seed parameter if provided
-        if seed is not None:
-            full_prompt += f" --seed {seed}"
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            self._profiling = False
+            path = self._new_file(f"cprofile-{func.__name__}", ".prof")
+            profile.dump_stats(path)
+            with open(path[:-len(".prof")] + ".txt", "w") as f:
+                pstats.Stats(profile, stream=f).sort_stats("cumulative").print_stats(60)
+            _log(f"🔬 Profiled {func.__name__} -> {path}")
+
+    def arm_memory(self, calls: int, frames: int = 25):
+        """Trace allocations around the next `calls` image encodes"""
+        import tracemalloc
         
-        # Add watermark parameter
-        if not watermark:
-            full_prompt += " --no-watermark"
-            
-        content.append({
-            "type": "text",
-            "text": full_prompt
-        })
+        with self._lock:
+            self.memory_calls = calls
+            if calls > 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            elif calls <= 0 and not self._memory_active and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def trace_memory(self, label: str):
+        """Context manager around one image encode; a no-op unless memory tracing is armed"""
+        if not self.memory_calls:
+            return nullcontext()
+        with self._lock:
+            if self.memory_calls <= 0:
+                return nullcontext()
+            self.memory_calls -= 1
+            self._memory_active += 1
+        return self._memory_trace(label)
+
+    @contextmanager
+    def _memory_trace(self, label: str):
+        import tracemalloc
         
-        # 添加图片 - 支持URL或本地文件路径
-        if image_url:
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": image_url
-                }
-            })
-        elif image_path:
-            # 将本地图片转换为base64
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        start_current, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            with self._lock:
+                self._memory_active -= 1
+                # 最后一次追踪结束后关闭 tracemalloc，恢复正常分配开销
+                if self.memory_calls <= 0 and not self._memory_active:
+                    tracemalloc.stop()
+            own = tracemalloc.Filter(False, tracemalloc.__file__)
+            stats = after.filter_traces([own]).compare_to(before.filter_traces([own]), "lineno")
+            path = self._new_file(f"tracemalloc-{label}", ".txt")
+            with open(path, "w") as f:
+                f.write(f"{label}: peak {(peak - start_current) / 1024 / 1024:.1f} MiB above start "
+                        f"(Python allocations only; other concurrent requests are included)\n\n")
+                for stat in stats[:40]:
+                    f.write(f"{stat}\n")
+            _log(f"🔬 Traced memory for {label} -> {path}")
+
+
+PROFILER = Profiler(SEEDANCE_PROFILE_DIR, SEEDANCE_PROFILE_KEEP)
+
+
+class HandlerActivity:
+    """Handler calls in progress with their current phase and upstream task, plus Gradio queue saturation
+
+    A watchdog thread logs the stack of any handler running longer than slow_after seconds.
+    """
+
+    def __init__(self, slow_after: float, interval: float):
+        self.slow_after = slow_after
+        self.interval = interval
+        self.queue = None
+        self._lock = threading.Lock()
+        self._by_thread = {}  # thread ident -> activity record
+        self._records = []
+        self._queued_since = {}  # Gradio event id -> first time we saw it waiting
+        self._watchdog = None
+
+    @contextmanager
+    def track(self, handler: str):
+        """Register a handler call on the current thread (nested calls join the outer one)"""
+        ident = threading.get_ident()
+        with self._lock:
+            record = self._by_thread.get(ident)
+            if record is not None:
+                outer = False
+            else:
+                outer = True
+                record = {"handler": handler, "thread": ident, "started_at": time.time(),
+                          "phase": "starting", "task_id": None, "reported_at": None}
+                self._by_thread[ident] = record
+                self._records.append(record)
+        try:
+            yield record
+        finally:
+            if outer:
+                with self._lock:
+                    self._records.remove(record)
+                    if self._by_thread.get(record["thread"]) is record:
+                        del self._by_thread[record["thread"]]
+
+    def rebind(self, record: Dict[str, Any], ident: Optional[int]):
+        """Move a record to another thread (generator handlers resume on any worker thread); None while suspended"""
+        with self._lock:
+            if record["thread"] is not None and self._by_thread.get(record["thread"]) is record:
+                del self._by_thread[record["thread"]]
+            record["thread"] = ident
+            if ident is not None:
+                self._by_thread[ident] = record
+
+    def phase(self, phase: str, task_id: Optional[str] = None):
+        """Label what the handler on the current thread is doing; a no-op outside handlers"""
+        record = self._by_thread.get(threading.get_ident())
+        if record is not None:
+            record["phase"] = phase
+            if task_id:
+                record["task_id"] = task_id
+
+    def records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(record) for record in self._records]
+
+    def attach(self, demo):
+        """Watch the Gradio queue of the served UI and start the watchdog"""
+        self.queue = getattr(demo, "_queue", None)
+        with self._lock:
+            if self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch_loop, name="handler-watchdog", daemon=True)
+                self._watchdog.start()
+
+    def queue_stats(self) -> Dict[str, float]:
+        """Gradio queue depth, oldest wait and busy/total worker slots"""
+        queue = self.queue
+        if queue is None:
+            return {"waiting": 0, "oldest_wait": 0.0, "busy": 0, "slots": 0}
+        now = time.time()
+        # Gradio 事件没有入队时间，按首次观察到的时间估算 (精度为检查间隔)
+        waiting = [event._id for event_queue in list(queue.event_queue_per_concurrency_id.values())
+                   for event in list(event_queue.queue)]
+        with self._lock:
+            self._queued_since = {event_id: self._queued_since.get(event_id, now) for event_id in waiting}
+            oldest = now - min(self._queued_since.values()) if self._queued_since else 0.0
+        jobs = list(queue.active_jobs)
+        return {"waiting": len(waiting), "oldest_wait": oldest,
+                "busy": sum(job is not None for job in jobs), "slots": len(jobs)}
+
+    def check(self):
+        """Refresh queue observations and dump the stacks of handlers past the slow threshold"""
+        self.queue_stats()
+        now = time.time()
+        with self._lock:
+            slow = [record for record in self._records
+                    if now - record["started_at"] >= self.slow_after
+                    and not (record["reported_at"] and now - record["reported_at"] < self.slow_after)]
+            for record in slow:
+                record["reported_at"] = now
+            slow = [dict(record) for record in slow]
+        frames = sys._current_frames() if slow else {}
+        for record in slow:
+            elapsed = now - record["started_at"]
+            frame = frames.get(record["thread"]) if record["thread"] is not None else None
+            stack = "".join(traceback.format_stack(frame)) if frame else "  (generator suspended between updates)\n"
+            METRICS.inc("seedance_slow_handlers_total", handler=record["handler"], help_text="Watchdog reports of handlers past the slow threshold")
+            _log(f"🐢 Slow handler {record['handler']}: running {elapsed:.0f}s, phase={record['phase']}, "
+                 f"task_id={record['task_id'] or '-'}\n{stack}")
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.interval)
             try:
-                base64_image = self.encode_image_to_base64(image_path)
-                # 检测图片格式
-                mime_type, _ = mimetypes.guess_type(image_path)
-                if not mime_type or not mime_type.startswith('image/'):
-                    mime_type = 'image/jpeg'  # 默认为jpeg
-                
-                data_url = f"data:{mime_type};base64,{base64_image}"
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": data_url
-                    }
-                })
+                self.check()
             except Exception as e:
-                return {"error": f"Failed to encode image: {str(e)}"}
-        else:
-            return {"error": "Either image_url or image_path must be provided"}
-        
-        # Get model ID from model name
-        model_id = self.models["image_to_video"].get(model, self.models["image_to_video"]["Bytedance-Seedance-1.0-Lite-i2v"])
+                _log(f"⚠️ Handler watchdog failed: {e}")
+
+
+ACTIVITY = HandlerActivity(SEEDANCE_SLOW_HANDLER_SECONDS, SEEDANCE_WATCHDOG_INTERVAL)
+
+
+def _gradio_worker_states():
+    stats = ACTIVITY.queue_stats()
+    return [({"state": "busy"}, stats["busy"]), ({"state": "idle"}, stats["slots"] - stats["busy"])]
+
+
+def _handler_phase_counts():
+    counts = {}
+    for record in ACTIVITY.records():
+        key = (record["handler"], record["phase"])
+        counts[key] = counts.get(key, 0) + 1
+    return [({"handler": handler, "phase": phase}, count) for (handler, phase), count in counts.items()]
+
+
+METRICS.gauge("seedance_handlers_active", _handler_phase_counts, "Handler calls in progress by handler and phase")
+METRICS.gauge(
+    "seedance_handler_oldest_seconds",
+    lambda: max([time.time() - record["started_at"] for record in ACTIVITY.records()], default=0.0),
+    "Age of the longest-running handler call"
+)
+METRICS.gauge("seedance_gradio_workers", _gradio_worker_states, "Gradio worker slots running an event vs free")
+METRICS.gauge("seedance_gradio_queue_depth", lambda: ACTIVITY.queue_stats()["waiting"], "Events waiting in the Gradio queue")
+METRICS.gauge(
+    "seedance_gradio_queue_oldest_wait_seconds",
+    lambda: ACTIVITY.queue_stats()["oldest_wait"],
+    "How long the oldest queued Gradio event has been waiting for a worker slot"
+)
+
+
+def track_activity(func):
+    """Record a UI handler's calls for saturation gauges and the slow-handler watchdog"""
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            with ACTIVITY.track(func.__name__) as record:
+                iterator = func(*args, **kwargs)
+                while True:
+                    ACTIVITY.rebind(record, threading.get_ident())
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    ACTIVITY.rebind(record, None)
+                    yield item
+        return generator_wrapper
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with ACTIVITY.track(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class LocalStateBackend:
+    """In-process state: enough for a single worker"""
+
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}   # key -> (expires_at, value)
+        self._buckets = {}  # key -> (tokens, updated_at)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None or entry[0] < time.time():
+                self._values.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float):
+        with self._lock:
+            self._values[key] = (time.time() + ttl, value)
+            # 顺带清理过期条目，避免长时间运行后内存增长
+            if len(self._values) % 256 == 0:
+                now = time.time()
+                for stale in [k for k, (expires_at, _) in self._values.items() if expires_at < now]:
+                    del self._values[stale]
+
+    def set_if_absent(self, key: str, value: Dict[str, Any], ttl: float) -> bool:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and entry[0] >= time.time():
+                return False
+            self._values[key] = (time.time() + ttl, value)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def take_token(self, key: str, rate: float, burst: int) -> bool:
+        """Take one token from a rate bucket refilled at rate tokens/s up to burst"""
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (float(burst), now))
+            tokens = min(burst, tokens + (now - updated_at) * rate) if rate > 0 else float(burst)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+
+class SQLiteStateBackend:
+    """State shared by worker processes on one host through a SQLite file (also handy for tests)"""
+
+    shared = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL);
+    CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ? AND expires_at >= ?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, json.dumps(value), now + ttl))
+        if random.random() < 0.01:
+            conn.execute("DELETE FROM kv WHERE expires_at < ?", (now,))
+
+    def set_if_absent(self, key: str, value: Dict[str, Any], ttl: float) -> bool:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires_at < ?", (key, now))
+            inserted = conn.execute("INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                                    (key, json.dumps(value), now + ttl)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return inserted == 1
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def take_token(self, key: str, rate: float, burst: int) -> bool:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (float(burst), now)
+            tokens = min(burst, tokens + (now - updated_at) * rate) if rate > 0 else float(burst)
+            allowed = tokens >= 1
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                         (key, tokens - 1 if allowed else tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+class RedisStateBackend:
+    """State shared by workers and replicas through Redis (or any Redis-compatible server)"""
+
+    shared = True
+
+    # 令牌桶在服务端原子计算，避免多个进程并发读写
+    TAKE_TOKEN_SCRIPT = """
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local tokens = tonumber(bucket[1]) or burst
+    local updated_at = tonumber(bucket[2]) or now
+    if rate > 0 then
+        tokens = math.min(burst, tokens + (now - updated_at) * rate)
+    else
+        tokens = burst
+    end
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+    redis.call('EXPIRE', KEYS[1], 3600)
+    return allowed
+    """
+
+    def __init__(self, url: str, prefix: str = "seedance:"):
+        import redis  # 可选依赖，仅在配置 Redis 时需要
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._take_token = self._redis.register_script(self.TAKE_TOKEN_SCRIPT)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._redis.get(self.prefix + key)
+        return json.loads(value) if value else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float):
+        self._redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    def set_if_absent(self, key: str, value: Dict[str, Any], ttl: float) -> bool:
+        return bool(self._redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000), nx=True))
+
+    def delete(self, key: str):
+        self._redis.delete(self.prefix + key)
+
+    def take_token(self, key: str, rate: float, burst: int) -> bool:
+        return bool(self._take_token(keys=[self.prefix + "bucket:" + key], args=[rate, burst, time.time()]))
+
+
+def open_state_backend(spec: str):
+    """Backend from a spec: "local", "sqlite:///path/to/state.db" or "redis://host:6379/0" """
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStateBackend(spec)
+    if spec.startswith("sqlite://"):
+        return SQLiteStateBackend(spec[len("sqlite://"):] or os.path.join(SEEDANCE_OUTPUT_DIR, "state.db"))
+    return LocalStateBackend()
+
+
+STATE = open_state_backend(SEEDANCE_STATE_BACKEND)
+
+
+class CircuitBreaker:
+    """Circuit breaker for the ARK API: trips on consecutive failures or slow calls, probes in half-open state"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self,
+                 failure_threshold: int = 5,
+                 latency_threshold: float = 20.0,
+                 recovery_timeout: float = 30.0,
+                 half_open_probes: int = 3):
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_probes = half_open_probes
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.trips = 0
+        self.last_error = ""
+
+    def _refresh(self):
+        # 冷却时间结束后进入半开状态 (caller holds the lock)
+        if self._state == self.OPEN and time.time() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def retry_after(self) -> int:
+        """Seconds until the breaker will admit half-open probes"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0
+            return max(0, int(self._opened_at + self.recovery_timeout - time.time()) + 1)
+
+    def allow_request(self) -> bool:
+        """Return True if a new submission may go upstream"""
+        with self._lock:
+            self._refresh()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN:
+                if self._probes_in_flight + self._probe_successes < self.half_open_probes:
+                    self._probes_in_flight += 1
+                    return True
+            return False
+
+    def record_success(self, latency: float, probe: bool = False):
+        """Record a call that got an answer from upstream; only submissions (probe=True) count as half-open probes"""
+        if latency > self.latency_threshold:
+            self.record_failure(f"slow response ({latency:.1f}s)")
+            return
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if not probe:
+                    # 状态轮询不占用探测名额, 也不能关闭熔断器
+                    return
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._state = self.CLOSED
+                    self._failures = 0
+                    _log("✅ ARK circuit breaker closed")
+            elif self._state == self.CLOSED:
+                self._failures = 0
+
+    def record_failure(self, reason: str):
+        """Record a transport error, 5xx/429 or slow call"""
+        with self._lock:
+            self.last_error = reason
+            if self._state == self.HALF_OPEN:
+                self._trip()
+            elif self._state == self.CLOSED:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._trip()
+
+    def _trip(self):
+        self._state = self.OPEN
+        self._opened_at = time.time()
+        self._failures = 0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.trips += 1
+        _log(f"❌ ARK circuit breaker opened: {self.last_error}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current breaker state for metrics and the UI"""
+        state = self.state
+        return {
+            "state": state,
+            "trips": self.trips,
+            "last_error": self.last_error,
+            "retry_after": self.retry_after(),
+        }
+
+
+class SingleFlight:
+    """Coalesces identical concurrent task submissions onto one upstream task
+
+    Callers attached to a task each hold one reference; the task is only worth
+    cancelling upstream once the last reference has been released.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_key = {}   # payload key -> entry
+        self._by_task = {}  # task_id -> entry
+
+    @staticmethod
+    def payload_key(payload: Dict[str, Any]) -> str:
+        """Normalized identity of a task payload: model ID, prompt text and image digests"""
+        texts = []
+        images = []
+        for item in payload.get("content", []):
+            if item.get("type") == "text":
+                texts.append(item.get("text", ""))
+            elif item.get("type") == "image_url":
+                url = (item.get("image_url") or {}).get("url", "")
+                images.append((item.get("role", ""), hashlib.sha256(url.encode()).hexdigest()))
+        normalized = json.dumps([payload.get("model"), texts, images], ensure_ascii=False)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def run(self, key: str, create) -> Dict[str, Any]:
+        """Create the task via create() unless an identical one is already in flight"""
+        with self._lock:
+            entry = self._by_key.get(key)
+            leader = entry is None
+            if leader:
+                entry = {"key": key, "done": threading.Event(), "result": None, "task_id": None, "refs": 1}
+                self._by_key[key] = entry
+            else:
+                entry["refs"] += 1
         
-        payload = {
-            "model": model_id,
-            "content": content
+        if leader:
+            result = {"error": "task creation did not complete"}
+            try:
+                remote = STATE.get(f"flight:{key}") if STATE.shared else None
+                if remote:
+                    # Another worker already created this task; attach without owning it
+                    entry["remote"] = True
+                    result = {"id": remote["id"]}
+                    METRICS.inc("seedance_singleflight_coalesced_total", help_text="Submissions attached to an identical in-flight task")
+                    _log(f"🔗 Attached to task {remote['id']} created by another worker")
+                else:
+                    result = create()
+                    if STATE.shared and "error" not in result and result.get("id"):
+                        STATE.set(f"flight:{key}", {"id": result["id"]}, SEEDANCE_MAX_WAIT)
+            finally:
+                with self._lock:
+                    entry["result"] = result
+                    task_id = result.get("id") if "error" not in result else None
+                    if task_id:
+                        entry["task_id"] = task_id
+                        self._by_task[task_id] = entry
+                    else:
+                        # Failed creations are not shared with later retries
+                        self._by_key.pop(key, None)
+                entry["done"].set()
+            return result
+        
+        entry["done"].wait()
+        result = entry["result"]
+        if "error" in result or not result.get("id"):
+            with self._lock:
+                entry["refs"] -= 1
+        else:
+            METRICS.inc("seedance_singleflight_coalesced_total", help_text="Submissions attached to an identical in-flight task")
+            _log(f"🔗 Attached to in-flight task {result['id']} ({entry['refs']} callers)")
+        return result
+
+    def release(self, task_id: str, holder) -> bool:
+        """Drop one caller's reference (once per holder); True when no other caller is attached"""
+        with self._lock:
+            if getattr(holder, "flight_released", False):
+                return False
+            holder.flight_released = True
+            entry = self._by_task.get(task_id)
+            if entry is None:
+                return True
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return False
+            self._forget(entry)
+            # Tasks owned by another worker are never cancelled from here
+            return not entry.get("remote")
+
+    def complete(self, task_id: str):
+        """The task settled; identical submissions from now on create a fresh task"""
+        with self._lock:
+            entry = self._by_task.get(task_id)
+            if entry is not None and self._by_key.get(entry["key"]) is entry:
+                del self._by_key[entry["key"]]
+        if entry is not None and STATE.shared:
+            STATE.delete(f"flight:{entry['key']}")
+
+    def _forget(self, entry: Dict[str, Any]):
+        if self._by_key.get(entry["key"]) is entry:
+            del self._by_key[entry["key"]]
+            if STATE.shared and not entry.get("remote"):
+                STATE.delete(f"flight:{entry['key']}")
+        if self._by_task.get(entry["task_id"]) is entry:
+            del self._by_task[entry["task_id"]]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_task)
+
+
+SINGLE_FLIGHT = SingleFlight()
+METRICS.gauge("seedance_singleflight_tasks", lambda: len(SINGLE_FLIGHT), "Upstream tasks shared through single-flight")
+
+
+def _parse_model_map(spec: str, cast) -> Dict[str, Any]:
+    """Parse "model_id=value,model_id=value" lane settings"""
+    values = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            model_id, value = item.split("=", 1)
+            values[model_id.strip()] = cast(value.strip())
+    return values
+
+
+class ModelLane:
+    """Per-model admission: a cap on in-flight upstream tasks plus a submission rate bucket
+
+    The rate bucket lives in the state backend, so with a shared backend it limits all workers
+    together; the in-flight cap applies to each worker.
+    """
+
+    def __init__(self, model_id: str, limit: int, rate: float, burst: int):
+        self.model_id = model_id
+        self.limit = max(1, limit)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        """Wait for a free slot and a rate token; False if none became available in time"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    # 等待空闲槽位，并先占住它
+                    while self.active >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        self._cond.wait(remaining)
+                    self.active += 1
+                # 令牌可能要访问共享状态后端 (SQLite/Redis)，不能在持锁时进行，否则会阻塞 release 和其它等待者
+                try:
+                    if STATE.take_token(f"lane:{self.model_id}", self.rate, self.burst):
+                        return True
+                except BaseException:
+                    self.release()
+                    raise
+                with self._cond:
+                    # 没有令牌：归还槽位，等令牌补充后重试 (其它等待者同样缺令牌，只在放弃时唤醒它们)
+                    self.active -= 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._cond.notify()
+                        return False
+                    self._cond.wait(min(remaining, 1 / self.rate) if self.rate > 0 else remaining)
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active = max(0, self.active - 1)
+            self._cond.notify()
+
+
+class LaneRegistry:
+    """One lane per model ID, so slow Pro jobs never queue in front of Lite ones"""
+
+    def __init__(self, limits: Dict[str, int], rates: Dict[str, float], default_limit: int, default_rate: float, burst: int):
+        self.limits = limits
+        self.rates = rates
+        self.default_limit = default_limit
+        self.default_rate = default_rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self._bound = {}  # task_id -> lane holding a slot for it
+
+    def lane(self, model_id: str) -> ModelLane:
+        with self._lock:
+            lane = self._lanes.get(model_id)
+            if lane is None:
+                lane = ModelLane(
+                    model_id,
+                    self.limits.get(model_id, self.default_limit),
+                    self.rates.get(model_id, self.default_rate),
+                    self.burst
+                )
+                self._lanes[model_id] = lane
+            return lane
+
+    def bind(self, task_id: str, lane: ModelLane):
+        """The lane slot is now held by an upstream task"""
+        with self._lock:
+            self._bound[task_id] = lane
+
+    def finish(self, task_id: str):
+        """Return a task's slot to its lane (no-op if already returned)"""
+        with self._lock:
+            lane = self._bound.pop(task_id, None)
+        if lane is not None:
+            lane.release()
+
+    def samples(self, attribute: str):
+        with self._lock:
+            lanes = list(self._lanes.values())
+        return [({"model": lane.model_id}, getattr(lane, attribute)) for lane in lanes]
+
+
+LANES = LaneRegistry(
+    limits=_parse_model_map(SEEDANCE_LANE_LIMITS, int),
+    rates=_parse_model_map(SEEDANCE_LANE_RATES, float),
+    default_limit=SEEDANCE_LANE_DEFAULT_LIMIT,
+    default_rate=SEEDANCE_LANE_DEFAULT_RATE,
+    burst=SEEDANCE_LANE_BURST
+)
+METRICS.gauge("seedance_lane_queue_depth", lambda: LANES.samples("waiting"), "Submissions waiting for a model lane")
+METRICS.gauge("seedance_lane_active", lambda: LANES.samples("active"), "Upstream tasks holding a model lane slot")
+
+
+# 模型能力矩阵 - 在本地预检参数组合，避免网络往返甚至计费后才发现无效请求
+# 可通过 SEEDANCE_MODEL_CAPABILITIES_FILE 指向 JSON 文件按模型ID覆盖
+SEEDANCE_MODEL_CAPABILITIES_FILE = os.getenv("SEEDANCE_MODEL_CAPABILITIES_FILE")
+
+_STANDARD_RATIOS = ["16:9", "4:3", "1:1", "3:4", "9:16"]
+_IMAGE_LIMITS = {
+    "formats": ["JPEG", "PNG", "WEBP", "BMP", "TIFF", "GIF"],
+    "max_bytes": 30 * 1024 * 1024,
+    "min_side": 300,
+    "max_side": 6000,
+    "min_aspect": 0.4,
+    "max_aspect": 2.5
+}
+
+DEFAULT_MODEL_CAPABILITIES = {
+    MODEL_SEEDANCE_PRO_API: {
+        "modes": ["text_to_video", "image_to_video"],
+        "resolutions": ["480p", "720p", "1080p"],
+        "durations": list(range(3, 13)),
+        "ratios": _STANDARD_RATIOS,
+        "image_ratios": ["adaptive"],
+        "roles": ["first_frame"],
+        "max_reference_images": 0,
+        "image_limits": _IMAGE_LIMITS
+    },
+    MODEL_SEEDANCE_LITE_T2V_API: {
+        "modes": ["text_to_video"],
+        "resolutions": ["480p", "720p", "1080p"],
+        "durations": list(range(3, 13)),
+        "ratios": _STANDARD_RATIOS,
+        "image_ratios": [],
+        "roles": [],
+        "max_reference_images": 0,
+        "image_limits": _IMAGE_LIMITS
+    },
+    MODEL_SEEDANCE_LITE_I2V_API: {
+        "modes": ["image_to_video", "first_last_frame", "image_refs"],
+        "resolutions": ["480p", "720p", "1080p"],
+        "durations": list(range(3, 13)),
+        # Ratios apply to reference-image generation; first-frame modes force adaptive
+        "ratios": _STANDARD_RATIOS,
+        "image_ratios": ["adaptive"],
+        "roles": ["first_frame", "last_frame", "reference_image"],
+        "max_reference_images": 4,
+        "image_limits": _IMAGE_LIMITS
+    }
+}
+
+# 各模式需要的图片角色
+_MODE_ROLES = {
+    "text_to_video": [],
+    "image_to_video": ["first_frame"],
+    "first_last_frame": ["first_frame", "last_frame"],
+    "image_refs": ["reference_image"]
+}
+
+
+@functools.lru_cache(maxsize=1)
+def load_model_capabilities() -> Dict[str, Dict[str, Any]]:
+    """Load the capability matrix once (defaults plus optional JSON overrides)"""
+    capabilities = {model_id: dict(caps) for model_id, caps in DEFAULT_MODEL_CAPABILITIES.items()}
+    if SEEDANCE_MODEL_CAPABILITIES_FILE:
+        try:
+            with open(SEEDANCE_MODEL_CAPABILITIES_FILE, "r", encoding="utf-8") as f:
+                overrides = json.load(f)
+            for model_id, caps in overrides.items():
+                capabilities.setdefault(model_id, {}).update(caps)
+        except Exception as e:
+            _log(f"❌ Failed to load model capabilities from {SEEDANCE_MODEL_CAPABILITIES_FILE}: {e}")
+    return capabilities
+
+
+def get_model_capabilities(model_id: str) -> Optional[Dict[str, Any]]:
+    """Capabilities for a model ID, or None if the model is unknown"""
+    return load_model_capabilities().get(model_id)
+
+
+def _check_image(path: str, role: str, limits: Dict[str, Any]) -> Optional[str]:
+    # 只读取文件头获取尺寸，不解码像素
+    size = os.path.getsize(path)
+    if size > limits["max_bytes"]:
+        return f"{role} image is {size / 1024 / 1024:.1f} MB, limit is {limits['max_bytes'] // 1024 // 1024} MB"
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            image_format = img.format
+    except Exception as e:
+        return f"{role} image could not be read: {e}"
+    if image_format not in limits["formats"]:
+        return f"{role} image format {image_format} is not supported ({', '.join(limits['formats'])})"
+    if min(width, height) < limits["min_side"] or max(width, height) > limits["max_side"]:
+        return (f"{role} image is {width}x{height}, each side must be between "
+                f"{limits['min_side']} and {limits['max_side']} px")
+    aspect = width / height
+    if not limits["min_aspect"] <= aspect <= limits["max_aspect"]:
+        return (f"{role} image aspect ratio {aspect:.2f} is outside "
+                f"[{limits['min_aspect']}, {limits['max_aspect']}]")
+    return None
+
+
+def validate_generation_request(model_id: str,
+                                mode: str,
+                                resolution: str,
+                                duration: int,
+                                ratio: Optional[str] = None,
+                                images: Optional[List[tuple]] = None) -> Optional[str]:
+    """Preflight a request against the capability matrix; returns an error message or None
+
+    images is a list of (role, path_or_url) tuples; only local files are inspected.
+    """
+    caps = get_model_capabilities(model_id)
+    if caps is None:
+        return f"Unknown model: {model_id}"
+    if mode not in caps["modes"]:
+        return f"Model {model_id} does not support {mode.replace('_', '-')}"
+    if resolution not in caps["resolutions"]:
+        return f"Resolution {resolution} is not supported by {model_id} (supported: {', '.join(caps['resolutions'])})"
+    if int(duration) not in caps["durations"]:
+        return f"Duration {duration}s is not supported by {model_id} (supported: {min(caps['durations'])}-{max(caps['durations'])}s)"
+    
+    if ratio is not None:
+        allowed_ratios = caps["image_ratios"] if mode in ("image_to_video", "first_last_frame") else caps["ratios"]
+        if ratio not in allowed_ratios:
+            return f"Aspect ratio {ratio} is not supported for {mode.replace('_', '-')} on {model_id} (supported: {', '.join(allowed_ratios)})"
+    
+    images = images or []
+    for role in _MODE_ROLES[mode]:
+        if role not in caps["roles"]:
+            return f"Model {model_id} does not accept {role.replace('_', ' ')} images"
+    if mode == "image_refs" and len(images) > caps["max_reference_images"]:
+        return f"Maximum {caps['max_reference_images']} reference images are supported"
+    
+    for role, image in images:
+        if image and not image.startswith(("http://", "https://", "data:")):
+            error = _check_image(image, role.replace("_", " "), caps["image_limits"])
+            if error:
+                return error
+    return None
+
+
+def capability_choices(model_id: str, mode: str) -> Dict[str, Any]:
+    """Parameter choices the UI should offer for a model and mode"""
+    caps = get_model_capabilities(model_id) or DEFAULT_MODEL_CAPABILITIES[MODEL_SEEDANCE_LITE_I2V_API]
+    ratios = caps["image_ratios"] if mode in ("image_to_video", "first_last_frame") else caps["ratios"]
+    return {
+        "resolutions": caps["resolutions"],
+        "min_duration": min(caps["durations"]),
+        "max_duration": max(caps["durations"]),
+        "ratios": ratios
+    }
+
+
+def _as_requests_response(response) -> requests.Response:
+    """Wrap an httpx response so callers keep using the requests API (raise_for_status, .text, .json())"""
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.headers = requests.structures.CaseInsensitiveDict(response.headers)
+    converted.url = str(response.url)
+    converted.encoding = response.encoding
+    converted._content = response.content
+    return converted
+
+
+class ArkTransport:
+    """Pooled HTTP for ARK calls: a requests session, or an httpx HTTP/2 client that falls back to it
+
+    Either way callers get requests responses and requests exceptions.
+    """
+
+    def __init__(self, pool_size: int, http2: bool = False, max_protocol_errors: int = 3, max_streams: int = 64):
+        self.max_protocol_errors = max_protocol_errors
+        self._streams = threading.BoundedSemaphore(max(1, max_streams))
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._httpx = None
+        self._client = None
+        self._protocol_errors = 0
+        if http2:
+            try:
+                import httpx
+                import h2  # noqa: F401 - httpx only speaks HTTP/2 when h2 is installed
+            except ImportError as e:
+                _log(f"⚠️ ARK_HTTP2 needs httpx with HTTP/2 support (pip install 'httpx[http2]'), using HTTP/1.1: {e}")
+            else:
+                self._httpx = httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                )
+
+    @property
+    def http2(self) -> bool:
+        return self._client is not None
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        client = self._client
+        if client is None:
+            response = self.session.request(method, url, **kwargs)
+            METRICS.inc("ark_http_requests_total", version="HTTP/1.1", help_text="ARK HTTP requests by protocol version")
+            return response
+        
+        httpx = self._httpx
+        try:
+            with self._streams:
+                response = self._request_h2(client, method, url, **kwargs)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        
+        if isinstance(response, requests.Response):
+            METRICS.inc("ark_http_requests_total", version="HTTP/1.1", help_text="ARK HTTP requests by protocol version")
+            return response
+        self._protocol_errors = 0
+        METRICS.inc("ark_http_requests_total", version=response.http_version, help_text="ARK HTTP requests by protocol version")
+        return _as_requests_response(response)
+
+    def _request_h2(self, client, method: str, url: str, **kwargs):
+        httpx = self._httpx
+        try:
+            return client.request(method, url, **kwargs)
+        except httpx.RemoteProtocolError as e:
+            # 创建任务的请求可能已被处理，任何情况下都不自动重试
+            if method == "POST":
+                if not self._graceful_goaway(e):
+                    self._protocol_error(e)
+                raise requests.exceptions.ConnectionError(f"HTTP/2 connection closed mid-request: {e}") from e
+            if not self._graceful_goaway(e):
+                self._protocol_error(e)
+                return self.session.request(method, url, **kwargs)
+            # 服务端轮换连接 (GOAWAY NO_ERROR) 时正在等待的流会失败；幂等请求在新连接上重试一次
+            return client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ReadError, httpx.WriteError):
+            if method == "POST":
+                raise
+            # 共享连接被关闭时所有复用它的查询会同时失败，换新连接重试一次
+            return client.request(method, url, **kwargs)
+
+    @staticmethod
+    def _graceful_goaway(error: Exception) -> bool:
+        """Whether the connection ended with GOAWAY NO_ERROR (routine rotation, not a broken HTTP/2 peer)"""
+        cause = error.__cause__
+        event = cause.args[0] if cause is not None and cause.args else None
+        return getattr(event, "error_code", None) == 0
+
+    def _protocol_error(self, error: Exception):
+        self._protocol_errors += 1
+        if self._protocol_errors >= self.max_protocol_errors and self._client is not None:
+            client, self._client = self._client, None
+            client.close()
+            _log(f"⚠️ {self._protocol_errors} consecutive HTTP/2 protocol errors ({error}), falling back to HTTP/1.1")
+
+
+# 逐个查询任务状态的共享线程池：线程按需创建并复用，每次批量查询不再新建线程池
+_STATUS_FETCH_POOL = ThreadPoolExecutor(max_workers=max(1, ARK_STATUS_FETCH_CONCURRENCY), thread_name_prefix="ark-status")
+
+
+class BytePlusVideoClient:
+    """BytePlus ModelArk video generation client"""
+    
+    def __init__(self, api_key: str = None, base_url: str = None, callback_url: str = None):
+        """
+        Initialize BytePlus video client
+        
+        Args:
+            api_key: BytePlus API key
+            base_url: BytePlus API base URL
+            callback_url: Optional URL ARK calls on task status changes
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.callback_url = callback_url
+        
+        # Debug: Print API configuration status
+
+        
+        if not self.api_key or not self.base_url:
+            error_msg = f"API key and base URL are required. Current: API_KEY={'PROVIDED' if self.api_key else 'MISSING'}, BASE_URL={self.base_url or 'MISSING'}"
+            raise ValueError(error_msg)
+        
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        # Model configuration - Updated based on official documentation
+        self.models = {
+            "text_to_video": {
+                "Bytedance-Seedance-1.0-pro": MODEL_SEEDANCE_PRO_API,
+                "Bytedance-Seedance-1.0-Lite-t2v": MODEL_SEEDANCE_LITE_T2V_API
+            },
+            "image_to_video": {
+                "Bytedance-Seedance-1.0-pro": MODEL_SEEDANCE_PRO_API, 
+                "Bytedance-Seedance-1.0-Lite-i2v": MODEL_SEEDANCE_LITE_I2V_API
+            },
+            "first_last_frame": {
+                "Bytedance-Seedance-1.0-Lite-i2v": MODEL_SEEDANCE_LITE_I2V_API
+            },
+            "image_refs": {
+                "Bytedance-Seedance-1.0-Lite-i2v": MODEL_SEEDANCE_LITE_I2V_API
+            }
         }
         
+        self.breaker = CircuitBreaker(
+            failure_threshold=ARK_BREAKER_FAILURE_THRESHOLD,
+            latency_threshold=ARK_BREAKER_LATENCY_THRESHOLD,
+            recovery_timeout=ARK_BREAKER_RECOVERY_TIMEOUT,
+            half_open_probes=ARK_BREAKER_HALF_OPEN_PROBES
+        )
+        # None until the first bulk listing tells us whether the endpoint is available
+        self.bulk_list_supported = None
+        self.http = ArkTransport(ARK_HTTP_POOL_SIZE, http2=ARK_HTTP2, max_protocol_errors=ARK_HTTP2_MAX_PROTOCOL_ERRORS,
+                                  max_streams=ARK_HTTP2_MAX_STREAMS)
+    
+    def _observe(self, start_time: float, error: Exception = None, probe: bool = False):
+        """Feed the outcome of an upstream call into the circuit breaker (probe=True for task submissions)"""
+        latency = time.time() - start_time
+        if error is None:
+            self.breaker.record_success(latency, probe=probe)
+            METRICS.inc("ark_requests_total", outcome="ok", help_text="ARK API calls by outcome")
+            return
+        
+        response = getattr(error, 'response', None)
+        status_code = response.status_code if response is not None else None
+        if status_code is not None and status_code < 500 and status_code != 429:
+            # 4xx means upstream answered; it is a bad request, not an outage
+            self.breaker.record_success(latency, probe=probe)
+            METRICS.inc("ark_requests_total", outcome="client_error", help_text="ARK API calls by outcome")
+        else:
+            self.breaker.record_failure(f"HTTP {status_code}" if status_code else type(error).__name__)
+            METRICS.inc("ark_requests_total", outcome="failure", help_text="ARK API calls by outcome")
+    
+    def _submit_task(self, payload: Dict[str, Any], action: str) -> Dict[str, Any]:
+        """Create a generation task, sharing one upstream task between identical concurrent submissions"""
+        if not SEEDANCE_SINGLE_FLIGHT:
+            result = self._post_task(payload, action)
+        else:
+            result = SINGLE_FLIGHT.run(SingleFlight.payload_key(payload), lambda: self._post_task(payload, action))
+        
+        task_id = result.get("id") if "error" not in result else None
+        if task_id and IN_FLIGHT.scope_cancelled():
+            # 创建期间用户已取消：没人会等待这个任务，立即取消它并释放通道 (其他共享者仍在等待时除外)
+            if SINGLE_FLIGHT.release(task_id, SimpleNamespace(flight_released=False)):
+                self.cancel_task(task_id)
+                LANES.finish(task_id)
+            METRICS.inc("seedance_cancellations_total", mode=IN_FLIGHT.current_scope()[1], help_text="Generations cancelled by users or disconnects")
+            return {"error": f"Generation cancelled (task {task_id} was cancelled upstream)"}
+        return result
+    
+    def _post_task(self, payload: Dict[str, Any], action: str) -> Dict[str, Any]:
+        """Create a task in its model's lane; the lane slot is held until the task settles"""
+        if LIFECYCLE.draining:
+            return {"error": "Server is restarting and not accepting new jobs, please retry in a minute"}
+        if IN_FLIGHT.scope_cancelled():
+            return {"error": "Generation cancelled before submission"}
+        
+        lane = LANES.lane(payload.get("model", ""))
+        ACTIVITY.phase("lane_wait")
+        if not lane.acquire(SEEDANCE_LANE_MAX_WAIT):
+            METRICS.inc("seedance_lane_rejected_total", model=lane.model_id, help_text="Submissions that timed out waiting for a model lane")
+            return {"error": f"Model {lane.model_id} is at capacity ({lane.active} running, {lane.waiting} waiting), please retry later"}
+        if IN_FLIGHT.scope_cancelled():
+            lane.release()
+            return {"error": "Generation cancelled before submission"}
+        
+        ACTIVITY.phase("submitting")
+        result = self._create_task(payload, action)
+        if "error" not in result and result.get("id"):
+            LANES.bind(result["id"], lane)
+        else:
+            lane.release()
+        return result
+    
+    def _create_task(self, payload: Dict[str, Any], action: str) -> Dict[str, Any]:
+        """POST a generation task, failing fast while the circuit breaker is open"""
+        if not self.breaker.allow_request():
+            METRICS.inc("ark_requests_total", outcome="rejected", help_text="ARK API calls by outcome")
+            reason = self.breaker.last_error or "repeated failures"
+            return {"error": f"ARK API is currently unavailable (circuit open after {reason}). "
+                             f"Failing fast to avoid long waits, please retry in {self.breaker.retry_after()}s"}
+        
+        if self.callback_url:
+            payload = dict(payload, callback_url=self.callback_url)
+        
+        start_time = time.time()
         try:
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/contents/generations/tasks",
                 headers=self.headers,
                 json=payload,
                 timeout=30
             )
             response.raise_for_status()
+            self._observe(start_time, probe=True)
             return response.json()
         except requests.exceptions.RequestException as e:
+            self._observe(start_time, e, probe=True)
             error_detail = str(e)
             if hasattr(e, 'response') and e.response is not None:
                 try:
                     error_detail = e.response.text
                 except:
                     pass
-            return {"error": f"Failed to create image-to-video task: {error_detail}"}
+            return {"error": f"Failed to create {action}: {error_detail}"}
     
-    def create_first_last_frame_task(self, 
-                                     first_frame_url: str = None,
-                                     first_frame_path: str = None,
-                                     last_frame_url: str = None,
-                                     last_frame_path: str = None,
-                                     prompt: str = "",
-                                     model: str = "Bytedance-Seedance-1.0-Lite-i2v",
-                                     resolution: str = "720p", 
-                                     duration: int = 5,
-                                     cf: bool = False,
-                                     seed: Optional[int] = None,
-                                     watermark: bool = True) -> Dict[str, Any]:
-        """Create first-last frame video task"""
+    def encode_image_to_base64(self, image_path: str) -> str:
+        """Encode image to base64 format"""
+        with open(image_path, "rb") as image_file:
+            return base64.b64encode(image_file.read()).decode('utf-8')
+    
+    def image_to_data_url(self, image_path: str) -> str:
+        """Encode a local image as a data URL (reusable across several tasks)"""
+        with PROFILER.trace_memory("image_to_data_url"):
+            base64_image = self.encode_image_to_base64(image_path)
+        # 检测图片格式
+        mime_type, _ = mimetypes.guess_type(image_path)
+        if not mime_type or not mime_type.startswith('image/'):
+            mime_type = 'image/jpeg'  # 默认为jpeg
+        return f"data:{mime_type};base64,{base64_image}"
+    
+    def create_text_to_video_task(self, 
+                                  prompt: str, 
+                                  model: str = "Bytedance-Seedance-1.0-Lite-t2v",
+                                  resolution: str = "720p",
+                                  duration: int = 5,
+                                  ratio: str = "16:9",
+                                  seed: Optional[int] = None,
+                                  watermark: bool = True) -> Dict[str, Any]:
+        """Create text-to-video task"""
         
-        content = []
+        # Get model ID from model name
+        model_id = self.models["text_to_video"].get(model, self.models["text_to_video"]["Bytedance-Seedance-1.0-Lite-t2v"])
         
-        # Build prompt with parameters
-        if prompt:
-            full_prompt = f"{prompt} --rs {resolution} --dur {duration} --cf {str(cf).lower()}"
-        else:
-            full_prompt = f"--rs {resolution} --dur {duration} --cf {str(cf).lower()}"
+        # 本地预检参数组合
+        error = validate_generation_request(model_id, "text_to_video", resolution, duration, ratio)
+        if error:
+            return {"error": f"Invalid parameters: {error}"}
+        
+        # Build complete prompt with parameters
+        full_prompt = f"{prompt} --resolution {resolution} --duration {duration} --ratio {ratio}"
         
         # Add seed parameter if provided
         if seed is not None:
@@ -231,7 +1729,132 @@ class BytePlusVideoClient:
         # Add watermark parameter
         if not watermark:
             full_prompt += " --no-watermark"
-            
+        
+        payload = {
+            "model": model_id,
+            "content": [
+                {
+                    "type": "text",
+                    "text": full_prompt
+                }
+            ]
+        }
+        
+        return self._submit_task(payload, "text-to-video task")
+    
+    def create_image_to_video_task(self, 
+                                   image_url: str = None,
+                                   image_path: str = None,
+                                   prompt: str = "",
+                                   model: str = "Bytedance-Seedance-1.0-Lite-i2v",
+                                   resolution: str = "720p", 
+                                   duration: int = 5,
+                                   ratio: str = "adaptive",
+                                   seed: Optional[int] = None,
+                                   watermark: bool = True) -> Dict[str, Any]:
+        """Create image-to-video task"""
+        
+        # Get model ID from model name
+        model_id = self.models["image_to_video"].get(model, self.models["image_to_video"]["Bytedance-Seedance-1.0-Lite-i2v"])
+        
+        # 本地预检参数组合 (image-to-video only supports --ratio adaptive)
+        error = validate_generation_request(model_id, "image_to_video", resolution, duration, ratio,
+                                            images=[("first_frame", image_url or image_path)])
+        if error:
+            return {"error": f"Invalid parameters: {error}"}
+        
+        content = []
+        
+        # 添加文本prompt（如果提供）
+        if prompt:
+            full_prompt = f"{prompt} --resolution {resolution} --duration {duration} --ratio {ratio}"
+        else:
+            # 只有参数的情况
+            full_prompt = f"--resolution {resolution} --duration {duration} --ratio {ratio}"
+        
+        # Add seed parameter if provided
+        if seed is not None:
+            full_prompt += f" --seed {seed}"
+        
+        # Add watermark parameter
+        if not watermark:
+            full_prompt += " --no-watermark"
+            
+        content.append({
+            "type": "text",
+            "text": full_prompt
+        })
+        
+        # 添加图片 - 支持URL或本地文件路径
+        if image_url:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": image_url
+                }
+            })
+        elif image_path:
+            # 将本地图片转换为base64
+            try:
+                data_url = self.image_to_data_url(image_path)
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": data_url
+                    }
+                })
+            except Exception as e:
+                return {"error": f"Failed to encode image: {str(e)}"}
+        else:
+            return {"error": "Either image_url or image_path must be provided"}
+        
+        payload = {
+            "model": model_id,
+            "content": content
+        }
+        
+        return self._submit_task(payload, "image-to-video task")
+    
+    def create_first_last_frame_task(self, 
+                                     first_frame_url: str = None,
+                                     first_frame_path: str = None,
+                                     last_frame_url: str = None,
+                                     last_frame_path: str = None,
+                                     prompt: str = "",
+                                     model: str = "Bytedance-Seedance-1.0-Lite-i2v",
+                                     resolution: str = "720p", 
+                                     duration: int = 5,
+                                     cf: bool = False,
+                                     seed: Optional[int] = None,
+                                     watermark: bool = True) -> Dict[str, Any]:
+        """Create first-last frame video task"""
+        
+        # Get model ID - only Lite i2v model is supported for this feature
+        model_id = self.models["first_last_frame"].get(model, MODEL_SEEDANCE_LITE_I2V_API)
+        
+        # 本地预检参数组合
+        error = validate_generation_request(model_id, "first_last_frame", resolution, duration,
+                                            images=[("first_frame", first_frame_url or first_frame_path),
+                                                    ("last_frame", last_frame_url or last_frame_path)])
+        if error:
+            return {"error": f"Invalid parameters: {error}"}
+        
+        content = []
+        
+        # Build prompt with parameters
+        if prompt:
+            full_prompt = f"{prompt} --rs {resolution} --dur {duration} --cf {str(cf).lower()}"
+        else:
+            full_prompt = f"--rs {resolution} --dur {duration} --cf {str(cf).lower()}"
+        
+        # Add seed parameter if provided
+        if seed is not None:
+            full_prompt += f" --seed {seed}"
+        
+        # Add watermark parameter
+        if not watermark:
+            full_prompt += " --no-watermark"
+            
         content.append({
             "type": "text",
             "text": full_prompt
@@ -248,12 +1871,7 @@ class BytePlusVideoClient:
             })
         elif first_frame_path:
             try:
-                base64_image = self.encode_image_to_base64(first_frame_path)
-                mime_type, _ = mimetypes.guess_type(first_frame_path)
-                if not mime_type or not mime_type.startswith('image/'):
-                    mime_type = 'image/jpeg'
-                
-                data_url = f"data:{mime_type};base64,{base64_image}"
+                data_url = self.image_to_data_url(first_frame_path)
                 content.append({
                     "type": "image_url",
                     "image_url": {
@@ -277,12 +1895,7 @@ class BytePlusVideoClient:
             })
         elif last_frame_path:
             try:
-                base64_image = self.encode_image_to_base64(last_frame_path)
-                mime_type, _ = mimetypes.guess_type(last_frame_path)
-                if not mime_type or not mime_type.startswith('image/'):
-                    mime_type = 'image/jpeg'
-                
-                data_url = f"data:{mime_type};base64,{base64_image}"
+                data_url = self.image_to_data_url(last_frame_path)
                 content.append({
                     "type": "image_url",
                     "image_url": {
@@ -295,31 +1908,12 @@ class BytePlusVideoClient:
         else:
             return {"error": "Either last_frame_url or last_frame_path must be provided"}
         
-        # Get model ID - only Lite i2v model is supported for this feature
-        model_id = self.models["first_last_frame"].get(model, MODEL_SEEDANCE_LITE_I2V_API)
-        
         payload = {
             "model": model_id,
             "content": content
         }
         
-        try:
-            response = requests.post(
-                f"{self.base_url}/contents/generations/tasks",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            error_detail = str(e)
-            if hasattr(e, 'response') and e.response is not None:
-                try:
-                    error_detail = e.response.text
-                except:
-                    pass
-            return {"error": f"Failed to create first-last frame task: {error_detail}"}
+        return self._submit_task(payload, "first-last frame task")
     
     def create_image_refs_task(self, 
                                ref_images: List[str] = None,  # List of image paths or URLs
@@ -335,8 +1929,14 @@ class BytePlusVideoClient:
         if not ref_images or len(ref_images) == 0:
             return {"error": "At least one reference image is required"}
         
-        if len(ref_images) > 4:
-            return {"error": "Maximum 4 reference images are supported"}
+        # Get model ID - only Lite i2v model is supported for this feature
+        model_id = self.models["image_refs"].get(model, MODEL_SEEDANCE_LITE_I2V_API)
+        
+        # 本地预检参数组合 (also enforces the reference image count)
+        error = validate_generation_request(model_id, "image_refs", resolution, duration, ratio,
+                                            images=[("reference_image", ref_image) for ref_image in ref_images if ref_image])
+        if error:
+            return {"error": f"Invalid parameters: {error}"}
         
         content = []
         
@@ -373,12 +1973,7 @@ class BytePlusVideoClient:
                 else:
                     # It's a local file path
                     try:
-                        base64_image = self.encode_image_to_base64(ref_image)
-                        mime_type, _ = mimetypes.guess_type(ref_image)
-                        if not mime_type or not mime_type.startswith('image/'):
-                            mime_type = 'image/jpeg'
-                        
-                        data_url = f"data:{mime_type};base64,{base64_image}"
+                        data_url = self.image_to_data_url(ref_image)
                         content.append({
                             "type": "image_url",
                             "image_url": {
@@ -389,94 +1984,2395 @@ class BytePlusVideoClient:
                     except Exception as e:
                         return {"error": f"Failed to encode reference image: {str(e)}"}
         
-        # Get model ID - only Lite i2v model is supported for this feature
-        model_id = self.models["image_refs"].get(model, MODEL_SEEDANCE_LITE_I2V_API)
-        
         payload = {
             "model": model_id,
             "content": content
         }
         
+        return self._submit_task(payload, "image refs task")
+    
+    def get_task_status(self, task_id: str) -> Dict[str, Any]:
+        """Query task status"""
+        start_time = time.time()
+        try:
+            response = self.http.get(
+                f"{self.base_url}/contents/generations/tasks/{task_id}",
+                headers=self.headers,
+                timeout=30
+            )
+            response.raise_for_status()
+            self._observe(start_time)
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            self._observe(start_time, e)
+            return {"error": f"Query failed: {str(e)}"}
+    
+    def _list_tasks(self, task_ids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Fetch many task statuses through the list endpoint; None if listing failed"""
+        results = {}
+        for offset in range(0, len(task_ids), ARK_STATUS_PAGE_SIZE):
+            chunk = task_ids[offset:offset + ARK_STATUS_PAGE_SIZE]
+            page_num = 1
+            while True:
+                start_time = time.time()
+                try:
+                    response = self.http.get(
+                        f"{self.base_url}/contents/generations/tasks",
+                        headers=self.headers,
+                        params={"page_num": page_num, "page_size": ARK_STATUS_PAGE_SIZE, "filter.task_ids": chunk},
+                        timeout=30
+                    )
+                    response.raise_for_status()
+                    self._observe(start_time)
+                    data = response.json()
+                except requests.exceptions.RequestException as e:
+                    self._observe(start_time, e)
+                    status_code = e.response.status_code if getattr(e, 'response', None) is not None else None
+                    if status_code in (400, 404, 405, 501):
+                        _log(f"⚠️ Bulk task listing unavailable (HTTP {status_code}), using per-task queries")
+                        self.bulk_list_supported = False
+                    return None
+                except ValueError:
+                    return None
+                
+                items = data.get("items") or []
+                for item in items:
+                    if item.get("id"):
+                        results[item["id"]] = item
+                if not items or page_num * ARK_STATUS_PAGE_SIZE >= data.get("total", 0):
+                    break
+                page_num += 1
+        self.bulk_list_supported = True
+        return results
+    
+    def get_tasks_status(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Query many tasks at once: paged list requests, falling back to bounded parallel GETs"""
+        task_ids = list(dict.fromkeys(task_ids))
+        results = {}
+        if task_ids and self.bulk_list_supported is not False:
+            results.update(self._list_tasks(task_ids) or {})
+        
+        # Tasks the listing did not return (or all of them, without bulk support) are fetched one by one
+        missing = [task_id for task_id in task_ids if task_id not in results]
+        if missing:
+            for task_id, status in zip(missing, _STATUS_FETCH_POOL.map(self.get_task_status, missing)):
+                results[task_id] = status
+        return results
+    
+    def check_reachable(self, timeout: float = 5) -> Optional[str]:
+        """Cheap authenticated call for readiness checks; returns an error message, or None if ARK answered"""
+        start_time = time.time()
+        try:
+            response = self.http.get(
+                f"{self.base_url}/contents/generations/tasks",
+                headers=self.headers,
+                params={"page_num": 1, "page_size": 1},
+                timeout=timeout
+            )
+        except requests.exceptions.RequestException as e:
+            self._observe(start_time, e)
+            return f"{type(e).__name__}: {e}"
+        
+        # Any answer short of an auth failure or outage means requests can be served
+        if response.status_code >= 500 or response.status_code == 429:
+            self._observe(start_time, requests.exceptions.HTTPError(response=response))
+            return f"HTTP {response.status_code}"
+        self._observe(start_time)
+        if response.status_code in (401, 403):
+            return f"HTTP {response.status_code} (check ARK_API_KEY)"
+        return None
+    
+    def cancel_task(self, task_id: str) -> Dict[str, Any]:
+        """Cancel a queued task (deletes it upstream and frees its concurrency slot)"""
+        start_time = time.time()
+        try:
+            response = self.http.delete(
+                f"{self.base_url}/contents/generations/tasks/{task_id}",
+                headers=self.headers,
+                timeout=30
+            )
+            response.raise_for_status()
+            self._observe(start_time)
+            return {"id": task_id, "status": "cancelled"}
+        except requests.exceptions.RequestException as e:
+            self._observe(start_time, e)
+            error_detail = str(e)
+            if hasattr(e, 'response') and e.response is not None:
+                try:
+                    error_detail = e.response.text
+                except:
+                    pass
+            return {"error": f"Failed to cancel task: {error_detail}"}
+    
+    def wait_for_task_completion(self, task_id: str, timeout: int = 300) -> Dict[str, Any]:
+        """Wait for task completion"""
+        start_time = time.time()
+        
+        while time.time() - start_time < timeout:
+            status_response = self.get_task_status(task_id)
+            
+            if "error" in status_response:
+                return status_response
+            
+            status = status_response.get("status", "unknown")
+            
+            if status == "success":
+                return status_response
+            elif status == "failed":
+                return {"error": "Task execution failed"}
+            
+            # Wait 5 seconds before querying again
+            time.sleep(5)
+        
+        return {"error": "Task timeout"}
+
+def _build_client() -> BytePlusVideoClient:
+    """Create the ARK client from the environment"""
+    api_key = os.getenv("ARK_API_KEY")
+    base_url = os.getenv("ARK_BASE_URL")
+    if not api_key or not base_url:
+        raise ValueError(f"Environment variables missing: ARK_API_KEY={'SET' if api_key else 'NOT SET'}, ARK_BASE_URL={base_url or 'NOT SET'}")
+    
+    callback_url = None
+    if ARK_CALLBACK_ENABLED:
+        separator = "&" if "?" in ARK_CALLBACK_URL else "?"
+        callback_url = f"{ARK_CALLBACK_URL}{separator}token={ARK_CALLBACK_TOKEN}"
+    elif ARK_CALLBACK_URL:
+        _log("⚠️ ARK_CALLBACK_URL is set without ARK_CALLBACK_TOKEN; callbacks stay disabled and tasks are polled")
+    
+    return BytePlusVideoClient(api_key=api_key, base_url=base_url, callback_url=callback_url)
+
+
+class LazyVideoClient:
+    """Stands in for the ARK client: builds it on first use, and retries a failed build instead of staying down
+
+    Falsy while no client could be built; attribute access is forwarded to the real client.
+    """
+
+    def __init__(self, retry_interval: float):
+        self.retry_interval = retry_interval
+        self.error = None
+        self._client = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[BytePlusVideoClient]:
+        if self._client is not None:
+            return self._client
+        with self._lock:
+            if self._client is None and (self._failed_at is None or time.time() - self._failed_at >= self.retry_interval):
+                try:
+                    self._client = _build_client()
+                    self.error = None
+                    _log("✅ BytePlus client initialized successfully")
+                except Exception as e:
+                    self._failed_at = time.time()
+                    self.error = str(e)
+                    _log(f"❌ Client initialization failed (retry in {self.retry_interval:.0f}s): {e}")
+        return self._client
+
+    def __bool__(self):
+        return self.get() is not None
+
+    def __getattr__(self, name):
+        real = self.get()
+        if real is None:
+            raise RuntimeError(f"ARK client not initialized: {self.error}")
+        return getattr(real, name)
+
+
+client = LazyVideoClient(SEEDANCE_CLIENT_RETRY_INTERVAL)
+
+_BREAKER_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+METRICS.gauge(
+    "ark_circuit_state",
+    lambda: _BREAKER_STATE_VALUES[client.breaker.state] if client else None,
+    "ARK circuit breaker state (0=closed, 1=half-open, 2=open)"
+)
+METRICS.gauge(
+    "ark_circuit_trips",
+    lambda: client.breaker.trips if client else None,
+    "Times the ARK circuit breaker has opened since start"
+)
+
+
+def render_service_status() -> str:
+    """HTML badge with the ARK API health shown in the page header"""
+    if not client:
+        return "<div class='service-status'>🔴 ARK client not initialized</div>"
+    
+    snapshot = client.breaker.snapshot()
+    if snapshot["state"] == CircuitBreaker.OPEN:
+        return (f"<div class='service-status'>🔴 ARK API degraded - new requests fail fast "
+                f"(retry in {snapshot['retry_after']}s; last error: {snapshot['last_error']})</div>")
+    if snapshot["state"] == CircuitBreaker.HALF_OPEN:
+        return "<div class='service-status'>🟡 ARK API recovering - probing with limited requests</div>"
+    return "<div class='service-status'>🟢 ARK API available</div>"
+
+TASK_STATUSES = {"queued", "running", "succeeded", "failed", "cancelled"}
+
+
+class TaskCompletionHub:
+    """Hands task status updates (ARK callbacks or polls) to the handlers waiting on them
+
+    With a shared state backend, statuses and tracked task IDs are visible to every worker,
+    so a callback delivered to one worker reaches handlers waiting in another.
+    """
+
+    def __init__(self, retention: float = 3600):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._waiters = {}  # task_id -> set of threading.Event
+        self._results = {}  # task_id -> (received_at, status payload)
+
+    def subscribe(self, task_id: str) -> threading.Event:
+        """Register interest in a task; the returned event is set on every update"""
+        event = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(task_id, set()).add(event)
+        if STATE.shared:
+            STATE.set(f"tracked:{task_id}", {"pid": os.getpid()}, self.retention)
+        return event
+
+    def unsubscribe(self, task_id: str, event: threading.Event):
+        with self._lock:
+            waiters = self._waiters.get(task_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[task_id]
+
+    def is_known(self, task_id: str) -> bool:
+        with self._lock:
+            if task_id in self._waiters or task_id in self._results:
+                return True
+        return STATE.shared and STATE.get(f"tracked:{task_id}") is not None
+
+    def publish(self, task_id: str, payload: Dict[str, Any]):
+        """Store the latest status for a task and wake everyone waiting on it"""
+        now = time.time()
+        if STATE.shared:
+            STATE.set(f"task:{task_id}", {"received_at": now, "payload": payload}, self.retention)
+        with self._lock:
+            self._results[task_id] = (now, payload)
+            # 清理过期结果，避免长时间运行后内存增长
+            expired = [tid for tid, (received_at, _) in self._results.items()
+                       if now - received_at > self.retention and tid not in self._waiters]
+            for tid in expired:
+                del self._results[tid]
+            waiters = list(self._waiters.get(task_id, ()))
+        for event in waiters:
+            event.set()
+
+    def latest(self, task_id: str):
+        """(received_at, payload) of the newest status seen by any worker, or None"""
+        with self._lock:
+            entry = self._results.get(task_id)
+        if STATE.shared:
+            shared = STATE.get(f"task:{task_id}")
+            if shared and (entry is None or shared["received_at"] > entry[0]):
+                entry = (shared["received_at"], shared["payload"])
+        return entry
+
+    def result(self, task_id: str) -> Optional[Dict[str, Any]]:
+        entry = self.latest(task_id)
+        return entry[1] if entry else None
+
+    def handle_callback(self, payload: Any):
+        """Validate an ARK callback and confirm it upstream; returns (accepted, message)
+
+        The body is only a wake-up signal: waiters are handed the status re-read from ARK,
+        so a forged or replayed callback cannot inject a result.
+        """
+        if not isinstance(payload, dict):
+            return False, "callback body must be a JSON object"
+        task_id = payload.get("id")
+        status = payload.get("status")
+        if not isinstance(task_id, str) or not task_id:
+            return False, "missing task id"
+        if status not in TASK_STATUSES:
+            return False, f"unknown status: {status}"
+        if not self.is_known(task_id):
+            # Not a task any worker is tracking; acknowledge so ARK stops retrying
+            return True, "ignored unknown task"
+        METRICS.inc("ark_callbacks_total", status=status, help_text="Task status callbacks received from ARK")
+        latest = self.result(task_id)
+        if latest and latest.get("status") in ("succeeded", "failed", "cancelled"):
+            # 重复或迟到的回调：任务已结束，无需再查询
+            return True, "already settled"
+        confirmed = STATUS_BATCHER.get(task_id)
+        if "error" in confirmed:
+            # 确认失败时交给兜底轮询
+            return True, "not confirmed, left to polling"
+        self.publish(task_id, confirmed)
+        return True, "recorded"
+
+
+TASK_HUB = TaskCompletionHub()
+
+
+class StatusBatcher:
+    """Merges status polls that arrive within a short window into one bulk query
+
+    pollers, if given, returns how many callers may poll at once; the window ends as soon as that
+    many have joined, so a lone poll is sent right away.
+    """
+
+    def __init__(self, window: float, pollers: Optional[Callable[[], int]] = None):
+        self.window = window
+        self.pollers = pollers
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def get(self, task_id: str) -> Dict[str, Any]:
+        """Status of one task, fetched together with any other polls in the same window"""
+        if not ARK_STATUS_BATCH:
+            return client.get_task_status(task_id)
+        
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = {"ids": [], "full": threading.Event(), "done": threading.Event(), "results": {}}
+            batch["ids"].append(task_id)
+            if self.pollers and len(batch["ids"]) >= max(1, self.pollers()):
+                # 可能轮询的调用方都已加入，不必等满窗口
+                batch["full"].set()
+        
+        if leader:
+            batch["full"].wait(self.window)
+            with self._lock:
+                self._batch = None
+            try:
+                batch["results"] = client.get_tasks_status(batch["ids"])
+                METRICS.inc("ark_status_batches_total", help_text="Bulk status queries issued")
+                METRICS.inc("ark_status_batched_polls_total", len(batch["ids"]), help_text="Task polls answered by bulk status queries")
+            finally:
+                batch["done"].set()
+        else:
+            batch["done"].wait()
+        return batch["results"].get(task_id) or {"error": "Query failed: task missing from bulk status response"}
+
+
+# 每个在途任务的等待方至多同时发起一次查询
+STATUS_BATCHER = StatusBatcher(ARK_STATUS_BATCH_WINDOW, pollers=lambda: len(IN_FLIGHT.tasks()))
+
+
+class InFlightTask:
+    """An upstream task a handler is currently waiting on"""
+
+    def __init__(self, task_id: str, session_id: str, mode: str, model: str):
+        self.task_id = task_id
+        self.session_id = session_id
+        self.mode = mode
+        self.model = model
+        self.started_at = time.time()
+        self.cancelled = False
+        # Set by task updates and by cancellation so the waiter wakes immediately
+        self.wakeup = None
+        self.running_at = None
+        self.last_status = None
+        self.flight_released = False
+        self.archive = True
+
+
+class InFlightRegistry:
+    """Tracks in-flight tasks per browser session so they can be cancelled
+
+    Cancels are also remembered per session and tab, so a handler that is still waiting for a lane
+    or submitting when the cancel arrives (nothing to track yet) drops or cancels its task itself.
+    """
+
+    def __init__(self, cancel_retention: float = 86400):
+        self.cancel_retention = cancel_retention
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._cancel_requests = {}  # (session_id, mode or None for every tab) -> time of the latest cancel
+        self._local = threading.local()
+
+    def track(self, task: InFlightTask):
+        with self._lock:
+            self._tasks.append(task)
+
+    def untrack(self, task: InFlightTask):
+        with self._lock:
+            if task in self._tasks:
+                self._tasks.remove(task)
+
+    def tasks(self, session_id: Optional[str] = None, mode: Optional[str] = None) -> List[InFlightTask]:
+        with self._lock:
+            return [task for task in self._tasks
+                    if (session_id is None or task.session_id == session_id)
+                    and (mode is None or task.mode == mode)]
+
+    def request_cancel(self, session_id: str, mode: Optional[str] = None):
+        """Remember a cancel so the session's submissions still on their way upstream stop too"""
+        now = time.time()
+        with self._lock:
+            self._cancel_requests[(session_id, mode)] = now
+            self._cancel_requests = {key: at for key, at in self._cancel_requests.items()
+                                     if now - at < self.cancel_retention}
+
+    @contextmanager
+    def scope(self, scope: Optional[tuple]):
+        """Attribute submissions on this thread to a handler call: (session_id, mode, started_at)"""
+        previous = getattr(self._local, "scope", None)
+        self._local.scope = scope
+        try:
+            yield
+        finally:
+            self._local.scope = previous
+
+    def current_scope(self) -> Optional[tuple]:
+        return getattr(self._local, "scope", None)
+
+    def scope_cancelled(self) -> bool:
+        """True if the handler call on this thread was cancelled after it started"""
+        scope = self.current_scope()
+        if scope is None:
+            return False
+        session_id, mode, started_at = scope
+        with self._lock:
+            return any(self._cancel_requests.get((session_id, key), 0) >= started_at for key in (mode, None))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
+
+
+IN_FLIGHT = InFlightRegistry()
+METRICS.gauge("seedance_inflight_tasks", lambda: len(IN_FLIGHT), "Upstream tasks handlers are waiting on")
+
+
+def _session_id(request) -> str:
+    """Browser session identifier from a Gradio request"""
+    return getattr(request, "session_hash", None) or "anonymous"
+
+
+def _user_key(request) -> str:
+    """Owner of History rows and deferred jobs: the logged-in user, else the browser's id cookie, else the session"""
+    explicit = getattr(request, "user_key", None)
+    if explicit:
+        return explicit
+    username = getattr(request, "username", None)
+    if username:
+        return f"user:{username}"
+    cookies = getattr(request, "cookies", None) or {}
+    browser_id = cookies.get(SEEDANCE_USER_COOKIE)
+    if browser_id:
+        return f"browser:{browser_id}"
+    return f"session:{_session_id(request)}"
+
+
+def cancellable(mode: str):
+    """Scope a UI handler's submissions to its session and tab, so its Cancel button also stops tasks not yet created"""
+    def decorate(func):
+        signature = inspect.signature(func)
+        
+        def scope_of(args, kwargs) -> tuple:
+            request = signature.bind_partial(*args, **kwargs).arguments.get("request")
+            return _session_id(request), mode, time.time()
+        
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                scope = scope_of(args, kwargs)
+                iterator = func(*args, **kwargs)
+                while True:
+                    # Generator handlers resume on any worker thread
+                    with IN_FLIGHT.scope(scope):
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                    yield item
+            return generator_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with IN_FLIGHT.scope(scope_of(args, kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class ModelRouter:
+    """Routes the "Auto" model choice: Pro unless its recent queue time exceeds the SLO, then Lite"""
+
+    LITE_MODELS = {
+        "text_to_video": "Bytedance-Seedance-1.0-Lite-t2v",
+        "image_to_video": "Bytedance-Seedance-1.0-Lite-i2v",
+    }
+    PRO_MODEL = "Bytedance-Seedance-1.0-pro"
+
+    def __init__(self, slo: float, window: int = 20, max_age: float = 900):
+        self.slo = slo
+        self.max_age = max_age
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}  # model_id -> deque of (observed_at, queue_seconds)
+
+    def record_queue_time(self, model_id: str, seconds: float):
+        """Record how long a task waited upstream before it started running"""
+        with self._lock:
+            self._samples.setdefault(model_id, deque(maxlen=self.window)).append((time.time(), seconds))
+
+    def estimated_wait(self, model_id: str) -> float:
+        """p75 of recent queue times, or the age of the oldest task still queued if that is longer"""
+        now = time.time()
+        with self._lock:
+            recent = sorted(seconds for observed_at, seconds in self._samples.get(model_id, ())
+                            if now - observed_at <= self.max_age)
+        estimate = recent[int(0.75 * (len(recent) - 1))] if recent else 0.0
+        # 队列卡住时不会产生新样本，用仍在排队的任务等待时长兜底
+        queued = [now - task.started_at for task in IN_FLIGHT.tasks()
+                  if task.model == model_id and task.running_at is None]
+        return max([estimate] + queued)
+
+    def route(self, mode: str, resolution, duration, ratio):
+        """Pick a concrete model for "Auto"; returns (model_name, note)"""
+        lite = self.LITE_MODELS[mode]
+        pro_id = _model_id_for(mode, self.PRO_MODEL)
+        wait = self.estimated_wait(pro_id)
+        model = self.PRO_MODEL
+        if wait > self.slo:
+            if validate_generation_request(_model_id_for(mode, lite), mode, resolution, duration, ratio) is None:
+                model = lite
+                note = f"🧭 Auto: Pro queue ~{wait:.0f}s exceeds {self.slo:.0f}s SLO, routed to {lite}"
+            else:
+                note = f"🧭 Auto: Pro queue ~{wait:.0f}s but these parameters need Pro, using {model}"
+        else:
+            note = f"🧭 Auto: Pro queue ~{wait:.0f}s, using {model}"
+        METRICS.inc("seedance_router_decisions_total", mode=mode, model=model, help_text="Auto model routing decisions")
+        return model, note
+
+
+ROUTER = ModelRouter(SEEDANCE_ROUTER_QUEUE_SLO)
+METRICS.gauge(
+    "seedance_router_estimated_queue_seconds",
+    lambda: [({"model": model_id}, ROUTER.estimated_wait(model_id))
+             for model_id in (MODEL_SEEDANCE_PRO_API, MODEL_SEEDANCE_LITE_T2V_API, MODEL_SEEDANCE_LITE_I2V_API)],
+    "Estimated upstream queue time per model"
+)
+
+
+def resolve_model(mode: str, model: str, resolution, duration, ratio):
+    """Resolve the "Auto" choice to a concrete model; returns (model_name, routing note or "")"""
+    if model != AUTO_MODEL:
+        return model, ""
+    return ROUTER.route(mode, resolution, duration, ratio)
+
+
+def cancel_tasks(tasks: List[InFlightTask]) -> List[str]:
+    """Cancel tasks upstream and wake their handlers; returns status lines"""
+    lines = []
+    for task in tasks:
+        task.cancelled = True
+        if task.wakeup is not None:
+            task.wakeup.set()
+        if not SINGLE_FLIGHT.release(task.task_id, task):
+            # Other callers are attached to the same upstream task; only this one stops waiting
+            lines.append(f"⏹️ Stopped waiting on shared task {task.task_id} (still running for other requests)")
+            METRICS.inc("seedance_cancellations_total", mode=task.mode, help_text="Generations cancelled by users or disconnects")
+            continue
+        result = client.cancel_task(task.task_id) if client else {"error": "client not initialized"}
+        LANES.finish(task.task_id)
+        if "error" in result:
+            lines.append(f"⚠️ Task {task.task_id}: {result['error']}")
+        else:
+            lines.append(f"⏹️ Task {task.task_id} cancelled")
+        METRICS.inc("seedance_cancellations_total", mode=task.mode, help_text="Generations cancelled by users or disconnects")
+    return lines
+
+
+def extract_video_url(status_result: Dict[str, Any]) -> Optional[str]:
+    """Get video URL - try multiple possible response formats"""
+    video_url = None
+    
+    # Format 1: Check content.video_url (BytePlus API format)
+    if "content" in status_result and isinstance(status_result["content"], dict):
+        video_url = status_result["content"].get("video_url")
+    
+    # Format 2: Check data array
+    if not video_url and "data" in status_result and status_result["data"]:
+        for item in status_result["data"]:
+            if item.get("type") == "video_url":
+                video_url = item.get("url")
+                break
+    
+    # Format 3: Check direct video_url field
+    if not video_url and "video_url" in status_result:
+        video_url = status_result["video_url"]
+    
+    # Format 4: Check result field
+    if not video_url and "result" in status_result:
+        result = status_result["result"]
+        if isinstance(result, dict):
+            video_url = result.get("video_url") or result.get("url")
+        elif isinstance(result, list) and result:
+            for item in result:
+                if isinstance(item, dict) and ("video_url" in item or "url" in item):
+                    video_url = item.get("video_url") or item.get("url")
+                    break
+    
+    # Format 5: Check outputs field
+    if not video_url and "outputs" in status_result:
+        outputs = status_result["outputs"]
+        if isinstance(outputs, list) and outputs:
+            for item in outputs:
+                if isinstance(item, dict) and ("video_url" in item or "url" in item):
+                    video_url = item.get("video_url") or item.get("url")
+                    break
+    
+    return video_url
+
+
+def download_video(video_url: str, dest_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Stream a generated video to disk without holding it in memory"""
+    ACTIVITY.phase("downloading")
+    return postprocess.download(video_url, dest_path, chunk_size)
+
+
+def run_ffmpeg(args: List[str], timeout: int = 120):
+    """Run the local ffmpeg quietly; raises RuntimeError with the stderr tail on failure"""
+    ACTIVITY.phase("ffmpeg")
+    postprocess.run_ffmpeg(FFMPEG_BINARY, args, timeout)
+
+
+def extract_last_frame(source: str, dest_path: str) -> str:
+    """Decode only the final frame of a video (local path or HTTP URL) into a JPEG"""
+    # -sseof seeks near the end (HTTP range requests for URLs), -update keeps overwriting
+    # the output so only the very last decoded frame remains
+    run_ffmpeg(["-sseof", "-1", "-i", source, "-update", "1", "-q:v", "2", dest_path])
+    if not os.path.exists(dest_path):
+        raise RuntimeError("ffmpeg produced no frame")
+    return dest_path
+
+
+def concat_videos(clip_paths: List[str], dest_path: str) -> str:
+    """Concatenate same-codec clips without re-encoding"""
+    list_path = dest_path + ".txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for clip_path in clip_paths:
+            escaped = clip_path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", "-movflags", "+faststart", dest_path])
+    finally:
+        os.unlink(list_path)
+    return dest_path
+
+
+def postprocess_available(setting: str) -> bool:
+    """Whether post-processing runs: "auto" needs a local ffmpeg, "true" warns and turns off without one"""
+    if setting not in ("true", "auto"):
+        return False
+    if shutil.which(FFMPEG_BINARY):
+        return True
+    if setting == "true":
+        _log(f"⚠️ SEEDANCE_POSTPROCESS=true but ffmpeg was not found ({FFMPEG_BINARY}); post-processing disabled")
+    return False
+
+
+class PostProcessor:
+    """Bounded worker pool that post-processes finished videos off the request path
+
+    Each job runs in its own low-priority `python postprocess.py` process, which imports only
+    that small module. Outputs live in one directory per task under output_dir; the oldest are deleted once they
+    exceed max_bytes in total or are older than max_age.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 16, output_dir: str = SEEDANCE_POSTPROCESS_DIR,
+                 transcode: bool = False, enabled: bool = True, max_bytes: int = 2048 * 1024 * 1024,
+                 max_age: float = 7 * 86400, job_timeout: float = 900):
+        self.workers = workers
+        self.output_dir = output_dir
+        self.transcode = transcode
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.job_timeout = job_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        # Recently submitted task IDs, so callers sharing one task don't process it twice
+        self._seen = {}
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        # 延迟创建；线程只负责等待各自的工作进程，并发上限即 workers
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="postprocess")
+            return self._pool
+
+    def _run_job(self, task_id: str, video_url: str) -> Dict[str, str]:
+        """Run one job in a fresh worker process; raises RuntimeError with its error output on failure"""
+        job = {"task_id": task_id, "video_url": video_url, "output_dir": self.output_dir, "ffmpeg": FFMPEG_BINARY,
+               "transcode": self.transcode, "preview_bitrate": SEEDANCE_PREVIEW_BITRATE}
+        try:
+            completed = subprocess.run([sys.executable, postprocess.__file__], input=json.dumps(job).encode(),
+                                       capture_output=True, timeout=self.job_timeout)
+        except subprocess.TimeoutExpired as e:
+            shutil.rmtree(os.path.join(self.output_dir, task_id), ignore_errors=True)
+            raise RuntimeError(f"post-processing timed out after {self.job_timeout:.0f}s") from e
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.decode(errors="replace").strip()[-500:] or f"exit code {completed.returncode}")
+        return json.loads(completed.stdout)
+
+    def submit(self, task_id: str, video_url: str, on_done=None):
+        """Queue a job; returns its Future, or None when disabled or the queue is full"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if task_id in self._seen:
+                return self._seen[task_id]
+            self._seen[task_id] = None
+        
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._seen.pop(task_id, None)
+            METRICS.inc("seedance_postprocess_jobs_total", outcome="dropped", help_text="Post-processing jobs by outcome")
+            _log(f"⚠️ Post-processing queue full, skipping task {task_id}")
+            return None
+        
+        with self._lock:
+            self._pending += 1
+        
+        def finished(future):
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            error = future.exception()
+            if error:
+                METRICS.inc("seedance_postprocess_jobs_total", outcome="failed", help_text="Post-processing jobs by outcome")
+                _log(f"❌ Post-processing failed for task {task_id}: {error}")
+                return
+            METRICS.inc("seedance_postprocess_jobs_total", outcome="ok", help_text="Post-processing jobs by outcome")
+            if on_done:
+                on_done(task_id, future.result())
+            self.sweep()
+        
+        try:
+            future = self._get_pool().submit(self._run_job, task_id, video_url)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                self._seen.pop(task_id, None)
+            self._slots.release()
+            raise
+        with self._lock:
+            self._seen[task_id] = future
+            while len(self._seen) > 1024:
+                del self._seen[next(iter(self._seen))]
+        future.add_done_callback(finished)
+        return future
+
+    def sweep(self) -> List[str]:
+        """Delete the oldest task outputs past max_age or beyond max_bytes; returns the task IDs removed"""
+        with self._lock:
+            busy = {task_id for task_id, future in self._seen.items() if future is None or not future.done()}
+        entries = []
+        try:
+            names = os.listdir(self.output_dir)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            path = os.path.join(self.output_dir, name)
+            if name in busy or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                entries.append((os.path.getmtime(path), size, name, path))
+            except OSError:
+                continue
+        
+        entries.sort()
+        total = sum(size for _, size, _, _ in entries)
+        now = time.time()
+        removed = []
+        for modified_at, size, name, path in entries:
+            if total <= self.max_bytes and now - modified_at <= self.max_age:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed.append(name)
+        if removed:
+            METRICS.inc("seedance_postprocess_evicted_total", len(removed), help_text="Post-processed task outputs deleted by retention")
+            _log(f"🧹 Removed post-processed outputs of {len(removed)} task(s) (retention)")
+        return removed
+
+
+POSTPROCESSOR = PostProcessor(
+    workers=SEEDANCE_POSTPROCESS_WORKERS,
+    max_pending=SEEDANCE_POSTPROCESS_MAX_PENDING,
+    transcode=SEEDANCE_POSTPROCESS_TRANSCODE,
+    enabled=postprocess_available(SEEDANCE_POSTPROCESS),
+    max_bytes=SEEDANCE_POSTPROCESS_MAX_MB * 1024 * 1024,
+    max_age=SEEDANCE_POSTPROCESS_MAX_AGE
+)
+METRICS.gauge("seedance_postprocess_pending", lambda: POSTPROCESSOR.pending, "Post-processing jobs queued or running")
+
+
+class HistoryStore:
+    """SQLite generation history with keyset pagination and full-text prompt search"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS generations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_id TEXT NOT NULL,
+        session_id TEXT,
+        mode TEXT,
+        model TEXT,
+        prompt TEXT,
+        params TEXT,
+        status TEXT,
+        created_at REAL,
+        finished_at REAL,
+        queue_seconds REAL,
+        render_seconds REAL,
+        video_url TEXT,
+        video_path TEXT,
+        poster_path TEXT,
+        preview_path TEXT,
+        error TEXT,
+        user_key TEXT,
+        UNIQUE (task_id, user_key)
+    );
+    CREATE INDEX IF NOT EXISTS idx_generations_mode_id ON generations(mode, id);
+    CREATE INDEX IF NOT EXISTS idx_generations_created_at ON generations(created_at);
+    """
+
+    FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(prompt, content='generations', content_rowid='id');
+    CREATE TRIGGER IF NOT EXISTS generations_ai AFTER INSERT ON generations BEGIN
+        INSERT INTO generations_fts(rowid, prompt) VALUES (new.id, new.prompt);
+    END;
+    CREATE TRIGGER IF NOT EXISTS generations_ad AFTER DELETE ON generations BEGIN
+        INSERT INTO generations_fts(generations_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+    END;
+    CREATE TRIGGER IF NOT EXISTS generations_au AFTER UPDATE OF prompt ON generations BEGIN
+        INSERT INTO generations_fts(generations_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+        INSERT INTO generations_fts(rowid, prompt) VALUES (new.id, new.prompt);
+    END;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.fts = True
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        # 旧库没有 user_key 列：补上，此前的记录不属于任何用户，共享模式之外不再显示
+        if "user_key" not in {row["name"] for row in conn.execute("PRAGMA table_info(generations)")}:
+            conn.execute("ALTER TABLE generations ADD COLUMN user_key TEXT")
+        self._migrate_unique_key(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_user_id ON generations(user_key, id)")
+        try:
+            conn.executescript(self.FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: fall back to LIKE search
+            self.fts = False
+
+    def _migrate_unique_key(self, conn: sqlite3.Connection):
+        """Rebuild a table keyed on task_id alone, so a task shared by several users gets one row per user"""
+        unique_columns = [
+            [column["name"] for column in conn.execute(f"PRAGMA index_info('{index['name']}')")]
+            for index in conn.execute("PRAGMA index_list(generations)") if index["unique"]
+        ]
+        if ["task_id"] not in unique_columns:
+            return
+        columns = ", ".join(row["name"] for row in conn.execute("PRAGMA table_info(generations)"))
+        # 保留行 id，全文索引 (content_rowid) 无需重建；触发器随旧表删除，稍后重新创建
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("ALTER TABLE generations RENAME TO generations_unique_task")
+            # executescript 会先提交当前事务，这里只单独执行建表语句 (SCHEMA 的第一条)
+            conn.execute(self.SCHEMA.split(";")[0])
+            conn.execute(f"INSERT INTO generations ({columns}) SELECT {columns} FROM generations_unique_task")
+            conn.execute("DROP TABLE generations_unique_task")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # 每个线程一个连接，WAL 模式允许读写并发
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql: str, args=()):
+        # 历史记录写入失败不能影响视频生成
+        try:
+            self._conn().execute(sql, args)
+        except sqlite3.Error as e:
+            _log(f"⚠️ History write failed: {e}")
+
+    def record_start(self, task_id: str, session_id: str, mode: str, model: str, prompt: str, params: Dict[str, Any],
+                     user_key: Optional[str] = None):
+        self._execute(
+            "INSERT OR IGNORE INTO generations (task_id, session_id, mode, model, prompt, params, status, created_at, user_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (task_id, session_id, mode, model, prompt or "", json.dumps(params, ensure_ascii=False), time.time(), user_key)
+        )
+
+    def record_finish(self, task_id: str, status: str, video_url: str = None, error: str = None,
+                      queue_seconds: float = None, render_seconds: float = None, user_key: Optional[str] = None):
+        """Record the outcome on one user's row, or with user_key None on every row still waiting on the task"""
+        self._execute(
+            "UPDATE generations SET status = ?, finished_at = ?, video_url = ?, error = ?, "
+            "queue_seconds = ?, render_seconds = ? WHERE task_id = ? AND "
+            "(user_key = ? OR (? IS NULL AND status IN ('queued', 'interrupted')))",
+            (status, time.time(), video_url, error, queue_seconds, render_seconds, task_id, user_key, user_key)
+        )
+
+    def attach_outputs(self, task_id: str, outputs: Dict[str, str]):
+        """Store local file paths produced by post-processing"""
+        self._execute(
+            "UPDATE generations SET video_path = ?, poster_path = ?, preview_path = ? WHERE task_id = ?",
+            (outputs.get("video"), outputs.get("poster"), outputs.get("preview"), task_id)
+        )
+
+    def page(self, user_key: Optional[str], before_id: Optional[int] = None, limit: int = 24, query: str = "",
+             mode: str = None) -> List[Dict[str, Any]]:
+        """One page of a user's history, newest first; pass the last row's id as before_id for the next page
+
+        user_key None lists every user's rows (SEEDANCE_HISTORY_SHARED).
+        """
+        clauses = []
+        args = []
+        if user_key is not None:
+            clauses.append("g.user_key = ?")
+            args.append(user_key)
+        if before_id:
+            clauses.append("g.id < ?")
+            args.append(before_id)
+        if mode:
+            clauses.append("g.mode = ?")
+            args.append(mode)
+        
+        query = (query or "").strip()
+        if query and self.fts:
+            # 每个词作为短语匹配，避免用户输入被解析为 FTS 语法
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+            sql = "SELECT g.* FROM generations_fts f JOIN generations g ON g.id = f.rowid WHERE generations_fts MATCH ?"
+            args.insert(0, match)
+        else:
+            sql = "SELECT g.* FROM generations g WHERE 1 = 1"
+            if query:
+                clauses.append("g.prompt LIKE ?")
+                args.append(f"%{query}%")
+        
+        for clause in clauses:
+            sql += f" AND {clause}"
+        sql += " ORDER BY g.id DESC LIMIT ?"
+        args.append(limit)
+        
+        try:
+            rows = self._conn().execute(sql, args).fetchall()
+        except sqlite3.Error as e:
+            _log(f"⚠️ History query failed: {e}")
+            return []
+        return [dict(row) for row in rows]
+
+    def recent_timings(self, limit: int) -> List[Dict[str, Any]]:
+        """Queue/render times of the latest successful generations, newest first"""
+        try:
+            rows = self._conn().execute(
+                "SELECT model, mode, params, queue_seconds, render_seconds FROM generations "
+                "WHERE status = 'succeeded' AND render_seconds IS NOT NULL ORDER BY id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            _log(f"⚠️ History query failed: {e}")
+            return []
+        return [dict(row) for row in rows]
+
+    def mark_interrupted(self, task_ids: List[str]):
+        """Flag unfinished tasks left behind by a shutdown so the next start can resume them"""
+        for task_id in task_ids:
+            self._execute("UPDATE generations SET status = 'interrupted' WHERE task_id = ? AND status = 'queued'", (task_id,))
+    
+    def claim_interrupted(self, max_age: float) -> List[Dict[str, Any]]:
+        """Take over interrupted tasks younger than max_age; each task is claimed by one process only
+
+        A task shared by several users is returned once; finishing it updates every user's waiting row.
+        """
+        try:
+            rows = self._conn().execute(
+                "SELECT * FROM generations WHERE status = 'interrupted' AND created_at >= ? ORDER BY id",
+                (time.time() - max_age,)
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                cursor = self._conn().execute(
+                    "UPDATE generations SET status = 'queued' WHERE task_id = ? AND status = 'interrupted'",
+                    (row["task_id"],)
+                )
+                if cursor.rowcount >= 1:
+                    claimed.append(dict(row))
+        except sqlite3.Error as e:
+            _log(f"⚠️ History query failed: {e}")
+            return []
+        return claimed
+    
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM generations WHERE task_id = ?", (task_id,)).fetchone()
+        return dict(row) if row else None
+
+
+HISTORY = HistoryStore(SEEDANCE_HISTORY_DB)
+
+
+class UsageLedger:
+    """Token usage reported by ARK for each finished task, aggregated for metrics, the usage view and soft limits"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS usage (
+        task_id TEXT PRIMARY KEY,
+        session_id TEXT,
+        mode TEXT,
+        model TEXT,
+        resolution TEXT,
+        duration INTEGER,
+        completion_tokens INTEGER,
+        total_tokens INTEGER,
+        recorded_at REAL,
+        user_key TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_usage_recorded_at ON usage(recorded_at);
+    CREATE INDEX IF NOT EXISTS idx_usage_session ON usage(session_id, recorded_at);
+    """
+
+    def __init__(self, path: str, prices: Dict[str, float], window: float, soft_limit: int,
+                 throttle_seconds: float, throttle_max: float):
+        self.path = path
+        self.prices = prices
+        self.window = window
+        self.soft_limit = soft_limit
+        self.throttle_seconds = throttle_seconds
+        self.throttle_max = throttle_max
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        # 软限制按用户计算 (会话在刷新页面后就会变化)；旧库补上 user_key 列
+        if "user_key" not in {row["name"] for row in conn.execute("PRAGMA table_info(usage)")}:
+            conn.execute("ALTER TABLE usage ADD COLUMN user_key TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_user ON usage(user_key, recorded_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _query(self, sql: str, args=()) -> List[Dict[str, Any]]:
+        try:
+            return [dict(row) for row in self._conn().execute(sql, args).fetchall()]
+        except sqlite3.Error as e:
+            _log(f"⚠️ Usage query failed: {e}")
+            return []
+
+    def record(self, task_id: str, session_id: str, mode: str, model: str, resolution, duration,
+               usage: Optional[Dict[str, Any]], user_key: Optional[str] = None):
+        """Store a finished task's usage once, however many handlers waited on it, charged to user_key"""
+        if not usage:
+            return
+        total = int(usage.get("total_tokens") or 0)
+        completion = int(usage.get("completion_tokens") or total)
+        try:
+            inserted = self._conn().execute(
+                "INSERT OR IGNORE INTO usage (task_id, session_id, mode, model, resolution, duration, "
+                "completion_tokens, total_tokens, recorded_at, user_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (task_id, session_id, mode, model, str(resolution or ""), int(duration or 0), completion, total, time.time(),
+                 user_key)
+            ).rowcount
+        except sqlite3.Error as e:
+            _log(f"⚠️ Usage write failed: {e}")
+            return
+        if inserted:
+            # 会话不作为指标标签，避免时间序列数量无限增长；按会话的数据见汇总视图
+            labels = {"model": model, "resolution": str(resolution or ""), "duration": str(duration or "")}
+            METRICS.inc("seedance_usage_tokens_total", total, help_text="Tokens consumed by finished tasks", **labels)
+            METRICS.inc("seedance_usage_tasks_total", help_text="Finished tasks that reported usage", **labels)
+
+    def user_tokens(self, user_key: str) -> int:
+        """Tokens a user consumed within the soft-limit window, deferred jobs included"""
+        rows = self._query("SELECT COALESCE(SUM(total_tokens), 0) AS tokens FROM usage WHERE user_key = ? AND recorded_at >= ?",
+                           (user_key, time.time() - self.window))
+        return rows[0]["tokens"] if rows else 0
+
+    def throttle_delay(self, user_key: str) -> tuple:
+        """(seconds to hold the user's next submission, tokens used in the window); no delay below the soft limit"""
+        if self.soft_limit <= 0:
+            return 0.0, 0
+        used = self.user_tokens(user_key)
+        if used < self.soft_limit:
+            return 0.0, used
+        return min(self.throttle_max, self.throttle_seconds * used / self.soft_limit), used
+
+    def cost(self, model: str, tokens: int) -> Optional[float]:
+        price = self.prices.get(model)
+        return None if price is None else tokens / 1_000_000 * price
+
+    def summary(self, hours: Optional[float] = None, top_sessions: int = 10) -> Dict[str, Any]:
+        """Usage totals per model/resolution/duration and the heaviest users and sessions, optionally for the last N hours
+
+        For operators only (/admin/usage): it names other users.
+        """
+        since = time.time() - hours * 3600 if hours else 0
+        summary = self.user_summary(None, hours)
+        summary["top_users"] = self._query(
+            "SELECT user_key, COUNT(*) AS tasks, SUM(total_tokens) AS tokens, MAX(recorded_at) AS last_at "
+            "FROM usage WHERE recorded_at >= ? GROUP BY user_key ORDER BY tokens DESC LIMIT ?",
+            (since, top_sessions)
+        )
+        summary["top_sessions"] = self._query(
+            "SELECT session_id, user_key, COUNT(*) AS tasks, SUM(total_tokens) AS tokens, MAX(recorded_at) AS last_at "
+            "FROM usage WHERE recorded_at >= ? GROUP BY session_id ORDER BY tokens DESC LIMIT ?",
+            (since, top_sessions)
+        )
+        return summary
+
+    def user_summary(self, user_key: Optional[str], hours: Optional[float] = None) -> Dict[str, Any]:
+        """Usage totals per model/resolution/duration of one user (everyone with None), optionally for the last N hours"""
+        since = time.time() - hours * 3600 if hours else 0
+        where, args = "recorded_at >= ?", [since]
+        if user_key is not None:
+            where += " AND user_key = ?"
+            args.append(user_key)
+        groups = self._query(
+            "SELECT model, resolution, duration, COUNT(*) AS tasks, SUM(total_tokens) AS tokens, "
+            f"AVG(total_tokens) AS avg_tokens FROM usage WHERE {where} "
+            "GROUP BY model, resolution, duration ORDER BY tokens DESC",
+            args
+        )
+        for group in groups:
+            group["cost"] = self.cost(group["model"], group["tokens"])
+        costs = [group["cost"] for group in groups if group["cost"] is not None]
+        return {
+            "since": since or None,
+            "tasks": sum(group["tasks"] for group in groups),
+            "tokens": sum(group["tokens"] for group in groups),
+            "cost": sum(costs) if costs else None,
+            "by_model": groups
+        }
+
+
+USAGE = UsageLedger(
+    SEEDANCE_USAGE_DB,
+    prices=_parse_model_map(SEEDANCE_USAGE_PRICES, float),
+    window=SEEDANCE_USAGE_WINDOW,
+    soft_limit=SEEDANCE_USAGE_SOFT_LIMIT,
+    throttle_seconds=SEEDANCE_USAGE_THROTTLE_SECONDS,
+    throttle_max=SEEDANCE_USAGE_THROTTLE_MAX
+)
+
+
+def usage_soft_limit(func):
+    """Hold a UI handler's submissions while its user is over the usage soft limit (queued jobs are not held, but count)"""
+    signature = inspect.signature(func)
+    
+    def throttle(args, kwargs):
+        arguments = signature.bind_partial(*args, **kwargs).arguments
+        if USAGE.soft_limit <= 0 or arguments.get("deferred"):
+            return
+        delay, used = USAGE.throttle_delay(_user_key(arguments.get("request")))
+        if delay <= 0:
+            return
+        METRICS.inc("seedance_usage_throttled_total", handler=func.__name__, help_text="Submissions held by the usage soft limit")
+        METRICS.inc("seedance_usage_throttle_seconds_total", delay, help_text="Time submissions were held by the usage soft limit")
+        ACTIVITY.phase("usage_throttle")
+        progress = arguments.get("progress")
+        if callable(progress):
+            progress(0, desc=f"⏳ Heavy usage ({used:,} tokens in the last {USAGE.window / 60:.0f} min, soft limit "
+                             f"{USAGE.soft_limit:,}): starting in {delay:.0f}s")
+        time.sleep(delay)
+    
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            throttle(args, kwargs)
+            yield from func(*args, **kwargs)
+        return generator_wrapper
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        throttle(args, kwargs)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class RollingQuantiles:
+    """Quantiles over the most recent N samples of a stream"""
+
+    def __init__(self, window: int):
+        self._samples = deque(maxlen=window)
+
+    def add(self, value: float):
+        self._samples.append(value)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class TimingStats:
+    """Queue/render time quantiles per (model, resolution, duration, mode), for ETAs and deadlines
+
+    Lookups fall back to coarser keys (model and mode, then model alone) until enough samples exist.
+    """
+
+    MIN_SAMPLES = 3
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {}  # key -> {"queue": RollingQuantiles, "render": RollingQuantiles}
+
+    @staticmethod
+    def _keys(model: str, resolution, duration, mode: str):
+        return [(model, resolution, int(duration) if duration else None, mode), (model, mode), (model,)]
+
+    def record(self, model: str, resolution, duration, mode: str, queue_seconds: float, render_seconds: float):
+        with self._lock:
+            for key in self._keys(model, resolution, duration, mode):
+                stats = self._stats.get(key)
+                if stats is None:
+                    stats = self._stats[key] = {"queue": RollingQuantiles(self.window), "render": RollingQuantiles(self.window)}
+                stats["queue"].add(queue_seconds)
+                stats["render"].add(render_seconds)
+
+    def estimate(self, model: str, resolution, duration, mode: str) -> Optional[Dict[str, float]]:
+        """p50/p95 queue and render seconds, or None without enough history"""
+        with self._lock:
+            for key in self._keys(model, resolution, duration, mode):
+                stats = self._stats.get(key)
+                if stats and len(stats["render"]) >= self.MIN_SAMPLES:
+                    return {
+                        "queue_p50": stats["queue"].quantile(0.5),
+                        "queue_p95": stats["queue"].quantile(0.95),
+                        "render_p50": stats["render"].quantile(0.5),
+                        "render_p95": stats["render"].quantile(0.95),
+                    }
+        return None
+
+    def deadline(self, estimate: Optional[Dict[str, float]]) -> float:
+        """Per-job timeout: a margin over the p95 total time, never below the old fixed limit"""
+        if not estimate:
+            return SEEDANCE_MIN_WAIT
+        expected = (estimate["queue_p95"] + estimate["render_p95"]) * SEEDANCE_DEADLINE_FACTOR
+        return min(max(expected, SEEDANCE_MIN_WAIT), SEEDANCE_MAX_WAIT)
+
+    def warm_start(self, history: "HistoryStore", limit: int = 2000):
+        """Seed the statistics from finished generations in the history store"""
+        for row in reversed(history.recent_timings(limit)):
+            try:
+                params = json.loads(row["params"] or "{}")
+            except ValueError:
+                params = {}
+            self.record(row["model"], params.get("resolution"), params.get("duration"), row["mode"],
+                        row["queue_seconds"], row["render_seconds"])
+
+
+ETA_STATS = TimingStats(SEEDANCE_ETA_WINDOW)
+ETA_STATS.warm_start(HISTORY)
+
+
+def _eta_progress(task: InFlightTask, eta: Optional[Dict[str, float]], status: str, max_wait: float):
+    """Progress fraction and description for a pending task, using ETA statistics when available"""
+    now = time.time()
+    elapsed = now - task.started_at
+    if not eta:
+        return min(0.3 + elapsed / max_wait * 0.6, 0.9), f"Generating video... (Status: {status})"
+    if task.running_at is None:
+        left = max(eta["queue_p50"] - elapsed, 0) + eta["render_p50"]
+        fraction = 0.3 + 0.2 * min(elapsed / max(eta["queue_p50"], 1), 1)
+        return fraction, f"Queued upstream... ETA ~{left:.0f}s"
+    rendering = now - task.running_at
+    left = eta["render_p50"] - rendering
+    fraction = 0.5 + 0.45 * min(rendering / max(eta["render_p50"], 1), 1)
+    if left > 0:
+        return fraction, f"Rendering... ~{left:.0f}s left"
+    return fraction, "Rendering... taking longer than usual"
+
+
+def _next_poll_interval(task: InFlightTask, eta: Optional[Dict[str, float]]) -> float:
+    """Seconds until the next status poll"""
+    now = time.time()
+    # 启用回调时放慢轮询，仅作兜底
+    if client.callback_url:
+        interval = ARK_CALLBACK_SAFETY_POLL_INTERVAL
+    elif not eta:
+        interval = 3
+    else:
+        # 距离预计完成还早时少轮询，临近时加密
+        if task.running_at is None:
+            remaining = task.started_at + eta["queue_p50"] - now
+        else:
+            remaining = task.running_at + eta["render_p50"] - now
+        interval = min(max(remaining / 2, 2), 15)
+    # 对齐到整秒，让并发任务的轮询落进同一个批量查询
+    return math.ceil(now + interval) - now
+
+
+def _shared_status(task_id: str, max_age: float) -> Optional[Dict[str, Any]]:
+    """A status another worker stored recently enough that our own poll can be skipped"""
+    if not STATE.shared:
+        return None
+    latest = TASK_HUB.latest(task_id)
+    if latest is None:
+        return None
+    received_at, payload = latest
+    if payload.get("status") in ("succeeded", "failed", "cancelled") or time.time() - received_at < max_age:
+        return payload
+    return None
+
+
+def _poll_until_done(task: InFlightTask, progress, max_wait: float, eta: Optional[Dict[str, float]] = None):
+    """Wait on callbacks/polls until the task settles; returns (status, video_url, error_message)"""
+    task_id = task.task_id
+    start_time = task.started_at
+    
+    # The callback may already have arrived before we subscribed
+    status_result = TASK_HUB.result(task_id)
+    
+    while time.time() - start_time < max_wait:
+        if task.cancelled:
+            return "cancelled", None, f"⏹️ Generation cancelled\nTask ID: {task_id}"
+        
+        if status_result is None:
+            status_result = STATUS_BATCHER.get(task_id)
+            
+            if "error" in status_result:
+                return "error", None, f"❌ Status query failed: {status_result['error']}"
+            if STATE.shared:
+                # 让其它进程中等待同一任务的处理函数直接复用本次查询结果
+                TASK_HUB.publish(task_id, status_result)
+                task.wakeup.clear()
+        
+        task.last_status = status_result
+        status = status_result.get("status", "")
+        ACTIVITY.phase(f"upstream_{status or 'unknown'}", task_id)
+        
+        if status == "running" and task.running_at is None:
+            task.running_at = time.time()
+        
+        if status == "succeeded":
+            progress(0.95, desc="Video generation completed, retrieving results...")
+            
+            video_url = extract_video_url(status_result)
+            if video_url:
+                progress(1.0, desc="✅ Video generation successful!")
+                # 直接返回视频URL，不下载到本地
+                return status, video_url, None
+            else:
+                return "error", None, f"❌ Generated video URL not found\nTask ID: {task_id}"
+                
+        elif status == "failed":
+            error_msg = status_result.get("error", "Unknown error")
+            return status, None, f"❌ Video generation failed: {error_msg}\nTask ID: {task_id}"
+            
+        elif status in ["queued", "running"]:
+            progress_val, desc = _eta_progress(task, eta, status, max_wait)
+            progress(progress_val, desc=desc)
+            remaining = max_wait - (time.time() - start_time)
+            interval = _next_poll_interval(task, eta)
+            notified = task.wakeup.wait(max(0, min(interval, remaining)))
+            task.wakeup.clear()
+            status_result = TASK_HUB.result(task_id) if notified else _shared_status(task_id, interval / 2)
+        elif status == "cancelled":
+            return status, None, f"⏹️ Generation cancelled\nTask ID: {task_id}"
+        else:
+            return "error", None, f"❌ Unknown status: {status}\nTask ID: {task_id}"
+    
+    return "timeout", None, f"❌ Video generation timeout after {max_wait:.0f}s\nTask ID: {task_id}"
+
+
+def wait_for_video(task_id: str, progress, max_wait: Optional[float] = None, request=None, mode: str = "", model: str = "",
+                   prompt: str = "", params: Optional[Dict[str, Any]] = None, archive: bool = True,
+                   started_at: Optional[float] = None):
+    """Wait for a task to finish via callback or polling; returns (video_url, error_message)
+
+    Without max_wait the deadline adapts to historical timings for this model and parameters.
+    With archive=True the task is recorded in the history store and its video is post-processed.
+    started_at backdates the task when resuming one created before a restart.
+    """
+    params = params or {}
+    eta = ETA_STATS.estimate(model, params.get("resolution"), params.get("duration"), mode)
+    if max_wait is None:
+        max_wait = ETA_STATS.deadline(eta)
+    task = InFlightTask(task_id, _session_id(request), mode, model)
+    task.archive = archive
+    if started_at:
+        task.started_at = started_at
+    task.wakeup = TASK_HUB.subscribe(task_id)
+    IN_FLIGHT.track(task)
+    if IN_FLIGHT.scope_cancelled():
+        # 取消请求在任务创建之后、开始等待之前到达
+        cancel_tasks([task])
+    if archive:
+        HISTORY.record_start(task_id, task.session_id, mode, model, prompt, params, _user_key(request))
+    
+    try:
+        status, video_url, error_message = _poll_until_done(task, progress, max_wait, eta)
+        finished_at = time.time()
+        running_at = task.running_at
+        if running_at:
+            ROUTER.record_queue_time(model, running_at - task.started_at)
+            if status == "succeeded":
+                ETA_STATS.record(model, params.get("resolution"), params.get("duration"), mode,
+                                 running_at - task.started_at, finished_at - running_at)
+        if status == "succeeded" and task.last_status:
+            USAGE.record(task_id, task.session_id, mode, model, params.get("resolution"), params.get("duration"),
+                         task.last_status.get("usage"), _user_key(request))
+        # A local cancel also reports "cancelled"; only an upstream final status settles the shared task
+        settled = status in ("succeeded", "failed", "cancelled") and not task.cancelled
+        if settled:
+            SINGLE_FLIGHT.complete(task_id)
+            LANES.finish(task_id)
+    except Exception as e:
+        # 不要让记录停在 queued；停机时的中断 (非 Exception) 仍留给 record_leftovers 标记恢复
+        if archive:
+            HISTORY.record_finish(task_id, "error", error=f"❌ Waiting for the video failed: {e}\nTask ID: {task_id}",
+                                  user_key=_user_key(request))
+        raise
+    finally:
+        IN_FLIGHT.untrack(task)
+        TASK_HUB.unsubscribe(task_id, task.wakeup)
+        if SINGLE_FLIGHT.release(task_id, task):
+            LANES.finish(task_id)
+    
+    if archive:
+        HISTORY.record_finish(
+            task_id,
+            status,
+            video_url=video_url,
+            error=error_message,
+            queue_seconds=(running_at - task.started_at) if running_at else None,
+            render_seconds=(finished_at - running_at) if running_at else None,
+            # 上游的最终状态也是其他仍在等待的用户的结果；本地取消或超时只影响当前用户自己的记录
+            user_key=None if settled else _user_key(request)
+        )
+        if video_url:
+            POSTPROCESSOR.submit(task_id, video_url, on_done=HISTORY.attach_outputs)
+    
+    return video_url, error_message
+
+
+def cancel_generation(request, mode: Optional[str] = None) -> str:
+    """Cancel the calling session's in-flight generations (optionally only one tab's)"""
+    session_id = _session_id(request)
+    IN_FLIGHT.request_cancel(session_id, mode)
+    tasks = IN_FLIGHT.tasks(session_id=session_id, mode=mode)
+    if not tasks:
+        return "⏹️ Cancelled (no upstream task was running yet; pending submissions are dropped)"
+    return "\n".join(cancel_tasks(tasks))
+
+
+def make_cancel_handler(mode: str):
+    """Cancel button handler bound to one tab"""
+    def cancel(request: gr.Request):
+        return cancel_generation(request, mode)
+    return cancel
+
+
+def cancel_session_on_disconnect(request: gr.Request):
+    """Free upstream slots when the browser session goes away"""
+    if LIFECYCLE.draining:
+        # 停机时连接断开不是用户离开；任务留给重启后恢复
+        return
+    session_id = _session_id(request)
+    IN_FLIGHT.request_cancel(session_id)
+    tasks = IN_FLIGHT.tasks(session_id=session_id)
+    if tasks:
+        _log(f"⏹️ Session disconnected, cancelling {len(tasks)} task(s)")
+        cancel_tasks(tasks)
+
+
+class ServiceLifecycle:
+    """Readiness for load balancers and graceful drain on SIGTERM, with resume of leftover tasks after restart"""
+
+    def __init__(self, drain_timeout: float, check_ttl: float, resume_max_age: float):
+        self.drain_timeout = drain_timeout
+        self.check_ttl = check_ttl
+        self.resume_max_age = resume_max_age
+        self.draining = False
+        self.drain_started_at = None
+        self._check_lock = threading.Lock()
+        self._last_check = None  # (checked_at, error message or None)
+
+    def upstream_error(self) -> Optional[str]:
+        """Why ARK cannot be used right now, or None; the reachability call is cached for check_ttl seconds"""
+        if not client:
+            return f"ARK client not initialized ({client.error})"
+        if client.breaker.state == CircuitBreaker.OPEN:
+            return f"ARK circuit open ({client.breaker.snapshot()['last_error']})"
+        # 探测串行化，避免探针并发时重复请求 ARK
+        with self._check_lock:
+            if self._last_check is None or time.time() - self._last_check[0] > self.check_ttl:
+                self._last_check = (time.time(), client.check_reachable())
+            return self._last_check[1]
+
+    def readiness(self):
+        """(ready, details) for /readyz"""
+        details = {"draining": self.draining, "inflight": len(IN_FLIGHT)}
+        if self.draining:
+            return False, dict(details, reason="draining")
+        error = self.upstream_error()
+        if error:
+            return False, dict(details, reason=error)
+        return True, details
+
+    def begin_drain(self):
+        """Stop admitting new upstream tasks; in-flight handlers keep polling"""
+        if not self.draining:
+            self.draining = True
+            self.drain_started_at = time.time()
+            _log(f"🛑 Draining: not accepting new jobs, waiting up to {self.drain_timeout:.0f}s for {len(IN_FLIGHT)} task(s)")
+
+    def wait_drained(self) -> List[InFlightTask]:
+        """Block until interactive in-flight tasks finish or the drain deadline passes; returns the leftovers"""
+        deadline = self.drain_started_at + self.drain_timeout
+        # 延后队列的任务不值得拖住停机，作为遗留任务在重启后恢复
+        while any(not is_deferred_task(task) for task in IN_FLIGHT.tasks()) and time.time() < deadline:
+            time.sleep(1)
+        return IN_FLIGHT.tasks()
+
+    def record_leftovers(self, tasks: List[InFlightTask]):
+        """Flag archived tasks that did not finish so the next start resumes them
+
+        Deferred jobs' tasks are left out: the deferred queue recovers them from its own table.
+        """
+        resumable = [task.task_id for task in tasks if task.archive and not is_deferred_task(task)]
+        if resumable:
+            HISTORY.mark_interrupted(resumable)
+        if tasks:
+            _log(f"💾 Shutdown with {len(tasks)} unfinished task(s), {len(resumable)} recorded for resume")
+
+    def resume_interrupted(self):
+        """Track tasks interrupted by the previous shutdown in background threads"""
+        rows = HISTORY.claim_interrupted(self.resume_max_age)
+        # 旧版本停机时也标记了延后作业的任务；它们由延后队列恢复，这里不再重复跟踪
+        rows = [row for row in rows if not (row["session_id"] or "").startswith(DEFERRED_SESSION_PREFIX)]
+        for row in rows:
+            threading.Thread(target=self._resume, args=(row,), daemon=True).start()
+        if rows:
+            _log(f"♻️ Resuming {len(rows)} task(s) interrupted by the last shutdown")
+
+    def _resume(self, row: Dict[str, Any]):
+        try:
+            params = json.loads(row["params"] or "{}")
+        except ValueError:
+            params = {}
+        eta = ETA_STATS.estimate(row["model"], params.get("resolution"), params.get("duration"), row["mode"])
+        # The deadline counts from the original submission, but give the task at least SEEDANCE_MIN_WAIT more
+        max_wait = max(ETA_STATS.deadline(eta), time.time() - row["created_at"] + SEEDANCE_MIN_WAIT)
+        # 以原会话和用户的身份继续等待，历史记录和用量仍归原用户
+        request = SimpleNamespace(session_hash=row["session_id"], user_key=row["user_key"])
+        video_url, error_message = wait_for_video(
+            row["task_id"], lambda *args, **kwargs: None, max_wait=max_wait, request=request, mode=row["mode"],
+            model=row["model"], prompt=row["prompt"], params=params, started_at=row["created_at"]
+        )
+        METRICS.inc("seedance_resumed_tasks_total", outcome="ok" if video_url else "failed",
+                    help_text="Tasks resumed after a restart, by outcome")
+        _log(f"♻️ Resumed task {row['task_id']}: " + (f"✅ {video_url}" if video_url else error_message.splitlines()[0]))
+
+
+LIFECYCLE = ServiceLifecycle(SEEDANCE_DRAIN_TIMEOUT, SEEDANCE_READY_CHECK_TTL, SEEDANCE_RESUME_MAX_AGE)
+METRICS.gauge("seedance_draining", lambda: 1 if LIFECYCLE.draining else 0, "1 while the server drains for shutdown")
+
+
+DEFERRED_SESSION_PREFIX = "deferred:"
+
+
+def is_deferred_task(task: InFlightTask) -> bool:
+    """Whether an in-flight task belongs to the deferred queue rather than an interactive session"""
+    return task.session_id.startswith(DEFERRED_SESSION_PREFIX)
+
+
+def _parse_windows(spec: str) -> List[tuple]:
+    """Parse "HH:MM-HH:MM,..." into (start, end) minutes of the day; a window may wrap past midnight"""
+    windows = []
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        try:
+            start, end = ((int(hour) * 60 + int(minute)) for hour, minute in
+                          (bound.strip().split(":") for bound in item.split("-", 1)))
+        except ValueError:
+            _log(f"⚠️ Ignoring invalid deferred window {item.strip()!r}, expected HH:MM-HH:MM")
+            continue
+        windows.append((start, end))
+    return windows
+
+
+class DeferredQueue:
+    """Persistent low-priority jobs, submitted only while interactive load is low or inside off-peak windows
+
+    A job is one text/image-to-video task or a whole storyboard. Every worker runs a dispatcher; rows are
+    claimed atomically, and running rows carry a heartbeat so a job left behind by a dead worker is settled
+    from its upstream status, or queued again if nothing had been submitted yet.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS deferred_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        model TEXT,
+        prompt TEXT,
+        params TEXT,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL,
+        started_at REAL,
+        finished_at REAL,
+        heartbeat_at REAL,
+        owner TEXT,
+        task_id TEXT,
+        progress TEXT,
+        result TEXT,
+        error TEXT,
+        user_key TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_deferred_jobs_status ON deferred_jobs(status, id);
+    """
+
+    FINAL = ("succeeded", "failed", "cancelled")
+
+    def __init__(self, path: str, job_dir: str, max_load: int, windows: str, concurrency: int,
+                 interval: float, max_attempts: int):
+        self.path = path
+        self.job_dir = job_dir
+        self.max_load = max_load
+        self.windows = _parse_windows(windows)
+        self.windows_spec = windows
+        self.concurrency = max(1, concurrency)
+        self.interval = interval
+        self.max_attempts = max(1, max_attempts)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._running = {}  # job id -> kind, for jobs running in this process
+        self._cancelled = set()
+        self._dispatcher = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        if "user_key" not in {row["name"] for row in conn.execute("PRAGMA table_info(deferred_jobs)")}:
+            conn.execute("ALTER TABLE deferred_jobs ADD COLUMN user_key TEXT")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql: str, args=()) -> int:
+        """Run a write; returns the affected row count (0 on error)"""
+        try:
+            return self._conn().execute(sql, args).rowcount
+        except sqlite3.Error as e:
+            _log(f"⚠️ Deferred queue write failed: {e}")
+            return 0
+
+    def _query(self, sql: str, args=()) -> List[Dict[str, Any]]:
+        try:
+            return [dict(row) for row in self._conn().execute(sql, args).fetchall()]
+        except sqlite3.Error as e:
+            _log(f"⚠️ Deferred queue query failed: {e}")
+            return []
+
+    def submit(self, kind: str, model: str, prompt: str, params: Dict[str, Any], image: Optional[str] = None,
+               user_key: Optional[str] = None) -> int:
+        """Queue a job; the image is copied next to the queue so it outlives Gradio's cache and restarts"""
+        params = dict(params)
+        if image:
+            os.makedirs(self.job_dir, exist_ok=True)
+            copy = os.path.join(self.job_dir, f"input-{time.time_ns()}-{random.randrange(16 ** 4):04x}"
+                                              f"{os.path.splitext(image)[1] or '.jpg'}")
+            shutil.copyfile(image, copy)
+            params["image"] = copy
+        cursor = self._conn().execute(
+            "INSERT INTO deferred_jobs (kind, model, prompt, params, status, created_at, progress, user_key) "
+            "VALUES (?, ?, ?, ?, 'pending', ?, 'waiting for off-peak capacity', ?)",
+            (kind, model, prompt or "", json.dumps(params, ensure_ascii=False), time.time(), user_key)
+        )
+        METRICS.inc("seedance_deferred_submitted_total", kind=kind, help_text="Jobs queued in the deferred queue")
+        return cursor.lastrowid
+
+    def cancel(self, job_id: int, user_key: Optional[str] = None) -> str:
+        """Cancel a pending or running job (a running one is also cancelled upstream); user_key limits it to that user's jobs"""
+        job = self.get(job_id, user_key)
+        if not job:
+            return f"❌ No deferred job #{job_id}"
+        if job["status"] in self.FINAL:
+            return f"ℹ️ Deferred job #{job_id} already {job['status']}"
+        if self._execute("UPDATE deferred_jobs SET status = 'cancelled', finished_at = ?, progress = 'cancelled' "
+                         "WHERE id = ? AND status IN ('pending', 'running')", (time.time(), job_id)) != 1:
+            return f"ℹ️ Deferred job #{job_id} finished before it could be cancelled"
+        if job["status"] == "pending":
+            self._remove_inputs(job)
+        else:
+            with self._lock:
+                local = job_id in self._running
+                if local:
+                    self._cancelled.add(job_id)
+            if local:
+                cancel_tasks(IN_FLIGHT.tasks(session_id=f"{DEFERRED_SESSION_PREFIX}{job_id}"))
+            elif job["task_id"] and client:
+                # 由其它进程运行的任务会在其下次心跳时取消；这里直接取消上游以防该进程已不存在
+                client.cancel_task(job["task_id"])
+        METRICS.inc("seedance_deferred_finished_total", kind=job["kind"], outcome="cancelled",
+                    help_text="Deferred jobs finished, by outcome")
+        return f"⏹️ Deferred job #{job_id} cancelled"
+
+    def get(self, job_id: int, user_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT * FROM deferred_jobs WHERE id = ?", (job_id,))
+        if rows and user_key is not None and rows[0]["user_key"] != user_key:
+            return None
+        return rows[0] if rows else None
+
+    def counts(self) -> Dict[str, int]:
+        return {row["status"]: row["n"] for row in
+                self._query("SELECT status, COUNT(*) AS n FROM deferred_jobs GROUP BY status")}
+
+    def jobs(self, limit: int = 50, user_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recent jobs (of one user when user_key is given), newest first, with each pending job's position in the whole queue"""
+        if user_key is None:
+            rows = self._query("SELECT * FROM deferred_jobs ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            rows = self._query("SELECT * FROM deferred_jobs WHERE user_key = ? ORDER BY id DESC LIMIT ?", (user_key, limit))
+        pending = [row["id"] for row in self._query("SELECT id FROM deferred_jobs WHERE status = 'pending' ORDER BY id")]
+        positions = {job_id: index + 1 for index, job_id in enumerate(pending)}
+        for row in rows:
+            row["position"] = positions.get(row["id"])
+        return rows
+
+    def in_window(self, now: Optional[float] = None) -> bool:
+        local = time.localtime(now)
+        minute = local.tm_hour * 60 + local.tm_min
+        for start, end in self.windows:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return True
+        return False
+
+    def interactive_load(self) -> int:
+        """Interactive upstream tasks in flight in this process plus events waiting in the Gradio queue"""
+        tasks = sum(1 for task in IN_FLIGHT.tasks() if not is_deferred_task(task))
+        return tasks + ACTIVITY.queue_stats()["waiting"]
+
+    def running(self) -> int:
+        with self._lock:
+            return len(self._running)
+
+    def blocked_reason(self) -> Optional[str]:
+        """Why this process cannot dispatch another job right now, or None"""
+        if LIFECYCLE.draining:
+            return "server is draining"
+        if not client:
+            return "ARK client not initialized"
+        if client.breaker.state == CircuitBreaker.OPEN:
+            return "ARK circuit is open"
+        running = self.running()
+        if running >= self.concurrency:
+            return f"{running}/{self.concurrency} deferred jobs already running"
+        if self.in_window():
+            return None
+        load = self.interactive_load()
+        if load >= self.max_load:
+            return f"interactive load {load} ≥ {self.max_load}"
+        return None
+
+    def start(self):
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._loop, name="deferred-dispatcher", daemon=True)
+                self._dispatcher.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                _log(f"⚠️ Deferred dispatcher failed: {e}")
+
+    def tick(self):
+        """Heartbeat our running jobs, settle orphaned ones, then dispatch while load allows"""
+        self._heartbeat()
+        self._recover_orphans()
+        while self.blocked_reason() is None:
+            job = self._claim()
+            if job is None or not self._start(job):
+                return
+
+    def _heartbeat(self):
+        with self._lock:
+            job_ids = list(self._running)
+        if not job_ids:
+            return
+        marks = ", ".join("?" * len(job_ids))
+        self._execute(f"UPDATE deferred_jobs SET heartbeat_at = ? WHERE id IN ({marks}) AND status = 'running'",
+                      (time.time(), *job_ids))
+        # 通过其它进程取消的作业在这里停止
+        for row in self._query(f"SELECT id FROM deferred_jobs WHERE id IN ({marks}) AND status = 'cancelled'", job_ids):
+            with self._lock:
+                self._cancelled.add(row["id"])
+            cancel_tasks(IN_FLIGHT.tasks(session_id=f"{DEFERRED_SESSION_PREFIX}{row['id']}"))
+
+    def _recover_orphans(self):
+        """Settle running jobs whose worker stopped sending heartbeats"""
+        stale = time.time() - max(60, 3 * self.interval)
+        for row in self._query("SELECT * FROM deferred_jobs WHERE status = 'running' AND heartbeat_at < ?", (stale,)):
+            if not row["task_id"]:
+                # 提交前或分镜运行中进程退出：重新排队 (分镜从第一段重新开始)
+                if self._execute("UPDATE deferred_jobs SET status = 'pending', owner = NULL, progress = 'queued again after a worker restart' "
+                                 "WHERE id = ? AND status = 'running' AND heartbeat_at < ?", (row["id"], stale)) == 1:
+                    _log(f"♻️ Deferred job #{row['id']} requeued: its worker stopped before submitting")
+                continue
+            if not client:
+                return
+            status_result = client.get_task_status(row["task_id"])
+            status = status_result.get("status")
+            if status not in self.FINAL:
+                self._execute("UPDATE deferred_jobs SET progress = ? WHERE id = ? AND status = 'running'",
+                              (f"upstream {status or 'unreachable'} (worker restarted, tracking by status)", row["id"]))
+                continue
+            video_url = extract_video_url(status_result) if status == "succeeded" else None
+            error = None if video_url else f"❌ Video generation {status}: {status_result.get('error', 'no video URL')}"
+            history = HISTORY.get(row["task_id"])
+            if history and history["status"] in ("queued", "interrupted"):
+                HISTORY.record_finish(row["task_id"], status, video_url=video_url, error=error)
+            if status == "succeeded":
+                params = json.loads(row["params"] or "{}")
+                USAGE.record(row["task_id"], f"{DEFERRED_SESSION_PREFIX}{row['id']}", row["kind"],
+                             _model_id_for(row["kind"], row["model"]), params.get("resolution"), params.get("duration"),
+                             status_result.get("usage"), row["user_key"])
+            self._settle(row, video_url, error, retry=False)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Take the oldest pending job; each row is claimed by one process only"""
+        for row in self._query("SELECT * FROM deferred_jobs WHERE status = 'pending' ORDER BY id LIMIT 5"):
+            now = time.time()
+            if self._execute("UPDATE deferred_jobs SET status = 'running', owner = ?, started_at = ?, heartbeat_at = ?, "
+                             "attempts = attempts + 1, task_id = NULL, progress = 'dispatching' WHERE id = ? AND status = 'pending'",
+                             (self.owner, now, now, row["id"])) == 1:
+                row.update(status="running", attempts=row["attempts"] + 1)
+                return row
+        return None
+
+    def _start(self, job: Dict[str, Any]) -> bool:
+        """Run a claimed job in a background thread; False (job returned to the queue) if its model lane is busy"""
+        params = json.loads(job["params"] or "{}")
+        if job["kind"] != "storyboard":
+            # "Auto" 在真正提交时才选择模型
+            model, _ = resolve_model(job["kind"], job["model"], params.get("resolution"), params.get("duration"), params.get("ratio"))
+            lane = LANES.lane(_model_id_for(job["kind"], model))
+            if lane.waiting or lane.active >= lane.limit:
+                # 不与交互请求争抢模型通道
+                self._execute("UPDATE deferred_jobs SET status = 'pending', owner = NULL, attempts = attempts - 1, progress = ? "
+                              "WHERE id = ? AND status = 'running'", (f"waiting for a free {lane.model_id} slot", job["id"]))
+                return False
+            job["model"] = model
+        with self._lock:
+            self._running[job["id"]] = job["kind"]
+        METRICS.inc("seedance_deferred_dispatched_total", kind=job["kind"], help_text="Deferred jobs handed to ARK")
+        threading.Thread(target=self._run, args=(job, params), name=f"deferred-{job['id']}", daemon=True).start()
+        return True
+
+    def _progress_writer(self, job_id: int, stop_on_cancel: bool):
+        """gr.Progress stand-in that records the latest progress on the job row"""
+        def progress(value=None, desc=None, **kwargs):
+            if stop_on_cancel and job_id in self._cancelled:
+                # 分镜在两段之间没有上游任务可取消，借进度回调中止生成器
+                raise RuntimeError("deferred job cancelled")
+            self._set_progress(job_id, f"{value:.0%} · {desc}" if isinstance(value, (int, float)) else (desc or ""))
+        return progress
+
+    def _set_progress(self, job_id: int, text: str):
+        self._execute("UPDATE deferred_jobs SET progress = ? WHERE id = ? AND status = 'running'", (text, job_id))
+
+    def _run(self, job: Dict[str, Any], params: Dict[str, Any]):
+        job_id = job["id"]
+        # 作业生成的记录归提交它的用户所有
+        request = SimpleNamespace(session_hash=f"{DEFERRED_SESSION_PREFIX}{job_id}", user_key=job.get("user_key"))
+        retry = False
+        try:
+            if job["kind"] == "storyboard":
+                result, error = self._run_storyboard(job, params, request)
+            else:
+                result, error, retry = self._run_task(job, params, request)
+        except Exception as e:
+            result, error = None, f"❌ Error: {e}"
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+                self._cancelled.discard(job_id)
+        self._settle(job, result, error, retry)
+
+    def _run_task(self, job: Dict[str, Any], params: Dict[str, Any], request):
+        """One text/image-to-video task; returns (video_url, error, retry) where retry means nothing was submitted"""
+        mode = job["kind"]
+        options = {key: params.get(key) for key in ("resolution", "duration", "ratio", "seed", "watermark")}
+        if mode == "image_to_video":
+            reserved = MEMORY_BUDGET.acquire(estimate_image_memory([params["image"]]), SEEDANCE_MEMORY_WAIT)
+            if reserved is None:
+                return None, MEMORY_BUSY_MESSAGE, True
+            try:
+                created = client.create_image_to_video_task(image_path=params["image"], prompt=job["prompt"], model=job["model"], **options)
+            finally:
+                MEMORY_BUDGET.release(reserved)
+        else:
+            created = client.create_text_to_video_task(prompt=job["prompt"], model=job["model"], **options)
+        task_id = created.get("id")
+        if "error" in created or not task_id:
+            return None, f"❌ Task creation failed: {created.get('error', 'no task ID returned')}", True
+        
+        self._execute("UPDATE deferred_jobs SET task_id = ? WHERE id = ?", (task_id, job["id"]))
+        video_url, error_message = wait_for_video(
+            task_id, self._progress_writer(job["id"], stop_on_cancel=False), request=request, mode=mode,
+            model=_model_id_for(mode, job["model"]), prompt=job["prompt"], params=options
+        )
+        return video_url, error_message, False
+
+    def _run_storyboard(self, job: Dict[str, Any], params: Dict[str, Any], request):
+        """A whole storyboard; the joined video is kept next to the queue"""
+        output_path, status = None, ""
+        # 绕过处理函数装饰器：延后作业不计入交互负载，也不受会话用量软限制
+        for output_path, status in inspect.unwrap(storyboard_to_video)(
+                params["segments"], params.get("image"), job["model"], params.get("resolution"), params.get("duration"),
+                params.get("ratio"), params.get("seed", -1), params.get("watermark", True),
+                progress=self._progress_writer(job["id"], stop_on_cancel=True), request=request):
+            if status:
+                self._set_progress(job["id"], status.splitlines()[-1])
+        if not output_path:
+            return None, status.splitlines()[-1] if status else "❌ Storyboard failed"
+        os.makedirs(self.job_dir, exist_ok=True)
+        result = os.path.join(self.job_dir, f"storyboard-{job['id']}.mp4")
+        shutil.copyfile(output_path, result)
+        return result, None
+
+    def _settle(self, job: Dict[str, Any], result: Optional[str], error: Optional[str], retry: bool):
+        """Record a job's outcome; a submission failure goes back to the queue until attempts run out"""
+        if not result and retry and job["attempts"] < self.max_attempts:
+            self._execute("UPDATE deferred_jobs SET status = 'pending', owner = NULL, progress = ? WHERE id = ? AND status = 'running'",
+                          (f"retrying (attempt {job['attempts']}/{self.max_attempts} failed: {error})", job["id"]))
+            return
+        status = "succeeded" if result else "failed"
+        if self._execute("UPDATE deferred_jobs SET status = ?, finished_at = ?, result = ?, error = ?, progress = ? "
+                         "WHERE id = ? AND status = 'running'",
+                         (status, time.time(), result, error, "done" if result else "failed", job["id"])) != 1:
+            # 已被取消
+            self._remove_inputs(job)
+            return
+        self._remove_inputs(job)
+        METRICS.inc("seedance_deferred_finished_total", kind=job["kind"], outcome=status, help_text="Deferred jobs finished, by outcome")
+        _log(f"🌙 Deferred job #{job['id']} {status}: " + (result if result else (error or "").splitlines()[0]))
+
+    def _remove_inputs(self, job: Dict[str, Any]):
         try:
-            response = requests.post(
-                f"{self.base_url}/contents/generations/tasks",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            error_detail = str(e)
-            if hasattr(e, 'response') and e.response is not None:
+            image = json.loads(job["params"] or "{}").get("image")
+        except ValueError:
+            return
+        if image and os.path.dirname(image) == self.job_dir:
+            try:
+                os.unlink(image)
+            except FileNotFoundError:
+                pass
+
+
+DEFERRED = DeferredQueue(
+    SEEDANCE_DEFERRED_DB,
+    SEEDANCE_DEFERRED_DIR,
+    max_load=SEEDANCE_DEFERRED_MAX_LOAD,
+    windows=SEEDANCE_DEFERRED_WINDOWS,
+    concurrency=SEEDANCE_DEFERRED_CONCURRENCY,
+    interval=SEEDANCE_DEFERRED_INTERVAL,
+    max_attempts=SEEDANCE_DEFERRED_MAX_ATTEMPTS
+)
+METRICS.gauge("seedance_deferred_jobs", lambda: [({"status": status}, count) for status, count in DEFERRED.counts().items()],
+              "Deferred queue jobs by status")
+METRICS.gauge("seedance_deferred_running", DEFERRED.running, "Deferred jobs running in this process")
+
+
+class ScratchDir:
+    """A per-request scratch directory, removed when its last holder releases it"""
+
+    def __init__(self, manager: "ScratchManager", path: str):
+        self.manager = manager
+        self.path = path
+        self.refs = 1
+        self.expires_at = None
+        self._counter = 0
+
+    def file(self, suffix: str = "", name: Optional[str] = None) -> str:
+        """Path for a new file in this directory (checked against the byte quota)"""
+        self.manager.check_quota()
+        with self.manager._lock:
+            self._counter += 1
+            counter = self._counter
+        return os.path.join(self.path, name or f"{counter:03d}{suffix}")
+
+    def retain(self) -> "ScratchDir":
+        """Take another reference, e.g. for a background job still writing here"""
+        with self.manager._lock:
+            self.refs += 1
+        return self
+
+    def release(self, linger: float = 0):
+        """Drop a reference; the directory goes with the last one, or after linger seconds"""
+        self.manager._release(self, linger)
+
+
+class ScratchManager:
+    """Owns per-request scratch directories under one root, with a byte quota and an orphan sweeper
+
+    Only directories carrying this manager's marker file are ever deleted.
+    """
+
+    MARKER = ".seedance-scratch"
+
+    def __init__(self, root: str, quota_bytes: int, max_age: float, sweep_interval: float):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._dirs = {}  # path -> ScratchDir
+        self._sweeper = None
+
+    def create(self, prefix: str = "request") -> ScratchDir:
+        """New scratch directory holding one reference (the quota is enforced per file)"""
+        self._start_sweeper()
+        os.makedirs(self.root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=f"{prefix}-", dir=self.root)
+        with open(os.path.join(path, self.MARKER), "w") as marker:
+            marker.write(str(os.getpid()))
+        scratch = ScratchDir(self, path)
+        with self._lock:
+            self._dirs[path] = scratch
+        return scratch
+
+    def check_quota(self):
+        used = self.usage()
+        if used >= self.quota_bytes:
+            METRICS.inc("seedance_scratch_quota_rejections_total", help_text="Scratch allocations refused by the byte quota")
+            raise RuntimeError(f"Scratch space is full ({used / 1024 / 1024:.0f} MB used of "
+                               f"{self.quota_bytes / 1024 / 1024:.0f} MB), please retry shortly")
+
+    def usage(self) -> int:
+        """Bytes currently used under the scratch root"""
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
                 try:
-                    error_detail = e.response.text
-                except:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
                     pass
-            return {"error": f"Failed to create image refs task: {error_detail}"}
-    
-    def get_task_status(self, task_id: str) -> Dict[str, Any]:
-        """Query task status"""
+        return total
+
+    def __len__(self):
+        with self._lock:
+            return len(self._dirs)
+
+    def _release(self, scratch: ScratchDir, linger: float):
+        with self._lock:
+            scratch.refs -= 1
+            if scratch.refs > 0:
+                return
+            if linger > 0:
+                # 例如交给 Gradio 的输出文件，留给清理线程稍后删除
+                scratch.expires_at = time.time() + linger
+                return
+            self._dirs.pop(scratch.path, None)
+        self._remove(scratch.path)
+
+    def _remove(self, path: str):
+        # 只删除带有本管理器标记的目录
+        if os.path.exists(os.path.join(path, self.MARKER)):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _owner_alive(self, path: str) -> bool:
         try:
-            response = requests.get(
-                f"{self.base_url}/contents/generations/tasks/{task_id}",
-                headers=self.headers,
-                timeout=30
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"error": f"Query failed: {str(e)}"}
-    
-    def wait_for_task_completion(self, task_id: str, timeout: int = 300) -> Dict[str, Any]:
-        """Wait for task completion"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            status_response = self.get_task_status(task_id)
-            
-            if "error" in status_response:
-                return status_response
-            
-            status = status_response.get("status", "unknown")
-            
-            if status == "success":
-                return status_response
-            elif status == "failed":
-                return {"error": "Task execution failed"}
-            
-            # Wait 5 seconds before querying again
-            time.sleep(5)
+            with open(os.path.join(path, self.MARKER)) as marker:
+                pid = int(marker.read().strip())
+        except (OSError, ValueError):
+            return False
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+            return True
+        except OSError:
+            return False
+
+    def sweep(self) -> int:
+        """Remove expired lingering directories and orphans left by crashed requests or processes"""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            expired = [path for path, scratch in self._dirs.items()
+                       if scratch.refs <= 0 and scratch.expires_at and scratch.expires_at <= now]
+            for path in expired:
+                del self._dirs[path]
+            active = set(self._dirs)
+        for path in expired:
+            self._remove(path)
+            removed += 1
         
-        return {"error": "Task timeout"}
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return removed
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) or entry.path in active:
+                continue
+            marker = os.path.join(entry.path, self.MARKER)
+            try:
+                age = now - os.path.getmtime(marker)
+            except OSError:
+                continue
+            if age > self.max_age and not self._owner_alive(entry.path):
+                self._remove(entry.path)
+                removed += 1
+        if removed:
+            _log(f"🧹 Scratch sweeper removed {removed} director{'y' if removed == 1 else 'ies'}")
+        return removed
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="scratch-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                _log(f"⚠️ Scratch sweep failed: {e}")
+            time.sleep(self.sweep_interval)
+
+
+SCRATCH = ScratchManager(
+    root=SEEDANCE_SCRATCH_DIR,
+    quota_bytes=SEEDANCE_SCRATCH_QUOTA_MB * 1024 * 1024,
+    max_age=SEEDANCE_SCRATCH_MAX_AGE,
+    sweep_interval=SEEDANCE_SCRATCH_SWEEP_INTERVAL
+)
+METRICS.gauge("seedance_scratch_bytes", SCRATCH.usage, "Bytes used in the scratch directory")
+METRICS.gauge("seedance_scratch_dirs", lambda: len(SCRATCH), "Scratch directories held by requests")
+
 
-# Read environment variables in app.py
-ARK_API_KEY = os.getenv("ARK_API_KEY")
-ARK_BASE_URL = os.getenv("ARK_BASE_URL")
+def _can_pass_through(img: Image.Image, path: str) -> bool:
+    """Compliant JPEG/PNG/WebP uploads (including browser-resized ones) are sent exactly as uploaded, without decoding"""
+    width, height = img.size
+    return (img.format in ("JPEG", "PNG", "WEBP")
+            and not getattr(img, "is_animated", False)
+            and os.path.getsize(path) <= SEEDANCE_IMAGE_MAX_BYTES
+            and _IMAGE_LIMITS["min_side"] <= min(width, height)
+            and max(width, height) <= SEEDANCE_IMAGE_MAX_SIDE
+            and _IMAGE_LIMITS["min_aspect"] <= width / height <= _IMAGE_LIMITS["max_aspect"]
+            and _exif_orientation(img) == 1)
 
 
+# EXIF orientation -> transpose that makes the pixels upright
+_EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
 
-# Initialize client with environment variables from app.py
-try:
-    if not ARK_API_KEY or not ARK_BASE_URL:
-        raise ValueError(f"Environment variables missing: ARK_API_KEY={'SET' if ARK_API_KEY else 'NOT SET'}, ARK_BASE_URL={ARK_BASE_URL or 'NOT SET'}")
+
+def _exif_orientation(img: Image.Image) -> int:
+    # PNG 的 eXIf 块可能位于像素数据之后，读取它需要解码整张图，因此只检查 JPEG 和 WebP (EXIF 在文件头部)
+    if img.format not in ("JPEG", "WEBP"):
+        return 1
+    return img.getexif().get(0x0112, 1)
+
+
+def prepare_image(image, scratch: ScratchDir, role: str = "Image") -> Optional[str]:
+    """Path of an upload ready to send; any re-encoded copy is written to the request's scratch dir
+
+    Compliant JPEG/PNG/WebP files pass through untouched. Anything else is decoded straight
+    at reduced scale (JPEG draft mode, integer reduce otherwise) and re-encoded once.
+    """
+    if image is None or (isinstance(image, str) and image.startswith("http")):
+        return image
+    
+    if not isinstance(image, str):
+        # API callers may still send decoded PIL images
+        temp_path = scratch.file(".jpg")
+        image.save(temp_path, format="JPEG")
+        return temp_path
+    
+    ACTIVITY.phase("preparing_image")
+    start = time.process_time()
+    with PROFILER.trace_memory("prepare_image"), Image.open(image) as img:
+        image_format = img.format
+        original_size = img.size
+        if _can_pass_through(img, image):
+            path = "passthrough"
+            result = image
+            final_size = original_size
+        else:
+            path = "reduced"
+            orientation = _exif_orientation(img)
+            factor = math.ceil(max(original_size) / SEEDANCE_IMAGE_MAX_SIDE)
+            # JPEG 直接在解码阶段按 1/2、1/4、1/8 缩小；剩余倍数用整数 reduce (盒式平均，开销很小)
+            img.draft("RGB", (original_size[0] // factor, original_size[1] // factor))
+            prepared = img
+            remaining = math.ceil(max(img.size) / SEEDANCE_IMAGE_MAX_SIDE)
+            if remaining > 1:
+                prepared = prepared.reduce(remaining)
+            # 旋转放在缩小之后，只处理小图
+            if orientation in _EXIF_TRANSPOSE:
+                prepared = prepared.transpose(_EXIF_TRANSPOSE[orientation])
+            if prepared.mode not in ("RGB", "L"):
+                prepared = prepared.convert("RGB")
+            result = scratch.file(".jpg")
+            prepared.save(result, format="JPEG", quality=90)
+            final_size = prepared.size
     
-    client = BytePlusVideoClient(api_key=ARK_API_KEY, base_url=ARK_BASE_URL)
-    print("✅ BytePlus client initialized successfully")
-except Exception as e:
-    print(f"❌ Client initialization failed: {e}")
-    client = None
+    cpu_seconds = time.process_time() - start
+    METRICS.inc("seedance_image_prepare_total", path=path, help_text="Uploaded images prepared, by path")
+    METRICS.inc("seedance_image_prepare_cpu_seconds_total", cpu_seconds, path=path, help_text="CPU time spent preparing uploaded images")
+    if path == "passthrough":
+        print(f"🖼️ {role}: compliant {image_format} {original_size[0]}x{original_size[1]} sent as uploaded ({cpu_seconds * 1000:.1f} ms CPU)")
+    else:
+        print(f"🖼️ {role}: {image_format} {original_size[0]}x{original_size[1]} reduced to "
+              f"{final_size[0]}x{final_size[1]} ({cpu_seconds * 1000:.1f} ms CPU)")
+    return result
+
+
+class MemoryBudget:
+    """Byte-counting semaphore: requests wait in arrival order until their estimated peak memory fits"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.used = 0
+        self._cond = threading.Condition()
+        self._queue = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._queue)
+
+    def acquire(self, nbytes: int, timeout: Optional[float] = None) -> Optional[int]:
+        """Reserve nbytes; returns the reserved amount, or None on timeout"""
+        # 超过总预算的请求单独运行，而不是永远等待
+        nbytes = min(int(nbytes), self.capacity)
+        ACTIVITY.phase("memory_wait")
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                admitted = self._cond.wait_for(
+                    lambda: self._queue[0] is ticket and self.used + nbytes <= self.capacity, timeout
+                )
+                if not admitted:
+                    return None
+                self.used += nbytes
+                return nbytes
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self, nbytes: Optional[int]):
+        if not nbytes:
+            return
+        with self._cond:
+            self.used = max(0, self.used - nbytes)
+            self._cond.notify_all()
+
+
+MEMORY_BUDGET = MemoryBudget(SEEDANCE_MEMORY_BUDGET_MB * 1024 * 1024)
+METRICS.gauge("seedance_memory_budget_used_bytes", lambda: MEMORY_BUDGET.used, "Estimated image memory reserved by running requests")
+METRICS.gauge("seedance_memory_budget_capacity_bytes", lambda: MEMORY_BUDGET.capacity, "Image memory budget")
+METRICS.gauge("seedance_memory_budget_waiting", lambda: MEMORY_BUDGET.waiting, "Requests waiting for image memory budget")
+
+MEMORY_BUSY_MESSAGE = "❌ Server is busy processing other large images, please retry in a moment"
+
+
+def estimate_image_memory(images) -> int:
+    """Peak bytes to encode and submit images: decoded pixels plus raw, base64 and JSON body copies"""
+    total = 0
+    for image in images:
+        if image is None:
+            continue
+        if isinstance(image, str):
+            if image.startswith("http"):
+                continue
+            try:
+                encoded = os.path.getsize(image)
+                with Image.open(image) as img:
+                    width, height = img.size
+                    bands = len(img.getbands())
+                    # 原样透传的文件不会被解码
+                    decoded = 0 if _can_pass_through(img, image) else width * height * max(bands, 3)
+            except Exception:
+                continue
+        else:
+            width, height = image.size
+            decoded = width * height * max(len(image.getbands()), 3)
+            # 尚未编码的图片按 JPEG 约每像素半字节估算
+            encoded = width * height // 2
+        total += decoded + encoded * (1 + 2 * 4 / 3)
+    return int(total)
+
 
 def capture_logs_wrapper(func):
     """包装函数以捕获print输出"""
+    PROFILER.handler_names.add(func.__name__)
+    
+    # wraps keeps the original signature so Gradio can inject Progress and Request
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         # 创建字符串缓冲区来捕获输出
         log_buffer = io.StringIO()
         
         try:
-            # 重定向stdout和stderr到缓冲区
-            with redirect_stdout(log_buffer), redirect_stderr(log_buffer):
-                result = func(*args, **kwargs)
+            # 只捕获本线程的输出：并发运行的其它处理函数的日志不会混入
+            with OUTPUT_CAPTURE.capture(log_buffer):
+                result = PROFILER.call(func, *args, **kwargs)
             
             # 获取捕获的日志
             captured_logs = log_buffer.getvalue()
@@ -503,7 +4399,9 @@ def capture_logs_wrapper(func):
 
 
 @capture_logs_wrapper
-def text_to_video(prompt, model, resolution="720p", duration=5, ratio="16:9", seed=-1, watermark=True, progress=gr.Progress()):
+@track_activity
+@cancellable("text_to_video")
+def text_to_video(prompt, model, resolution="720p", duration=5, ratio="16:9", seed=-1, watermark=True, progress=gr.Progress(), request: gr.Request = None):
     """Text-to-video generation function"""
     if not client:
         return None, "❌ Client not initialized, please check API configuration"
@@ -513,6 +4411,8 @@ def text_to_video(prompt, model, resolution="720p", duration=5, ratio="16:9", se
     
     progress(0.1, desc="Creating video generation task...")
     
+    model, route_note = resolve_model("text_to_video", model, resolution, duration, ratio)
+    
     # Process seed value (-1 means random)
     seed_value = None if seed == -1 else int(seed)
     
@@ -556,81 +4456,20 @@ def text_to_video(prompt, model, resolution="720p", duration=5, ratio="16:9", se
     
     progress(0.3, desc=f"Task created (ID: {task_id}), waiting for generation...")
     
-    # Wait for task completion
-    max_wait = 180  # 3 minutes timeout
-    start_time = time.time()
-    
-    while time.time() - start_time < max_wait:
-        status_result = client.get_task_status(task_id)
-        
-        if "error" in status_result:
-            return None, f"❌ Status query failed: {status_result['error']}"
-        
-        status = status_result.get("status", "")
-        progress_val = min(0.3 + (time.time() - start_time) / max_wait * 0.6, 0.9)
-        
-        if status == "succeeded":
-            progress(0.95, desc="Video generation completed, retrieving results...")
-            
-            # Get video URL - try multiple possible response formats
-            video_url = None
-            
-            # Format 1: Check content.video_url (BytePlus API format)
-            if "content" in status_result and isinstance(status_result["content"], dict):
-                video_url = status_result["content"].get("video_url")
-            
-            # Format 2: Check data array
-            if not video_url and "data" in status_result and status_result["data"]:
-                for item in status_result["data"]:
-                    if item.get("type") == "video_url":
-                        video_url = item.get("url")
-                        break
-            
-            # Format 3: Check direct video_url field
-            if not video_url and "video_url" in status_result:
-                video_url = status_result["video_url"]
-            
-            # Format 4: Check result field
-            if not video_url and "result" in status_result:
-                result = status_result["result"]
-                if isinstance(result, dict):
-                    video_url = result.get("video_url") or result.get("url")
-                elif isinstance(result, list) and result:
-                    for item in result:
-                        if isinstance(item, dict) and ("video_url" in item or "url" in item):
-                            video_url = item.get("video_url") or item.get("url")
-                            break
-            
-            # Format 5: Check outputs field
-            if not video_url and "outputs" in status_result:
-                outputs = status_result["outputs"]
-                if isinstance(outputs, list) and outputs:
-                    for item in outputs:
-                        if isinstance(item, dict) and ("video_url" in item or "url" in item):
-                            video_url = item.get("video_url") or item.get("url")
-                            break
-            
-            if video_url:
-                progress(1.0, desc="✅ Video generation successful!")
-                # 直接返回视频URL，不下载到本地
-                return video_url, f"✅ Video generation successful!\nTask ID: {task_id}\nVideo URL: {video_url}"
-            else:
-                return None, f"❌ Generated video URL not found\nTask ID: {task_id}"
-                
-        elif status == "failed":
-            error_msg = status_result.get("error", "Unknown error")
-            return None, f"❌ Video generation failed: {error_msg}\nTask ID: {task_id}"
-            
-        elif status in ["queued", "running"]:
-            progress(progress_val, desc=f"Generating video... (Status: {status})")
-            time.sleep(3)
-        else:
-            return None, f"❌ Unknown status: {status}\nTask ID: {task_id}"
+    # Wait for task completion (callback or polling)
+    video_url, error_message = wait_for_video(
+        task_id, progress, request=request, mode="text_to_video", model=_model_id_for("text_to_video", model),
+        prompt=prompt, params={"resolution": resolution, "duration": duration, "ratio": ratio, "seed": seed_value, "watermark": watermark}
+    )
+    if error_message:
+        return None, error_message
     
-    return None, f"❌ Video generation timeout\nTask ID: {task_id}"
+    return video_url, f"✅ Video generation successful!\nTask ID: {task_id}\nModel: {model}\nVideo URL: {video_url}" + (f"\n{route_note}" if route_note else "")
 
 @capture_logs_wrapper
-def image_to_video(image, prompt, model, resolution="720p", duration=5, ratio="16:9", seed=-1, watermark=True, progress=gr.Progress()):
+@track_activity
+@cancellable("image_to_video")
+def image_to_video(image, prompt, model, resolution="720p", duration=5, ratio="adaptive", seed=-1, watermark=True, progress=gr.Progress(), request: gr.Request = None):
     """Image-to-video generation function"""
     if not client:
         return None, "❌ Client not initialized, please check API configuration"
@@ -640,19 +4479,19 @@ def image_to_video(image, prompt, model, resolution="720p", duration=5, ratio="1
     
     progress(0.1, desc="Processing uploaded image...")
     
-    # Save uploaded image to temporary file
+    reserved = MEMORY_BUDGET.acquire(estimate_image_memory([image]), SEEDANCE_MEMORY_WAIT)
+    if reserved is None:
+        return None, MEMORY_BUSY_MESSAGE
+    
+    # Compliant uploads are used as-is, others are reduced into the request's scratch dir
+    scratch = SCRATCH.create("i2v")
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-            if isinstance(image, str):
-                # If it's a file path
-                image_path = image
-            else:
-                # If it's a PIL Image object
-                image.save(tmp_file.name, format="JPEG")
-                image_path = tmp_file.name
+        image_path = prepare_image(image, scratch)
         
         progress(0.2, desc="Creating image-to-video task...")
         
+        model, route_note = resolve_model("image_to_video", model, resolution, duration, ratio)
+        
         # Process seed value (-1 means random)
         seed_value = None if seed == -1 else int(seed)
         
@@ -667,6 +4506,9 @@ def image_to_video(image, prompt, model, resolution="720p", duration=5, ratio="1
             seed=seed_value,
             watermark=watermark
         )
+        # 请求体已发送，释放编码占用的内存预算
+        MEMORY_BUDGET.release(reserved)
+        reserved = None
         
         if "error" in result:
             error_message = result['error']
@@ -697,91 +4539,28 @@ def image_to_video(image, prompt, model, resolution="720p", duration=5, ratio="1
         
         progress(0.3, desc=f"Task created (ID: {task_id}), waiting for generation...")
         
-        # Wait for task completion
-        max_wait = 180  # 3 minutes timeout
-        start_time = time.time()
-        
-        while time.time() - start_time < max_wait:
-            status_result = client.get_task_status(task_id)
-            
-            if "error" in status_result:
-                return None, f"❌ Status query failed: {status_result['error']}"
-            
-            status = status_result.get("status", "")
-            progress_val = min(0.3 + (time.time() - start_time) / max_wait * 0.6, 0.9)
-            
-            if status == "succeeded":
-                progress(0.95, desc="Video generation completed, retrieving results...")
-                
-                # Get video URL - try multiple possible response formats
-                video_url = None
-                
-                # Format 1: Check content.video_url (BytePlus API format)
-                if "content" in status_result and isinstance(status_result["content"], dict):
-                    video_url = status_result["content"].get("video_url")
-                
-                # Format 2: Check data array
-                if not video_url and "data" in status_result and status_result["data"]:
-                    for item in status_result["data"]:
-                        if item.get("type") == "video_url":
-                            video_url = item.get("url")
-                            break
-                
-                # Format 3: Check direct video_url field
-                if not video_url and "video_url" in status_result:
-                    video_url = status_result["video_url"]
-                
-                # Format 4: Check result field
-                if not video_url and "result" in status_result:
-                    result = status_result["result"]
-                    if isinstance(result, dict):
-                        video_url = result.get("video_url") or result.get("url")
-                    elif isinstance(result, list) and result:
-                        for item in result:
-                            if isinstance(item, dict) and ("video_url" in item or "url" in item):
-                                video_url = item.get("video_url") or item.get("url")
-                                break
-                
-                # Format 5: Check outputs field
-                if not video_url and "outputs" in status_result:
-                    outputs = status_result["outputs"]
-                    if isinstance(outputs, list) and outputs:
-                        for item in outputs:
-                            if isinstance(item, dict) and ("video_url" in item or "url" in item):
-                                video_url = item.get("video_url") or item.get("url")
-                                break
-                
-                if video_url:
-                    progress(1.0, desc="✅ Video generation successful!")
-                    # 直接返回视频URL，不下载到本地
-                    return video_url, f"✅ Video generation successful!\nTask ID: {task_id}\nVideo URL: {video_url}"
-                else:
-                    return None, f"❌ Generated video URL not found\nTask ID: {task_id}"
-                    
-            elif status == "failed":
-                error_msg = status_result.get("error", "Unknown error")
-                return None, f"❌ Video generation failed: {error_msg}\nTask ID: {task_id}"
-                
-            elif status in ["queued", "running"]:
-                progress(progress_val, desc=f"Generating video... (Status: {status})")
-                time.sleep(3)
-            else:
-                return None, f"❌ Unknown status: {status}\nTask ID: {task_id}"
+        # Wait for task completion (callback or polling)
+        video_url, error_message = wait_for_video(
+            task_id, progress, request=request, mode="image_to_video", model=_model_id_for("image_to_video", model),
+            prompt=prompt, params={"resolution": resolution, "duration": duration, "ratio": ratio, "seed": seed_value, "watermark": watermark}
+        )
+        if error_message:
+            return None, error_message
         
-        return None, f"❌ Video generation timeout\nTask ID: {task_id}"
+        return video_url, f"✅ Video generation successful!\nTask ID: {task_id}\nModel: {model}\nVideo URL: {video_url}" + (f"\n{route_note}" if route_note else "")
         
     except Exception as e:
         return None, f"❌ Error processing image: {str(e)}"
     finally:
+        MEMORY_BUDGET.release(reserved)
         # Clean up temporary files
-        if 'image_path' in locals() and os.path.exists(image_path):
-            try:
-                os.unlink(image_path)
-            except:
-                pass
+        scratch.release()
 
 @capture_logs_wrapper
-def first_last_frame_to_video(first_frame, last_frame, prompt, resolution="720p", duration=5, cf=False, seed=-1, watermark=True, progress=gr.Progress()):
+@track_activity
+@cancellable("first_last_frame")
+@usage_soft_limit
+def first_last_frame_to_video(first_frame, last_frame, prompt, resolution="720p", duration=5, cf=False, seed=-1, watermark=True, progress=gr.Progress(), request: gr.Request = None):
     """First-last frame to video generation function"""
     if not client:
         return None, "❌ Client not initialized, please check API configuration"
@@ -791,23 +4570,15 @@ def first_last_frame_to_video(first_frame, last_frame, prompt, resolution="720p"
     
     progress(0.1, desc="Processing uploaded images...")
     
-    # Save uploaded images to temporary files
+    reserved = MEMORY_BUDGET.acquire(estimate_image_memory([first_frame, last_frame]), SEEDANCE_MEMORY_WAIT)
+    if reserved is None:
+        return None, MEMORY_BUSY_MESSAGE
+    
+    # Compliant uploads are used as-is, others are reduced into the request's scratch dir
+    scratch = SCRATCH.create("flf")
     try:
-        # Process first frame
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-            if isinstance(first_frame, str):
-                first_frame_path = first_frame
-            else:
-                first_frame.save(tmp_file.name, format="JPEG")
-                first_frame_path = tmp_file.name
-        
-        # Process last frame
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-            if isinstance(last_frame, str):
-                last_frame_path = last_frame
-            else:
-                last_frame.save(tmp_file.name, format="JPEG")
-                last_frame_path = tmp_file.name
+        first_frame_path = prepare_image(first_frame, scratch, "First frame")
+        last_frame_path = prepare_image(last_frame, scratch, "Last frame")
         
         progress(0.2, desc="Creating first-last frame video task...")
         
@@ -826,6 +4597,9 @@ def first_last_frame_to_video(first_frame, last_frame, prompt, resolution="720p"
             seed=seed_value,
             watermark=watermark
         )
+        # 请求体已发送，释放编码占用的内存预算
+        MEMORY_BUDGET.release(reserved)
+        reserved = None
         
         if "error" in result:
             error_message = result['error']
@@ -856,95 +4630,28 @@ def first_last_frame_to_video(first_frame, last_frame, prompt, resolution="720p"
         
         progress(0.3, desc=f"Task created (ID: {task_id}), waiting for generation...")
         
-        # Wait for task completion
-        max_wait = 180  # 3 minutes timeout
-        start_time = time.time()
-        
-        while time.time() - start_time < max_wait:
-            status_result = client.get_task_status(task_id)
-            
-            if "error" in status_result:
-                return None, f"❌ Status query failed: {status_result['error']}"
-            
-            status = status_result.get("status", "")
-            progress_val = min(0.3 + (time.time() - start_time) / max_wait * 0.6, 0.9)
-            
-            if status == "succeeded":
-                progress(0.95, desc="Video generation completed, retrieving results...")
-                
-                # Get video URL - try multiple possible response formats
-                video_url = None
-                
-                # Format 1: Check content.video_url (BytePlus API format)
-                if "content" in status_result and isinstance(status_result["content"], dict):
-                    video_url = status_result["content"].get("video_url")
-                
-                # Format 2: Check data array
-                if not video_url and "data" in status_result and status_result["data"]:
-                    for item in status_result["data"]:
-                        if item.get("type") == "video_url":
-                            video_url = item.get("url")
-                            break
-                
-                # Format 3: Check direct video_url field
-                if not video_url and "video_url" in status_result:
-                    video_url = status_result["video_url"]
-                
-                # Format 4: Check result field
-                if not video_url and "result" in status_result:
-                    result = status_result["result"]
-                    if isinstance(result, dict):
-                        video_url = result.get("video_url") or result.get("url")
-                    elif isinstance(result, list) and result:
-                        for item in result:
-                            if isinstance(item, dict) and ("video_url" in item or "url" in item):
-                                video_url = item.get("video_url") or item.get("url")
-                                break
-                
-                # Format 5: Check outputs field
-                if not video_url and "outputs" in status_result:
-                    outputs = status_result["outputs"]
-                    if isinstance(outputs, list) and outputs:
-                        for item in outputs:
-                            if isinstance(item, dict) and ("video_url" in item or "url" in item):
-                                video_url = item.get("video_url") or item.get("url")
-                                break
-                
-                if video_url:
-                    progress(1.0, desc="✅ Video generation successful!")
-                    return video_url, f"✅ Video generation successful!\nTask ID: {task_id}\nVideo URL: {video_url}"
-                else:
-                    return None, f"❌ Generated video URL not found\nTask ID: {task_id}"
-                    
-            elif status == "failed":
-                error_msg = status_result.get("error", "Unknown error")
-                return None, f"❌ Video generation failed: {error_msg}\nTask ID: {task_id}"
-                
-            elif status in ["queued", "running"]:
-                progress(progress_val, desc=f"Generating video... (Status: {status})")
-                time.sleep(3)
-            else:
-                return None, f"❌ Unknown status: {status}\nTask ID: {task_id}"
+        # Wait for task completion (callback or polling)
+        video_url, error_message = wait_for_video(
+            task_id, progress, request=request, mode="first_last_frame", model=MODEL_SEEDANCE_LITE_I2V_API,
+            prompt=prompt, params={"resolution": resolution, "duration": duration, "cf": cf, "seed": seed_value, "watermark": watermark}
+        )
+        if error_message:
+            return None, error_message
         
-        return None, f"❌ Video generation timeout\nTask ID: {task_id}"
+        return video_url, f"✅ Video generation successful!\nTask ID: {task_id}\nVideo URL: {video_url}"
         
     except Exception as e:
         return None, f"❌ Error processing images: {str(e)}"
     finally:
+        MEMORY_BUDGET.release(reserved)
         # Clean up temporary files
-        if 'first_frame_path' in locals() and os.path.exists(first_frame_path):
-            try:
-                os.unlink(first_frame_path)
-            except:
-                pass
-        if 'last_frame_path' in locals() and os.path.exists(last_frame_path):
-            try:
-                os.unlink(last_frame_path)
-            except:
-                pass
+        scratch.release()
 
 @capture_logs_wrapper
-def image_refs_to_video(ref_image1, ref_image2, ref_image3, ref_image4, prompt, resolution="720p", duration=5, ratio="16:9", seed=-1, watermark=True, progress=gr.Progress()):
+@track_activity
+@cancellable("image_refs")
+@usage_soft_limit
+def image_refs_to_video(ref_image1, ref_image2, ref_image3, ref_image4, prompt, resolution="720p", duration=5, ratio="16:9", seed=-1, watermark=True, progress=gr.Progress(), request: gr.Request = None):
     """Image references to video generation function"""
     if not client:
         return None, "❌ Client not initialized, please check API configuration"
@@ -962,21 +4669,15 @@ def image_refs_to_video(ref_image1, ref_image2, ref_image3, ref_image4, prompt,
     
     progress(0.1, desc=f"Processing {len(ref_images_paths)} reference images...")
     
-    # Save uploaded images to temporary files
-    temp_files = []
+    reserved = MEMORY_BUDGET.acquire(estimate_image_memory(ref_images_paths), SEEDANCE_MEMORY_WAIT)
+    if reserved is None:
+        return None, MEMORY_BUSY_MESSAGE
+    
+    # Compliant uploads are used as-is, others are reduced into the request's scratch dir
+    scratch = SCRATCH.create("refs")
     try:
-        processed_images = []
-        for i, image in enumerate(ref_images_paths):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-                if isinstance(image, str):
-                    # If it's a file path
-                    image_path = image
-                else:
-                    # If it's a PIL Image object
-                    image.save(tmp_file.name, format="JPEG")
-                    image_path = tmp_file.name
-                processed_images.append(image_path)
-                temp_files.append(image_path)
+        processed_images = [prepare_image(image, scratch, f"Reference image {i + 1}")
+                            for i, image in enumerate(ref_images_paths)]
         
         progress(0.2, desc="Creating image refs video task...")
         
@@ -994,6 +4695,9 @@ def image_refs_to_video(ref_image1, ref_image2, ref_image3, ref_image4, prompt,
             seed=seed_value,
             watermark=watermark
         )
+        # 请求体已发送，释放编码占用的内存预算
+        MEMORY_BUDGET.release(reserved)
+        reserved = None
         
         if "error" in result:
             error_message = result['error']
@@ -1014,102 +4718,675 @@ def image_refs_to_video(ref_image1, ref_image2, ref_image3, ref_image4, prompt,
         if not task_id:
             return None, """❌ Failed to get task ID
 
-🔧 可能的解决方案：
-1. 请登录 BytePlus 控制台 (https://console.byteplus.com/modelark)
-2. 在"模型广场"中激活 Seedance 视频生成模型
-3. 确保账户有足够的权限和余额
-4. 检查 API 密钥是否正确配置
+🔧 可能的解决方案：
+1. 请登录 BytePlus 控制台 (https://console.byteplus.com/modelark)
+2. 在"模型广场"中激活 Seedance 视频生成模型
+3. 确保账户有足够的权限和余额
+4. 检查 API 密钥是否正确配置
+
+💡 提示：视频生成模型需要单独激活才能使用"""
+        
+        progress(0.3, desc=f"Task created (ID: {task_id}), waiting for generation...")
+        
+        # Wait for task completion (callback or polling)
+        video_url, error_message = wait_for_video(
+            task_id, progress, request=request, mode="image_refs", model=MODEL_SEEDANCE_LITE_I2V_API,
+            prompt=prompt, params={"resolution": resolution, "duration": duration, "ratio": ratio, "seed": seed_value,
+                                   "watermark": watermark, "reference_images": len(processed_images)}
+        )
+        if error_message:
+            return None, error_message
+        
+        return video_url, f"✅ Video generation successful with {len(ref_images_paths)} reference images!\nTask ID: {task_id}\nVideo URL: {video_url}"
+        
+    except Exception as e:
+        return None, f"❌ Error processing images: {str(e)}"
+    finally:
+        MEMORY_BUDGET.release(reserved)
+        # Clean up temporary files
+        scratch.release()
+
+def _variant_seeds(seed, variants: int) -> List[int]:
+    """Distinct seeds for N variants: consecutive from the given seed, or from a random base"""
+    base = random.randint(0, 4294967295) if seed == -1 else int(seed)
+    return [(base + i) % 4294967296 for i in range(variants)]
+
+
+def defer_generation(kind: str, model: str, prompt: str, params: Dict[str, Any], seeds: List[Optional[int]],
+                     image: Optional[str] = None, request=None) -> str:
+    """Queue non-urgent work in the deferred queue, one job per seed, owned by the requesting user; returns the status text"""
+    user_key = _user_key(request)
+    job_ids = [DEFERRED.submit(kind, model, prompt, dict(params, seed=seed), image, user_key) for seed in seeds]
+    when = f"interactive load is below {DEFERRED.max_load}"
+    if DEFERRED.windows:
+        when += f" or during off-peak hours ({DEFERRED.windows_spec})"
+    return (f"🌙 Queued {len(job_ids)} deferred job(s): {', '.join(f'#{job_id}' for job_id in job_ids)}\n"
+            f"They are submitted when {when}. Track them in the 🌙 Deferred tab; "
+            f"finished videos also appear in History.")
+
+
+def generate_variants(submit, seeds: List[int], mode: str, model_id: str, request=None,
+                      prompt: str = "", params: Optional[Dict[str, Any]] = None):
+    """Submit one task per seed concurrently; yields (seed, video_url, message) as each one finishes"""
+    scope = IN_FLIGHT.current_scope()
+    
+    def run(seed):
+        # Pool threads submit on behalf of the handler call, so its cancels apply to them
+        with IN_FLIGHT.scope(scope):
+            return submit_and_wait(seed)
+    
+    def submit_and_wait(seed):
+        result = submit(seed)
+        if "error" in result:
+            return seed, None, f"❌ Task creation failed: {result['error']}"
+        task_id = result.get("id")
+        if not task_id:
+            return seed, None, "❌ Failed to get task ID"
+        video_url, error_message = wait_for_video(task_id, lambda *args, **kwargs: None,
+                                                  request=request, mode=mode, model=model_id,
+                                                  prompt=prompt, params=dict(params or {}, seed=seed))
+        if error_message:
+            return seed, None, error_message.replace("\n", " | ")
+        return seed, video_url, f"✅ Task ID: {task_id}"
+    
+    with ThreadPoolExecutor(max_workers=len(seeds)) as pool:
+        futures = [pool.submit(run, seed) for seed in seeds]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _stream_variants(submit, seeds: List[int], mode: str, model_id: str, progress, request,
+                     prompt: str = "", params: Optional[Dict[str, Any]] = None, note: str = ""):
+    """Yield (video, gallery, status) updates as variants complete"""
+    gallery = []
+    lines = []
+    header = f"🎲 Generating {len(seeds)} variants with {model_id} (seeds: {', '.join(str(s) for s in seeds)})"
+    if note:
+        header += f"\n{note}"
+    progress(0.1, desc=f"Submitting {len(seeds)} variants...")
+    yield None, gallery, header
+    
+    for done, (seed, video_url, message) in enumerate(generate_variants(submit, seeds, mode, model_id, request, prompt, params), start=1):
+        if video_url:
+            gallery.append((video_url, f"Seed {seed}"))
+        lines.append(f"Seed {seed}: {message}")
+        progress(0.1 + 0.9 * done / len(seeds), desc=f"{done}/{len(seeds)} variants finished")
+        yield (gallery[0][0] if gallery else None), list(gallery), f"{header}\n" + "\n".join(lines)
+
+
+@track_activity
+@cancellable("text_to_video")
+@usage_soft_limit
+def text_to_video_variants(prompt, model, resolution="720p", duration=5, ratio="16:9", seed=-1, watermark=True, variants=1, deferred=False, progress=gr.Progress(), request: gr.Request = None):
+    """Text-to-video with optional multi-seed variants streamed into a gallery, or queued for off-peak"""
+    variants = min(int(variants), SEEDANCE_MAX_VARIANTS)
+    if deferred:
+        if not prompt.strip():
+            yield None, None, "❌ Please enter video description text"
+            return
+        error = validate_generation_request(_model_id_for("text_to_video", model), "text_to_video", resolution, duration, ratio)
+        if error:
+            yield None, None, f"❌ Invalid parameters: {error}"
+            return
+        seeds = _variant_seeds(seed, variants) if variants > 1 else [None if seed == -1 else int(seed)]
+        yield None, None, defer_generation("text_to_video", model, prompt,
+                                           {"resolution": resolution, "duration": duration, "ratio": ratio, "watermark": watermark},
+                                           seeds, request=request)
+        return
+    model, route_note = resolve_model("text_to_video", model, resolution, duration, ratio)
+    if variants <= 1:
+        video, status = text_to_video(prompt, model, resolution, duration, ratio, seed, watermark, progress=progress, request=request)
+        yield video, None, status + (f"\n{route_note}" if route_note else "")
+        return
+    
+    if not client:
+        yield None, None, "❌ Client not initialized, please check API configuration"
+        return
+    
+    if not prompt.strip():
+        yield None, None, "❌ Please enter video description text"
+        return
+    
+    def submit(variant_seed):
+        return client.create_text_to_video_task(
+            prompt=prompt,
+            model=model,
+            resolution=resolution,
+            duration=duration,
+            ratio=ratio,
+            seed=variant_seed,
+            watermark=watermark
+        )
+    
+    try:
+        yield from _stream_variants(submit, _variant_seeds(seed, variants), "text_to_video",
+                                    _model_id_for("text_to_video", model), progress, request, prompt,
+                                    {"resolution": resolution, "duration": duration, "ratio": ratio, "watermark": watermark},
+                                    route_note)
+    except Exception as e:
+        yield None, None, f"❌ Error: {str(e)}"
+
 
-💡 提示：视频生成模型需要单独激活才能使用"""
+@track_activity
+@cancellable("image_to_video")
+@usage_soft_limit
+def image_to_video_variants(image, prompt, model, resolution="720p", duration=5, ratio="adaptive", seed=-1, watermark=True, variants=1, deferred=False, progress=gr.Progress(), request: gr.Request = None):
+    """Image-to-video with optional multi-seed variants; the image is encoded only once"""
+    variants = min(int(variants), SEEDANCE_MAX_VARIANTS)
+    if deferred:
+        if image is None:
+            yield None, None, "❌ Please upload an image"
+            return
+        scratch = SCRATCH.create("i2v-deferred")
+        try:
+            # 先在这里完成图片预处理，队列里只保存要发送的文件
+            image_path = prepare_image(image, scratch)
+            error = validate_generation_request(_model_id_for("image_to_video", model), "image_to_video", resolution, duration, ratio,
+                                                images=[("first_frame", image_path)])
+            if error:
+                yield None, None, f"❌ Invalid parameters: {error}"
+                return
+            seeds = _variant_seeds(seed, variants) if variants > 1 else [None if seed == -1 else int(seed)]
+            yield None, None, defer_generation("image_to_video", model, prompt,
+                                               {"resolution": resolution, "duration": duration, "ratio": ratio, "watermark": watermark},
+                                               seeds, image_path, request)
+        except Exception as e:
+            yield None, None, f"❌ Error processing image: {str(e)}"
+        finally:
+            scratch.release()
+        return
+    model, route_note = resolve_model("image_to_video", model, resolution, duration, ratio)
+    if variants <= 1:
+        video, status = image_to_video(image, prompt, model, resolution, duration, ratio, seed, watermark, progress=progress, request=request)
+        yield video, None, status + (f"\n{route_note}" if route_note else "")
+        return
+    
+    if not client:
+        yield None, None, "❌ Client not initialized, please check API configuration"
+        return
+    
+    if image is None:
+        yield None, None, "❌ Please upload an image"
+        return
+    
+    progress(0.05, desc="Processing uploaded image...")
+    
+    reserved = MEMORY_BUDGET.acquire(estimate_image_memory([image]), SEEDANCE_MEMORY_WAIT)
+    if reserved is None:
+        yield None, None, MEMORY_BUSY_MESSAGE
+        return
+    
+    scratch = SCRATCH.create("i2v-variants")
+    # The encoded image is shared by every variant; its budget is returned once all are submitted
+    encoded = {"data_url": None, "reserved": reserved, "unsubmitted": variants}
+    encoded_lock = threading.Lock()
+    
+    def release_encoded():
+        with encoded_lock:
+            encoded["data_url"] = None
+            MEMORY_BUDGET.release(encoded.pop("reserved", None))
+    
+    try:
+        image_path = prepare_image(image, scratch)
         
-        progress(0.3, desc=f"Task created (ID: {task_id}), waiting for generation...")
+        # 预检一次，然后所有变体共享同一份 base64 编码
+        model_id = _model_id_for("image_to_video", model)
+        error = validate_generation_request(model_id, "image_to_video", resolution, duration, ratio,
+                                            images=[("first_frame", image_path)])
+        if error:
+            yield None, None, f"❌ Task creation failed: Invalid parameters: {error}"
+            return
+        encoded["data_url"] = client.image_to_data_url(image_path)
         
-        # Wait for task completion
-        max_wait = 180  # 3 minutes timeout
-        start_time = time.time()
+        def submit(variant_seed):
+            try:
+                return client.create_image_to_video_task(
+                    image_url=encoded["data_url"],
+                    prompt=prompt,
+                    model=model,
+                    resolution=resolution,
+                    duration=duration,
+                    ratio=ratio,
+                    seed=variant_seed,
+                    watermark=watermark
+                )
+            finally:
+                with encoded_lock:
+                    encoded["unsubmitted"] -= 1
+                    last = encoded["unsubmitted"] == 0
+                if last:
+                    release_encoded()
         
-        while time.time() - start_time < max_wait:
-            status_result = client.get_task_status(task_id)
-            
-            if "error" in status_result:
-                return None, f"❌ Status query failed: {status_result['error']}"
-            
-            status = status_result.get("status", "")
-            progress_val = min(0.3 + (time.time() - start_time) / max_wait * 0.6, 0.9)
-            
-            if status == "succeeded":
-                progress(0.95, desc="Video generation completed, retrieving results...")
-                
-                # Get video URL - try multiple possible response formats
-                video_url = None
+        yield from _stream_variants(submit, _variant_seeds(seed, variants), "image_to_video", model_id, progress, request, prompt,
+                                    {"resolution": resolution, "duration": duration, "ratio": ratio, "watermark": watermark},
+                                    route_note)
+    except Exception as e:
+        yield None, None, f"❌ Error processing image: {str(e)}"
+    finally:
+        release_encoded()
+        scratch.release()
+
+
+@track_activity
+@cancellable("storyboard")
+@usage_soft_limit
+def storyboard_to_video(segment_prompts, image, model, resolution="720p", duration=5, ratio="16:9", seed=-1, watermark=True, deferred=False, progress=gr.Progress(), request: gr.Request = None):
+    """Chain several segments into one long video, handing each clip's last frame to the next"""
+    segments = [line.strip() for line in (segment_prompts or "").splitlines() if line.strip()]
+    if not segments:
+        yield None, "❌ Please enter at least one segment prompt (one per line)"
+        return
+    if len(segments) > SEEDANCE_MAX_STORYBOARD_SEGMENTS:
+        yield None, f"❌ At most {SEEDANCE_MAX_STORYBOARD_SEGMENTS} segments are supported"
+        return
+    
+    if deferred:
+        scratch = SCRATCH.create("storyboard-deferred")
+        try:
+            image_path = prepare_image(image, scratch, "Initial image")
+            yield None, defer_generation("storyboard", model, "\n".join(segments),
+                                         {"segments": "\n".join(segments), "resolution": resolution, "duration": duration,
+                                          "ratio": ratio, "watermark": watermark},
+                                         [seed], image_path, request)
+        except Exception as e:
+            yield None, f"❌ Error processing image: {str(e)}"
+        finally:
+            scratch.release()
+        return
+    
+    if not client:
+        yield None, "❌ Client not initialized, please check API configuration"
+        return
+    
+    # 无初始图片时第一段走文生视频，之后每段以上一段尾帧做图生视频
+    t2v_model = model if model in client.models["text_to_video"] else "Bytedance-Seedance-1.0-Lite-t2v"
+    seed_value = None if seed == -1 else int(seed)
+    scratch = SCRATCH.create("storyboard")
+    lines = [f"🎬 Storyboard with {len(segments)} segments"]
+    output_path = None
+    
+    try:
+        frame_path = prepare_image(image, scratch, "Initial image")
+        
+        downloads = []
+        # 下载与尾帧提取在后台进行，与下一段的上游排队时间重叠
+        with ThreadPoolExecutor(max_workers=2) as io_pool:
+            for index, segment_prompt in enumerate(segments):
+                label = f"Segment {index + 1}/{len(segments)}"
+                progress(index / len(segments), desc=f"{label}: creating task...")
                 
-                # Format 1: Check content.video_url (BytePlus API format)
-                if "content" in status_result and isinstance(status_result["content"], dict):
-                    video_url = status_result["content"].get("video_url")
+                if frame_path:
+                    result = client.create_image_to_video_task(
+                        image_path=frame_path,
+                        prompt=segment_prompt,
+                        model=model,
+                        resolution=resolution,
+                        duration=duration,
+                        seed=seed_value,
+                        watermark=watermark
+                    )
+                    mode = "image_to_video"
+                else:
+                    result = client.create_text_to_video_task(
+                        prompt=segment_prompt,
+                        model=t2v_model,
+                        resolution=resolution,
+                        duration=duration,
+                        ratio=ratio,
+                        seed=seed_value,
+                        watermark=watermark
+                    )
+                    mode = "text_to_video"
                 
-                # Format 2: Check data array
-                if not video_url and "data" in status_result and status_result["data"]:
-                    for item in status_result["data"]:
-                        if item.get("type") == "video_url":
-                            video_url = item.get("url")
-                            break
+                if "error" in result:
+                    lines.append(f"❌ {label}: task creation failed: {result['error']}")
+                    yield None, "\n".join(lines)
+                    return
+                task_id = result.get("id")
+                if not task_id:
+                    lines.append(f"❌ {label}: failed to get task ID")
+                    yield None, "\n".join(lines)
+                    return
                 
-                # Format 3: Check direct video_url field
-                if not video_url and "video_url" in status_result:
-                    video_url = status_result["video_url"]
+                lines.append(f"⏳ {label}: task {task_id} submitted")
+                yield None, "\n".join(lines)
                 
-                # Format 4: Check result field
-                if not video_url and "result" in status_result:
-                    result = status_result["result"]
-                    if isinstance(result, dict):
-                        video_url = result.get("video_url") or result.get("url")
-                    elif isinstance(result, list) and result:
-                        for item in result:
-                            if isinstance(item, dict) and ("video_url" in item or "url" in item):
-                                video_url = item.get("video_url") or item.get("url")
-                                break
+                video_url, error_message = wait_for_video(
+                    task_id, lambda *args, **kwargs: None, request=request, mode="storyboard",
+                    model=_model_id_for(mode, model if mode == "image_to_video" else t2v_model),
+                    params={"resolution": resolution, "duration": duration}, archive=False
+                )
+                if error_message:
+                    lines.append(f"❌ {label}: {error_message}")
+                    yield None, "\n".join(lines)
+                    return
                 
-                # Format 5: Check outputs field
-                if not video_url and "outputs" in status_result:
-                    outputs = status_result["outputs"]
-                    if isinstance(outputs, list) and outputs:
-                        for item in outputs:
-                            if isinstance(item, dict) and ("video_url" in item or "url" in item):
-                                video_url = item.get("video_url") or item.get("url")
-                                break
+                clip_path = scratch.file(name=f"segment_{index:02d}.mp4")
+                # The download holds its own reference so the directory outlives an early exit
+                scratch.retain()
+                download = io_pool.submit(download_video, video_url, clip_path)
+                download.add_done_callback(lambda _: scratch.release())
+                downloads.append(download)
                 
-                if video_url:
-                    progress(1.0, desc="✅ Video generation successful!")
-                    return video_url, f"✅ Video generation successful with {len(ref_images_paths)} reference images!\nTask ID: {task_id}\nVideo URL: {video_url}"
-                else:
-                    return None, f"❌ Generated video URL not found\nTask ID: {task_id}"
-                    
-            elif status == "failed":
-                error_msg = status_result.get("error", "Unknown error")
-                return None, f"❌ Video generation failed: {error_msg}\nTask ID: {task_id}"
+                if index < len(segments) - 1:
+                    progress((index + 0.9) / len(segments), desc=f"{label}: extracting last frame...")
+                    frame_path = scratch.file(name=f"last_frame_{index:02d}.jpg")
+                    try:
+                        # Seek straight to the tail of the remote clip instead of waiting for the download
+                        extract_last_frame(video_url, frame_path)
+                    except RuntimeError:
+                        extract_last_frame(download.result(), frame_path)
                 
-            elif status in ["queued", "running"]:
-                progress(progress_val, desc=f"Generating video... (Status: {status})")
-                time.sleep(3)
-            else:
-                return None, f"❌ Unknown status: {status}\nTask ID: {task_id}"
+                lines.append(f"✅ {label}: done")
+                yield None, "\n".join(lines)
+            
+            progress(0.95, desc="Waiting for segment downloads...")
+            clip_paths = [download.result() for download in downloads]
         
-        return None, f"❌ Video generation timeout\nTask ID: {task_id}"
+        progress(0.98, desc="Concatenating segments...")
+        output_path = concat_videos(clip_paths, scratch.file(name="storyboard.mp4"))
+        for clip_path in clip_paths:
+            os.unlink(clip_path)
         
+        progress(1.0, desc="✅ Storyboard complete!")
+        lines.append(f"✅ Storyboard complete: {len(segments)} segments concatenated without re-encoding")
+        yield output_path, "\n".join(lines)
     except Exception as e:
-        return None, f"❌ Error processing images: {str(e)}"
+        lines.append(f"❌ Error: {str(e)}")
+        yield None, "\n".join(lines)
     finally:
-        # Clean up temporary files
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                try:
-                    os.unlink(temp_file)
-                except:
-                    pass
+        # Keep the final video around long enough for Gradio to serve it
+        scratch.release(linger=SEEDANCE_SCRATCH_OUTPUT_LINGER if output_path else 0)
+
+
+HISTORY_MODES = ["All", "text_to_video", "image_to_video", "first_last_frame", "image_refs"]
+
+
+def _history_caption(row: Dict[str, Any]) -> str:
+    created = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["created_at"] or 0))
+    prompt = (row["prompt"] or "").strip()
+    if len(prompt) > 60:
+        prompt = prompt[:57] + "..."
+    return f"{created} · {row['mode']} · {prompt or '(no prompt)'}"
+
+
+def _history_owner(request) -> Optional[str]:
+    """User whose History and deferred jobs a request may see; None when History is shared by everyone"""
+    return None if SEEDANCE_HISTORY_SHARED else _user_key(request)
+
+
+def load_history_page(query, mode_filter, state, direction="first", request=None):
+    """Load one page of the user's history (first/older/newer) into the gallery and table"""
+    state = dict(state or {})
+    cursors = list(state.get("cursors") or [None])
+    rows = state.get("rows") or []
+    
+    if direction == "older":
+        if len(rows) == SEEDANCE_HISTORY_PAGE_SIZE:
+            cursors.append(rows[-1]["id"])
+    elif direction == "newer":
+        if len(cursors) > 1:
+            cursors.pop()
+    else:
+        cursors = [None]
+    
+    mode = None if mode_filter in (None, "", "All") else mode_filter
+    rows = HISTORY.page(_history_owner(request), before_id=cursors[-1], limit=SEEDANCE_HISTORY_PAGE_SIZE, query=query, mode=mode)
+    
+    gallery = []
+    gallery_task_ids = []
+    for row in rows:
+        # 优先使用本地封面/预览，避免加载完整视频
+        media = next((path for path in (row["poster_path"], row["preview_path"]) if path and os.path.exists(path)), None)
+        media = media or row["video_url"]
+        if media:
+            gallery.append((media, _history_caption(row)))
+            gallery_task_ids.append(row["task_id"])
+    
+    table = [
+        [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["created_at"] or 0)), row["mode"], row["model"],
+         row["status"], (row["prompt"] or "")[:120], row["task_id"]]
+        for row in rows
+    ]
+    
+    state = {"cursors": cursors, "rows": rows, "gallery_task_ids": gallery_task_ids}
+    page_info = f"Page {len(cursors)} · {len(rows)} entries" + (" · more available" if len(rows) == SEEDANCE_HISTORY_PAGE_SIZE else "")
+    return gallery, table, page_info, state
+
+
+def make_history_loader(direction: str):
+    """History page handler for one navigation direction, bound to the requesting user"""
+    def load(query, mode_filter, state, request: gr.Request):
+        return load_history_page(query, mode_filter, state, direction, request)
+    return load
+
+
+def show_history_item(state, evt: gr.SelectData):
+    """Show the selected history entry's video and details"""
+    task_ids = (state or {}).get("gallery_task_ids") or []
+    if evt.index is None or evt.index >= len(task_ids):
+        return None, ""
+    row = HISTORY.get(task_ids[evt.index])
+    if not row:
+        return None, ""
+    
+    video = row["video_path"] if row["video_path"] and os.path.exists(row["video_path"]) else row["video_url"]
+    timing = []
+    if row["queue_seconds"] is not None:
+        timing.append(f"queued {row['queue_seconds']:.0f}s")
+    if row["render_seconds"] is not None:
+        timing.append(f"rendered {row['render_seconds']:.0f}s")
+    details = (f"**Task ID:** {row['task_id']}  \n**Mode:** {row['mode']}  \n**Model:** {row['model']}  \n"
+               f"**Status:** {row['status']}{' (' + ', '.join(timing) + ')' if timing else ''}  \n"
+               f"**Parameters:** {row['params']}  \n**Prompt:** {row['prompt'] or '(none)'}")
+    return video, details
+
+
+def load_deferred_jobs(request: gr.Request = None):
+    """Deferred queue summary and the user's most recent jobs"""
+    counts = DEFERRED.counts()
+    summary = " · ".join(f"{counts.get(status, 0)} {status}" for status in ("pending", "running", "succeeded", "failed", "cancelled"))
+    blocked = DEFERRED.blocked_reason()
+    if blocked:
+        dispatcher = f"⏸️ holding jobs back: {blocked}"
+    elif DEFERRED.in_window():
+        dispatcher = "🟢 dispatching (off-peak window)"
+    else:
+        dispatcher = f"🟢 dispatching (interactive load below {DEFERRED.max_load})"
+    windows = DEFERRED.windows_spec or "none configured"
+    info = (f"**Queue:** {summary}  \n**This worker:** {dispatcher}, {DEFERRED.running()}/{DEFERRED.concurrency} running  \n"
+            f"**Off-peak windows:** {windows}")
+    
+    now = time.time()
+    table = []
+    for job in DEFERRED.jobs(user_key=_history_owner(request)):
+        progress = job["progress"] or ""
+        if job["status"] == "pending" and job["position"]:
+            progress = f"#{job['position']} in queue · {progress}"
+        elif job["status"] == "running" and job["started_at"]:
+            progress = f"{progress} ({now - job['started_at']:.0f}s)"
+        outcome = job["result"] or (job["error"] or "").split("\n")[0]
+        table.append([job["id"], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job["created_at"] or 0)), job["kind"],
+                      job["model"], job["status"], progress, outcome, (job["prompt"] or "")[:120]])
+    return info, table
+
+
+def show_deferred_result(job_id, request: gr.Request = None):
+    """Video and details of one of the user's deferred jobs"""
+    if not job_id:
+        return None, "❌ Please enter a job ID from the table"
+    job = DEFERRED.get(int(job_id), _history_owner(request))
+    if not job:
+        return None, f"❌ No deferred job #{job_id}"
+    video = job["result"] if job["status"] == "succeeded" else None
+    details = (f"**Job #{job['id']}** · {job['kind']} · {job['model']}  \n**Status:** {job['status']} "
+               f"(attempts: {job['attempts']})  \n**Task ID:** {job['task_id'] or '-'}  \n"
+               f"**Progress:** {job['progress'] or '-'}")
+    if job["error"]:
+        details += f"  \n**Error:** {job['error']}"
+    return video, details
+
+
+def cancel_deferred_job(job_id, request: gr.Request = None):
+    if not job_id:
+        return "❌ Please enter a job ID from the table"
+    return DEFERRED.cancel(int(job_id), _history_owner(request))
+
+
+USAGE_WINDOWS = {"Last hour": 1, "Last 24 hours": 24, "Last 7 days": 24 * 7, "All time": None}
+
+
+def load_usage_summary(window, request: gr.Request = None):
+    """The caller's own usage totals and per model/resolution/duration breakdown for the usage tab
+
+    Other users' usage is only reported to operators by /admin/usage.
+    """
+    user_key = _user_key(request)
+    summary = USAGE.user_summary(user_key, USAGE_WINDOWS.get(window, 24))
+    info = f"**Your usage, {window.lower()}:** {summary['tasks']:,} tasks · {summary['tokens']:,} tokens"
+    if summary["cost"] is not None:
+        info += f" · ≈ {summary['cost']:,.2f} (priced models only)"
+    
+    used = USAGE.user_tokens(user_key)
+    info += f"  \n**Recent:** {used:,} tokens in the last {USAGE.window / 60:.0f} min, deferred jobs included"
+    if USAGE.soft_limit > 0:
+        delay, _ = USAGE.throttle_delay(user_key)
+        info += f" (soft limit {USAGE.soft_limit:,}" + (f", new jobs wait {delay:.0f}s)" if delay else ")")
+    
+    by_model = [
+        [group["model"], group["resolution"], group["duration"], group["tasks"], group["tokens"],
+         round(group["avg_tokens"] or 0), "" if group["cost"] is None else round(group["cost"], 4)]
+        for group in summary["by_model"]
+    ]
+    return info, by_model
+
+
+def _model_id_for(mode: str, model_name: str) -> str:
+    """Resolve a UI model name to its API model ID ("Auto" offers Pro's parameters)"""
+    if model_name == AUTO_MODEL:
+        model_name = ModelRouter.PRO_MODEL
+    if client:
+        return client.models[mode].get(model_name, model_name)
+    return model_name
+
+
+def update_parameter_controls(mode: str, model_name: str, resolution, duration, ratio):
+    """Restrict resolution/duration/ratio controls to what the selected model supports"""
+    choices = capability_choices(_model_id_for(mode, model_name), mode)
+    duration = min(max(int(duration), choices["min_duration"]), choices["max_duration"])
+    return (
+        gr.update(choices=choices["resolutions"],
+                  value=resolution if resolution in choices["resolutions"] else choices["resolutions"][0]),
+        gr.update(minimum=choices["min_duration"], maximum=choices["max_duration"], value=duration),
+        gr.update(choices=choices["ratios"],
+                  value=ratio if ratio in choices["ratios"] else choices["ratios"][0])
+    )
+
+
+_CLIENT_RESIZE_SCRIPT = """
+<script>
+(() => {
+  const cfg = __CONFIG__;
+  // 浏览器已能直接上传的格式；其余 (BMP/TIFF/HEIC 等) 一律转码
+  const direct = ["image/jpeg", "image/png", "image/webp"];
+
+  async function encode(canvas, type) {
+    if (canvas.convertToBlob) return canvas.convertToBlob({type, quality: cfg.quality});
+    return new Promise((resolve) => canvas.toBlob(resolve, type, cfg.quality));
+  }
+
+  async function shrink(file) {
+    if (!file.type.startsWith("image/") || file.type === "image/gif") return file;
+    let bitmap;
+    try {
+      bitmap = await createImageBitmap(file, {imageOrientation: "from-image"});
+    } catch (e) {
+      // 浏览器无法解码的图片原样上传，由服务端处理
+      return file;
+    }
+    const {width, height} = bitmap;
+    let scale = Math.min(1, cfg.maxSide / Math.max(width, height));
+    // 不要把窄边缩到平台下限以下
+    scale = Math.max(scale, Math.min(1, cfg.minSide / Math.min(width, height)));
+    if (scale === 1 && direct.includes(file.type) && file.size <= cfg.maxBytes) {
+      bitmap.close();
+      return file;
+    }
+    const w = Math.round(width * scale), h = Math.round(height * scale);
+    const canvas = window.OffscreenCanvas ? new OffscreenCanvas(w, h) : Object.assign(document.createElement("canvas"), {width: w, height: h});
+    const ctx = canvas.getContext("2d");
+    ctx.imageSmoothingQuality = "high";
+    ctx.drawImage(bitmap, 0, 0, w, h);
+    bitmap.close();
+    let blob = await encode(canvas, "image/webp");
+    // Safari 不支持 WebP 编码，会静默返回 PNG
+    if (!blob || blob.type !== "image/webp") blob = await encode(canvas, "image/jpeg");
+    if (!blob || (blob.size >= file.size && scale === 1 && direct.includes(file.type))) return file;
+    const ext = blob.type === "image/webp" ? ".webp" : ".jpg";
+    const name = file.name.replace(/\\.[^.]*$/, "") + ext;
+    console.debug(`seedance: ${file.name} ${width}x${height} ${file.size}B -> ${name} ${w}x${h} ${blob.size}B`);
+    return new File([blob], name, {type: blob.type, lastModified: file.lastModified});
+  }
+
+  async function upload(input, files) {
+    const transfer = new DataTransfer();
+    for (const file of await Promise.all(files.map(shrink))) transfer.items.add(file);
+    input.files = transfer.files;
+    input.dataset.resized = "1";
+    input.dispatchEvent(new Event("change", {bubbles: true}));
+  }
+
+  // 捕获阶段拦截 Gradio 上传组件的文件选择与拖放，缩放后再交给组件上传
+  window.addEventListener("change", (event) => {
+    const input = event.target;
+    if (!(input instanceof HTMLInputElement) || input.type !== "file" || !input.closest(".client-resize")) return;
+    if (input.dataset.resized) {
+      delete input.dataset.resized;
+      return;
+    }
+    if (!input.files || !input.files.length) return;
+    event.stopImmediatePropagation();
+    upload(input, Array.from(input.files));
+  }, true);
+
+  window.addEventListener("drop", (event) => {
+    const zone = event.target instanceof Element && event.target.closest(".client-resize");
+    const input = zone && zone.querySelector('input[type="file"]');
+    if (!input || !event.dataTransfer || !event.dataTransfer.files.length) return;
+    event.preventDefault();
+    event.stopImmediatePropagation();
+    // 让组件退出拖拽高亮状态
+    event.target.dispatchEvent(new DragEvent("dragleave", {bubbles: true}));
+    upload(input, Array.from(event.dataTransfer.files));
+  }, true);
+})();
+</script>
+"""
+
+
+def client_resize_head() -> str:
+    """<head> script that downscales uploads in the browser, or "" when SEEDANCE_CLIENT_RESIZE is off"""
+    if not SEEDANCE_CLIENT_RESIZE:
+        return ""
+    config = {
+        "maxSide": SEEDANCE_CLIENT_RESIZE_MAX_SIDE,
+        "minSide": _IMAGE_LIMITS["min_side"],
+        "maxBytes": SEEDANCE_IMAGE_MAX_BYTES,
+        "quality": SEEDANCE_CLIENT_RESIZE_QUALITY
+    }
+    return _CLIENT_RESIZE_SCRIPT.replace("__CONFIG__", json.dumps(config))
+
 
 def create_demo():
     """Create Gradio demo interface"""
     
+    # Parameter choices come from the model capability matrix
+    t2v_choices = capability_choices(_model_id_for("text_to_video", "Bytedance-Seedance-1.0-Lite-t2v"), "text_to_video")
+    i2v_choices = capability_choices(_model_id_for("image_to_video", "Bytedance-Seedance-1.0-Lite-i2v"), "image_to_video")
+    flf_choices = capability_choices(_model_id_for("first_last_frame", "Bytedance-Seedance-1.0-Lite-i2v"), "first_last_frame")
+    ref_choices = capability_choices(_model_id_for("image_refs", "Bytedance-Seedance-1.0-Lite-i2v"), "image_refs")
+    sb_choices = capability_choices(_model_id_for("text_to_video", "Bytedance-Seedance-1.0-Lite-t2v"), "text_to_video")
+    
     # Custom CSS styles
     css = """
     .gradio-container {
@@ -1167,9 +5444,18 @@ def create_demo():
     .output-section {
         background: linear-gradient(135deg, #e8f5e8 0%, #d4e7d4 100%);
     }
+    .service-status {
+        text-align: center;
+        font-size: 0.95em;
+        margin-bottom: 0.5em;
+    }
     """
     
-    with gr.Blocks(css=css, title="BytePlus Video Generation Tool") as demo:
+    with gr.Blocks(css=css, title="BytePlus Video Generation Tool", head=client_resize_head()) as demo:
+        # 放开 Gradio 的单事件串行限制，排队交给按模型分道处理
+        # 须在添加组件前配置：Blocks 关闭后再调用 queue() 会把整个应用重新生成一遍
+        demo.queue(default_concurrency_limit=SEEDANCE_QUEUE_CONCURRENCY)
+        
         gr.HTML(f"""
         <h1>🎬 BytePlus ModelArk Video Generation</h1>
         <div class="info-box">
@@ -1179,11 +5465,16 @@ def create_demo():
                 <li><strong>Image-to-Video:</strong> Generate videos from images with action descriptions</li>
                 <li><strong>Image-with-FirstLastFrame:</strong> Generate transition videos between two frames (Lite-i2v model only)</li>
                 <li><strong>Image-Refs:</strong> Generate videos using 1-4 reference images (Lite-i2v model only)</li>
+                <li><strong>Storyboard:</strong> Chain several prompts into one long video via last-frame handoff</li>
             </ul>
             <p><strong>🔧 Model:</strong>Bytedance-Seedance-1.0-pro and ByteDance Seedance-1.0-lite (Efficient Version)</p>
         </div>
         """)
         
+        # ARK API status badge, refreshed periodically
+        service_status = gr.HTML(render_service_status)
+        gr.Timer(10).tick(fn=render_service_status, outputs=service_status)
+        
         with gr.Tabs():
             # Text-to-video tab
             with gr.TabItem("📝 Text-to-Video", id="text_to_video"):
@@ -1202,27 +5493,28 @@ def create_demo():
                             
                             gr.HTML("<h3>🤖 Model Selection</h3>")
                             t2v_model = gr.Dropdown(
-                                choices=["Bytedance-Seedance-1.0-pro", "Bytedance-Seedance-1.0-Lite-t2v"],
+                                choices=["Bytedance-Seedance-1.0-pro", "Bytedance-Seedance-1.0-Lite-t2v", AUTO_MODEL],
                                 value="Bytedance-Seedance-1.0-Lite-t2v",
-                                label="Model"
+                                label="Model",
+                                info="Auto uses Pro, falling back to Lite when Pro's queue is long"
                             )
                             
                             gr.HTML("<h3>⚙️ Generation Parameters</h3>")
                             t2v_resolution = gr.Dropdown(
-                                choices=["480p", "720p", "1080p"],
+                                choices=t2v_choices["resolutions"],
                                 value="720p",
                                 label="Resolution"
                             )
                             with gr.Row():
                                 t2v_duration = gr.Slider(
-                                    minimum=3,
-                                    maximum=12,
+                                    minimum=t2v_choices["min_duration"],
+                                    maximum=t2v_choices["max_duration"],
                                     value=5,
                                     step=1,
                                     label="Duration (seconds)"
                                 )
                                 t2v_ratio = gr.Dropdown(
-                                    choices=["16:9", "4:3", "1:1", "3:4", "9:16"],
+                                    choices=t2v_choices["ratios"],
                                     value="16:9",
                                     label="Aspect Ratio"
                                 )
@@ -1243,13 +5535,30 @@ def create_demo():
                                     info="Include BytePlus watermark in the video"
                                 )
                             
-                            t2v_generate_btn = gr.Button("🎬 Generate Video", variant="primary", size="lg")
+                            t2v_variants = gr.Slider(
+                                minimum=1,
+                                maximum=SEEDANCE_MAX_VARIANTS,
+                                value=1,
+                                step=1,
+                                label="Variants",
+                                info="Generate several takes with different seeds in parallel"
+                            )
+                            t2v_deferred = gr.Checkbox(
+                                value=False,
+                                label="🌙 Not urgent",
+                                info="Queue for off-peak: submitted only when interactive load is low or in off-peak hours"
+                            )
+                            
+                            with gr.Row():
+                                t2v_generate_btn = gr.Button("🎬 Generate Video", variant="primary", size="lg", scale=3)
+                                t2v_cancel_btn = gr.Button("⏹️ Cancel", variant="stop", size="lg", scale=1)
                     
                     # Right Side - Output Section
                     with gr.Column(scale=1):
                         with gr.Group(elem_classes=["output-section"]):
                             gr.HTML("<h3>🎥 Generation Result</h3>")
                             t2v_video_output = gr.Video(label="Generated Video", height=400)
+                            t2v_variants_gallery = gr.Gallery(label="Variants", columns=2, height=300)
                             t2v_status_output = gr.Textbox(
                                 label="Status Information & Debug Logs",
                                 lines=12,
@@ -1279,9 +5588,10 @@ def create_demo():
                             gr.HTML("<h3>🖼️ Upload Image</h3>")
                             i2v_image_input = gr.Image(
                                 label="Select Image",
-                                type="pil",
+                                type="filepath",
                                 height=250,
-                                sources=["upload"]
+                                sources=["upload"],
+                                elem_classes=["client-resize"]
                             )
                             
                             gr.HTML("<h3>📝 Action Description</h3>")
@@ -1295,27 +5605,28 @@ def create_demo():
                             
                             gr.HTML("<h3>🤖 Model Selection</h3>")
                             i2v_model = gr.Dropdown(
-                                choices=["Bytedance-Seedance-1.0-pro", "Bytedance-Seedance-1.0-Lite-i2v"],
+                                choices=["Bytedance-Seedance-1.0-pro", "Bytedance-Seedance-1.0-Lite-i2v", AUTO_MODEL],
                                 value="Bytedance-Seedance-1.0-Lite-i2v",
-                                label="Model"
+                                label="Model",
+                                info="Auto uses Pro, falling back to Lite when Pro's queue is long"
                             )
                             
                             gr.HTML("<h3>⚙️ Generation Parameters</h3>")
                             i2v_resolution = gr.Dropdown(
-                                choices=["480p", "720p", "1080p"],
+                                choices=i2v_choices["resolutions"],
                                 value="720p",
                                 label="Resolution"
                             )
                             with gr.Row():
                                 i2v_duration = gr.Slider(
-                                    minimum=3,
-                                    maximum=12,
+                                    minimum=i2v_choices["min_duration"],
+                                    maximum=i2v_choices["max_duration"],
                                     value=5,
                                     step=1,
                                     label="Duration (seconds)"
                                 )
                                 i2v_ratio = gr.Dropdown(
-                                    choices=["adaptive", "16:9", "4:3", "1:1", "3:4", "9:16"],
+                                    choices=i2v_choices["ratios"],
                                     value="adaptive",
                                     label="Aspect Ratio"
                                 )
@@ -1336,13 +5647,30 @@ def create_demo():
                                     info="Include BytePlus watermark in the video"
                                 )
                             
-                            i2v_generate_btn = gr.Button("🎬 Generate Video", variant="primary", size="lg")
+                            i2v_variants = gr.Slider(
+                                minimum=1,
+                                maximum=SEEDANCE_MAX_VARIANTS,
+                                value=1,
+                                step=1,
+                                label="Variants",
+                                info="Generate several takes with different seeds in parallel"
+                            )
+                            i2v_deferred = gr.Checkbox(
+                                value=False,
+                                label="🌙 Not urgent",
+                                info="Queue for off-peak: submitted only when interactive load is low or in off-peak hours"
+                            )
+                            
+                            with gr.Row():
+                                i2v_generate_btn = gr.Button("🎬 Generate Video", variant="primary", size="lg", scale=3)
+                                i2v_cancel_btn = gr.Button("⏹️ Cancel", variant="stop", size="lg", scale=1)
                     
                     # Right Side - Output Section
                     with gr.Column(scale=1):
                         with gr.Group(elem_classes=["output-section"]):
                             gr.HTML("<h3>🎥 Generation Result</h3>")
                             i2v_video_output = gr.Video(label="Generated Video", height=400)
+                            i2v_variants_gallery = gr.Gallery(label="Variants", columns=2, height=300)
                             i2v_status_output = gr.Textbox(
                                 label="Status Information & Debug Logs",
                                 lines=12,
@@ -1358,7 +5686,7 @@ def create_demo():
                     <ul>
                         <li>Upload clear, well-composed images (minimum width: 300px)</li>
                         <li>Text description is optional; the system will automatically analyze the image</li>
-                        <li>Recommend using "adaptive" aspect ratio to match image proportions</li>
+                        <li>Aspect ratio is "adaptive": the video follows the image proportions</li>
                     </ul>
                 </div>
                 """)
@@ -1374,16 +5702,18 @@ def create_demo():
                             
                             flf_first_frame = gr.Image(
                                 label="First Frame",
-                                type="pil",
+                                type="filepath",
                                 height=200,
-                                sources=["upload"]
+                                sources=["upload"],
+                                elem_classes=["client-resize"]
                             )
                             
                             flf_last_frame = gr.Image(
                                 label="Last Frame",
-                                type="pil",
+                                type="filepath",
                                 height=200,
-                                sources=["upload"]
+                                sources=["upload"],
+                                elem_classes=["client-resize"]
                             )
                             
                             gr.HTML("<h3>📝 Action Description</h3>")
@@ -1397,14 +5727,14 @@ def create_demo():
                             
                             gr.HTML("<h3>⚙️ Generation Parameters</h3>")
                             flf_resolution = gr.Dropdown(
-                                choices=["480p", "720p", "1080p"],
+                                choices=flf_choices["resolutions"],
                                 value="720p",
                                 label="Resolution (--rs parameter)"
                             )
                             with gr.Row():
                                 flf_duration = gr.Slider(
-                                    minimum=3,
-                                    maximum=12,
+                                    minimum=flf_choices["min_duration"],
+                                    maximum=flf_choices["max_duration"],
                                     value=5,
                                     step=1,
                                     label="Duration in seconds (--dur parameter)"
@@ -1431,7 +5761,9 @@ def create_demo():
                                     info="Include BytePlus watermark in the video"
                                 )
                             
-                            flf_generate_btn = gr.Button("🎬 Generate Video", variant="primary", size="lg")
+                            with gr.Row():
+                                flf_generate_btn = gr.Button("🎬 Generate Video", variant="primary", size="lg", scale=3)
+                                flf_cancel_btn = gr.Button("⏹️ Cancel", variant="stop", size="lg", scale=1)
                     
                     # Right Side - Output Section
                     with gr.Column(scale=1):
@@ -1471,29 +5803,33 @@ def create_demo():
                             with gr.Row():
                                 ref_image1 = gr.Image(
                                     label="Reference Image 1",
-                                    type="pil",
+                                    type="filepath",
                                     height=150,
-                                    sources=["upload"]
+                                    sources=["upload"],
+                                    elem_classes=["client-resize"]
                                 )
                                 ref_image2 = gr.Image(
                                     label="Reference Image 2",
-                                    type="pil",
+                                    type="filepath",
                                     height=150,
-                                    sources=["upload"]
+                                    sources=["upload"],
+                                    elem_classes=["client-resize"]
                                 )
                             
                             with gr.Row():
                                 ref_image3 = gr.Image(
                                     label="Reference Image 3",
-                                    type="pil",
+                                    type="filepath",
                                     height=150,
-                                    sources=["upload"]
+                                    sources=["upload"],
+                                    elem_classes=["client-resize"]
                                 )
                                 ref_image4 = gr.Image(
                                     label="Reference Image 4",
-                                    type="pil",
+                                    type="filepath",
                                     height=150,
-                                    sources=["upload"]
+                                    sources=["upload"],
+                                    elem_classes=["client-resize"]
                                 )
                             
                             gr.HTML("<h3>📝 Video Description</h3>")
@@ -1507,20 +5843,20 @@ def create_demo():
                             
                             gr.HTML("<h3>⚙️ Generation Parameters</h3>")
                             ref_resolution = gr.Dropdown(
-                                choices=["480p", "720p", "1080p"],
+                                choices=ref_choices["resolutions"],
                                 value="720p",
                                 label="Resolution (--rs parameter)"
                             )
                             with gr.Row():
                                 ref_duration = gr.Slider(
-                                    minimum=3,
-                                    maximum=12,
+                                    minimum=ref_choices["min_duration"],
+                                    maximum=ref_choices["max_duration"],
                                     value=5,
                                     step=1,
                                     label="Duration in seconds (--dur parameter)"
                                 )
                                 ref_ratio = gr.Dropdown(
-                                    choices=["16:9", "4:3", "1:1", "3:4", "9:16"],
+                                    choices=ref_choices["ratios"],
                                     value="16:9",
                                     label="Aspect Ratio (--rt parameter)"
                                 )
@@ -1541,7 +5877,9 @@ def create_demo():
                                     info="Include BytePlus watermark in the video"
                                 )
                             
-                            ref_generate_btn = gr.Button("🎬 Generate Video", variant="primary", size="lg")
+                            with gr.Row():
+                                ref_generate_btn = gr.Button("🎬 Generate Video", variant="primary", size="lg", scale=3)
+                                ref_cancel_btn = gr.Button("⏹️ Cancel", variant="stop", size="lg", scale=1)
                     
                     # Right Side - Output Section
                     with gr.Column(scale=1):
@@ -1568,31 +5906,291 @@ def create_demo():
                     </ul>
                 </div>
                 """)
+            
+            # Storyboard (long video) tab
+            with gr.TabItem("📚 Storyboard", id="storyboard"):
+                with gr.Row():
+                    # Left Side - Input Section
+                    with gr.Column(scale=1):
+                        with gr.Group(elem_classes=["input-section"]):
+                            gr.HTML("<h3>📚 Segment Prompts</h3>")
+                            gr.HTML("<p style='color: #666; margin-bottom: 15px;'>One prompt per line. Each segment starts from the last frame of the previous one, and the clips are joined into one video.</p>")
+                            sb_prompts = gr.Textbox(
+                                label="Segments (one per line)",
+                                placeholder="A fox wakes up in a snowy forest\nThe fox runs across a frozen lake\nThe fox reaches its den at sunset",
+                                lines=8,
+                                max_lines=20
+                            )
+                            
+                            sb_image = gr.Image(
+                                label="Optional Starting Image",
+                                type="filepath",
+                                height=200,
+                                sources=["upload"],
+                                elem_classes=["client-resize"]
+                            )
+                            
+                            gr.HTML("<h3>🤖 Model Selection</h3>")
+                            sb_model = gr.Dropdown(
+                                choices=["Bytedance-Seedance-1.0-pro", "Bytedance-Seedance-1.0-Lite-i2v"],
+                                value="Bytedance-Seedance-1.0-Lite-i2v",
+                                label="Model",
+                                info="Lite uses Lite-t2v for the first segment when no starting image is given"
+                            )
+                            
+                            gr.HTML("<h3>⚙️ Generation Parameters</h3>")
+                            sb_resolution = gr.Dropdown(
+                                choices=sb_choices["resolutions"],
+                                value="720p",
+                                label="Resolution"
+                            )
+                            with gr.Row():
+                                sb_duration = gr.Slider(
+                                    minimum=sb_choices["min_duration"],
+                                    maximum=sb_choices["max_duration"],
+                                    value=5,
+                                    step=1,
+                                    label="Segment Duration (seconds)"
+                                )
+                                sb_ratio = gr.Dropdown(
+                                    choices=sb_choices["ratios"],
+                                    value="16:9",
+                                    label="Aspect Ratio (first segment)"
+                                )
+                            
+                            with gr.Row():
+                                sb_seed = gr.Number(
+                                    value=-1,
+                                    label="Seed",
+                                    info="Range: [-1, 4294967295]. Use -1 for random",
+                                    minimum=-1,
+                                    maximum=4294967295,
+                                    step=1,
+                                    precision=0
+                                )
+                                sb_watermark = gr.Checkbox(
+                                    value=True,
+                                    label="Add Watermark",
+                                    info="Include BytePlus watermark in the video"
+                                )
+                            
+                            sb_deferred = gr.Checkbox(
+                                value=False,
+                                label="🌙 Not urgent",
+                                info="Queue for off-peak: submitted only when interactive load is low or in off-peak hours"
+                            )
+                            
+                            with gr.Row():
+                                sb_generate_btn = gr.Button("🎬 Generate Storyboard", variant="primary", size="lg", scale=3)
+                                sb_cancel_btn = gr.Button("⏹️ Cancel", variant="stop", size="lg", scale=1)
+                    
+                    # Right Side - Output Section
+                    with gr.Column(scale=1):
+                        with gr.Group(elem_classes=["output-section"]):
+                            gr.HTML("<h3>🎥 Generation Result</h3>")
+                            sb_video_output = gr.Video(label="Storyboard Video", height=400)
+                            sb_status_output = gr.Textbox(
+                                label="Status Information & Debug Logs",
+                                lines=12,
+                                max_lines=20,
+                                interactive=False,
+                                visible=True
+                            )
+                
+                # Example tips
+                gr.HTML("""
+                <div class="info-box">
+                    <p><strong>💡 Storyboard Tips:</strong></p>
+                    <ul>
+                        <li>Describe each shot as a continuation of the previous one for smooth handoffs</li>
+                        <li>The next segment is submitted as soon as the previous clip's last frame is extracted</li>
+                        <li>Segments are joined without re-encoding, so all of them share one resolution</li>
+                        <li>Requires ffmpeg on the server</li>
+                    </ul>
+                </div>
+                """)
+            
+            # Generation history tab (loaded lazily when opened)
+            with gr.TabItem("🗂️ History", id="history") as history_tab:
+                history_state = gr.State({})
+                with gr.Row():
+                    history_query = gr.Textbox(label="Search prompts", placeholder="e.g. cat garden sunset", scale=3)
+                    history_mode = gr.Dropdown(choices=HISTORY_MODES, value="All", label="Mode", scale=1)
+                    history_search_btn = gr.Button("🔍 Search", variant="primary", scale=1)
+                with gr.Row():
+                    with gr.Column(scale=2):
+                        history_gallery = gr.Gallery(label="Past Generations", columns=4, height=420, allow_preview=False)
+                        with gr.Row():
+                            history_newer_btn = gr.Button("⬅️ Newer", size="sm")
+                            history_page_info = gr.Markdown("")
+                            history_older_btn = gr.Button("Older ➡️", size="sm")
+                    with gr.Column(scale=1):
+                        history_video = gr.Video(label="Selected Video", height=300)
+                        history_details = gr.Markdown("")
+                history_table = gr.Dataframe(
+                    headers=["Created", "Mode", "Model", "Status", "Prompt", "Task ID"],
+                    interactive=False,
+                    wrap=True
+                )
+            
+            # Deferred (off-peak) queue tab
+            with gr.TabItem("🌙 Deferred", id="deferred") as deferred_tab:
+                with gr.Row():
+                    deferred_info = gr.Markdown("")
+                    deferred_refresh_btn = gr.Button("🔄 Refresh", scale=0)
+                deferred_table = gr.Dataframe(
+                    headers=["ID", "Created", "Kind", "Model", "Status", "Progress", "Result / Error", "Prompt"],
+                    interactive=False,
+                    wrap=True
+                )
+                with gr.Row():
+                    with gr.Column(scale=1):
+                        deferred_job_id = gr.Number(label="Job ID", precision=0, minimum=1)
+                        with gr.Row():
+                            deferred_show_btn = gr.Button("▶️ Show Result", size="sm")
+                            deferred_cancel_btn = gr.Button("⏹️ Cancel Job", variant="stop", size="sm")
+                        deferred_details = gr.Markdown("")
+                    with gr.Column(scale=1):
+                        deferred_video = gr.Video(label="Deferred Job Result", height=300)
+            
+            # Usage accounting tab
+            with gr.TabItem("📊 Usage", id="usage") as usage_tab:
+                with gr.Row():
+                    usage_window = gr.Dropdown(choices=list(USAGE_WINDOWS), value="Last 24 hours", label="Period", scale=1)
+                    usage_refresh_btn = gr.Button("🔄 Refresh", scale=0)
+                usage_info = gr.Markdown("")
+                usage_by_model = gr.Dataframe(
+                    headers=["Model", "Resolution", "Duration (s)", "Tasks", "Tokens", "Avg Tokens/Task", "Est. Cost"],
+                    interactive=False,
+                    wrap=True
+                )
+        
+        # Keep parameter controls in sync with the selected model's capabilities
+        t2v_model.change(
+            fn=lambda *args: update_parameter_controls("text_to_video", *args),
+            inputs=[t2v_model, t2v_resolution, t2v_duration, t2v_ratio],
+            outputs=[t2v_resolution, t2v_duration, t2v_ratio],
+            queue=False
+        )
+        
+        i2v_model.change(
+            fn=lambda *args: update_parameter_controls("image_to_video", *args),
+            inputs=[i2v_model, i2v_resolution, i2v_duration, i2v_ratio],
+            outputs=[i2v_resolution, i2v_duration, i2v_ratio],
+            queue=False
+        )
         
         # Bind events
-        t2v_generate_btn.click(
-            fn=text_to_video,
-            inputs=[t2v_prompt, t2v_model, t2v_resolution, t2v_duration, t2v_ratio, t2v_seed, t2v_watermark],
-            outputs=[t2v_video_output, t2v_status_output]
+        t2v_event = t2v_generate_btn.click(
+            fn=text_to_video_variants,
+            inputs=[t2v_prompt, t2v_model, t2v_resolution, t2v_duration, t2v_ratio, t2v_seed, t2v_watermark, t2v_variants, t2v_deferred],
+            outputs=[t2v_video_output, t2v_variants_gallery, t2v_status_output],
+            api_name="text_to_video"
+        )
+        t2v_cancel_btn.click(
+            fn=make_cancel_handler("text_to_video"),
+            outputs=[t2v_status_output],
+            cancels=[t2v_event]
         )
         
-        i2v_generate_btn.click(
-            fn=image_to_video,
-            inputs=[i2v_image_input, i2v_prompt, i2v_model, i2v_resolution, i2v_duration, i2v_ratio, i2v_seed, i2v_watermark],
-            outputs=[i2v_video_output, i2v_status_output]
+        i2v_event = i2v_generate_btn.click(
+            fn=image_to_video_variants,
+            inputs=[i2v_image_input, i2v_prompt, i2v_model, i2v_resolution, i2v_duration, i2v_ratio, i2v_seed, i2v_watermark, i2v_variants, i2v_deferred],
+            outputs=[i2v_video_output, i2v_variants_gallery, i2v_status_output],
+            api_name="image_to_video"
+        )
+        i2v_cancel_btn.click(
+            fn=make_cancel_handler("image_to_video"),
+            outputs=[i2v_status_output],
+            cancels=[i2v_event]
         )
         
-        flf_generate_btn.click(
+        flf_event = flf_generate_btn.click(
             fn=first_last_frame_to_video,
             inputs=[flf_first_frame, flf_last_frame, flf_prompt, flf_resolution, flf_duration, flf_cf, flf_seed, flf_watermark],
             outputs=[flf_video_output, flf_status_output]
         )
+        flf_cancel_btn.click(
+            fn=make_cancel_handler("first_last_frame"),
+            outputs=[flf_status_output],
+            cancels=[flf_event]
+        )
         
-        ref_generate_btn.click(
+        ref_event = ref_generate_btn.click(
             fn=image_refs_to_video,
             inputs=[ref_image1, ref_image2, ref_image3, ref_image4, ref_prompt, ref_resolution, ref_duration, ref_ratio, ref_seed, ref_watermark],
             outputs=[ref_video_output, ref_status_output]
         )
+        ref_cancel_btn.click(
+            fn=make_cancel_handler("image_refs"),
+            outputs=[ref_status_output],
+            cancels=[ref_event]
+        )
+        
+        sb_event = sb_generate_btn.click(
+            fn=storyboard_to_video,
+            inputs=[sb_prompts, sb_image, sb_model, sb_resolution, sb_duration, sb_ratio, sb_seed, sb_watermark, sb_deferred],
+            outputs=[sb_video_output, sb_status_output]
+        )
+        sb_cancel_btn.click(
+            fn=make_cancel_handler("storyboard"),
+            outputs=[sb_status_output],
+            cancels=[sb_event]
+        )
+        
+        history_outputs = [history_gallery, history_table, history_page_info, history_state]
+        history_tab.select(
+            fn=make_history_loader("first"),
+            inputs=[history_query, history_mode, history_state],
+            outputs=history_outputs
+        )
+        history_search_btn.click(
+            fn=make_history_loader("first"),
+            inputs=[history_query, history_mode, history_state],
+            outputs=history_outputs
+        )
+        history_query.submit(
+            fn=make_history_loader("first"),
+            inputs=[history_query, history_mode, history_state],
+            outputs=history_outputs
+        )
+        history_older_btn.click(
+            fn=make_history_loader("older"),
+            inputs=[history_query, history_mode, history_state],
+            outputs=history_outputs
+        )
+        history_newer_btn.click(
+            fn=make_history_loader("newer"),
+            inputs=[history_query, history_mode, history_state],
+            outputs=history_outputs
+        )
+        history_gallery.select(
+            fn=show_history_item,
+            inputs=[history_state],
+            outputs=[history_video, history_details]
+        )
+        
+        deferred_outputs = [deferred_info, deferred_table]
+        deferred_tab.select(fn=load_deferred_jobs, outputs=deferred_outputs)
+        deferred_refresh_btn.click(fn=load_deferred_jobs, outputs=deferred_outputs)
+        deferred_show_btn.click(
+            fn=show_deferred_result,
+            inputs=[deferred_job_id],
+            outputs=[deferred_video, deferred_details]
+        )
+        deferred_cancel_btn.click(
+            fn=cancel_deferred_job,
+            inputs=[deferred_job_id],
+            outputs=[deferred_details]
+        ).then(fn=load_deferred_jobs, outputs=deferred_outputs)
+        
+        usage_outputs = [usage_info, usage_by_model]
+        usage_tab.select(fn=load_usage_summary, inputs=[usage_window], outputs=usage_outputs)
+        usage_refresh_btn.click(fn=load_usage_summary, inputs=[usage_window], outputs=usage_outputs)
+        usage_window.change(fn=load_usage_summary, inputs=[usage_window], outputs=usage_outputs)
+        
+        # Cancel upstream tasks when the browser session disconnects
+        demo.unload(cancel_session_on_disconnect)
         
         # Footer information
         gr.HTML("""
@@ -1605,7 +6203,170 @@ def create_demo():
     
     return demo
 
-if __name__ == "__main__":
-    # Create and launch demo
+def create_app():
+    """Create the ASGI app: operational routes plus the Gradio UI mounted at /"""
+    import hmac
+    from fastapi import FastAPI, Request
+    from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+    from starlette.concurrency import run_in_threadpool
+    
+    app = FastAPI()
+    
+    @app.get("/metrics")
+    def metrics():
+        return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+    
+    @app.get("/healthz")
+    def healthz():
+        # 存活检查只说明进程在响应；停机排空期间也保持 200，避免被提前杀掉
+        return {"status": "ok", "draining": LIFECYCLE.draining}
+    
+    @app.get("/readyz")
+    def readyz():
+        ready, details = LIFECYCLE.readiness()
+        return JSONResponse(dict(details, status="ready" if ready else "not ready"), status_code=200 if ready else 503)
+    
+    def admin_denied(request: Request) -> Optional[JSONResponse]:
+        # 未配置令牌时管理端点等同于不存在
+        if not SEEDANCE_ADMIN_TOKEN:
+            return JSONResponse({"detail": "Not Found"}, status_code=404)
+        if not hmac.compare_digest(request.headers.get("x-admin-token", ""), SEEDANCE_ADMIN_TOKEN):
+            return JSONResponse({"error": "invalid admin token"}, status_code=403)
+        return None
+    
+    @app.post("/admin/profile/sample")
+    def profile_sample(request: Request, seconds: float = 10, interval: float = 0.01):
+        """Sample all thread stacks for `seconds` (blocks until done)"""
+        denied = admin_denied(request)
+        if denied:
+            return denied
+        try:
+            path = PROFILER.sample(min(max(seconds, 1), 300), min(max(interval, 0.001), 1))
+        except RuntimeError as e:
+            return JSONResponse({"error": str(e)}, status_code=409)
+        return {"file": os.path.basename(path)}
+    
+    @app.post("/admin/profile/handler")
+    def profile_handler(request: Request, name: str, calls: int = 1):
+        """cProfile the next `calls` calls of a UI handler"""
+        denied = admin_denied(request)
+        if denied:
+            return denied
+        if name not in PROFILER.handler_names:
+            return JSONResponse({"error": f"unknown handler, choose one of {sorted(PROFILER.handler_names)}"}, status_code=400)
+        PROFILER.arm_handler(name, max(0, min(calls, 100)))
+        return {"armed": PROFILER.handler_calls}
+    
+    @app.post("/admin/profile/memory")
+    def profile_memory(request: Request, calls: int = 1):
+        """tracemalloc snapshots around the next `calls` image encodes"""
+        denied = admin_denied(request)
+        if denied:
+            return denied
+        PROFILER.arm_memory(max(0, min(calls, 100)))
+        return {"armed": PROFILER.memory_calls}
+    
+    @app.get("/admin/profile/files")
+    def profile_files(request: Request):
+        denied = admin_denied(request)
+        if denied:
+            return denied
+        return {"files": PROFILER.files()}
+    
+    @app.get("/admin/profile/files/{name}")
+    def profile_file(request: Request, name: str):
+        denied = admin_denied(request)
+        if denied:
+            return denied
+        path = PROFILER.file_path(name)
+        if not path:
+            return JSONResponse({"error": "no such file"}, status_code=404)
+        return FileResponse(path, filename=os.path.basename(path))
+    
+    @app.get("/admin/usage")
+    def usage_summary(request: Request, hours: Optional[float] = None):
+        """Usage totals per model/resolution/duration and the heaviest users and sessions (all time without hours)"""
+        denied = admin_denied(request)
+        if denied:
+            return denied
+        return USAGE.summary(hours, top_sessions=50)
+    
+    @app.post("/ark/callback")
+    async def ark_callback(request: Request):
+        # 未启用回调时该端点等同于不存在
+        if not ARK_CALLBACK_ENABLED:
+            return JSONResponse({"detail": "Not Found"}, status_code=404)
+        # 校验回调令牌，防止伪造的任务完成通知
+        if not hmac.compare_digest(request.query_params.get("token", ""), ARK_CALLBACK_TOKEN):
+            return JSONResponse({"error": "invalid callback token"}, status_code=403)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return JSONResponse({"error": "invalid JSON body"}, status_code=400)
+        
+        # 确认状态需要请求 ARK，放到线程池里避免阻塞事件循环
+        accepted, message = await run_in_threadpool(TASK_HUB.handle_callback, payload)
+        return JSONResponse({"accepted": accepted, "message": message}, status_code=200 if accepted else 400)
+    
+    LIFECYCLE.resume_interrupted()
+    DEFERRED.start()
+    if POSTPROCESSOR.enabled:
+        # 启动时按保留策略清理上次运行留下的产物，不阻塞启动
+        threading.Thread(target=POSTPROCESSOR.sweep, name="postprocess-sweep", daemon=True).start()
+    app.add_middleware(BrowserIdCookie)
+    app.add_middleware(FirstRequestTimer)
     demo = create_demo()
-    demo.launch(server_name="127.0.0.1", server_port=7860, share=False)
\ No newline at end of file
+    ACTIVITY.attach(demo)
+    STARTUP.mark("ui")
+    app = gr.mount_gradio_app(app, demo, path="/")
+    STARTUP.mark("app")
+    return app
+
+def _serve_worker(port):
+    """Run one uvicorn worker serving the full app on the given port"""
+    import signal
+    import uvicorn
+
+    class DrainingServer(uvicorn.Server):
+        """First SIGTERM drains in-flight tasks before shutting down; a second signal or Ctrl+C exits now"""
+
+        def handle_exit(self, sig, frame):
+            if sig == signal.SIGTERM and not LIFECYCLE.draining:
+                LIFECYCLE.begin_drain()
+                threading.Thread(target=self._drain_then_exit, args=(sig, frame), daemon=True).start()
+                return
+            if not self.should_exit:
+                LIFECYCLE.record_leftovers(IN_FLIGHT.tasks())
+            super().handle_exit(sig, frame)
+
+        async def startup(self, sockets=None):
+            await super().startup(sockets)
+            STARTUP.mark("listening")
+
+        def _drain_then_exit(self, sig, frame):
+            LIFECYCLE.record_leftovers(LIFECYCLE.wait_drained())
+            self.should_exit = True
+
+    # 排空结束后仍打开的 Gradio 事件流不应再拖住退出
+    config = uvicorn.Config(create_app(), host=SEEDANCE_HOST, port=port, timeout_graceful_shutdown=10)
+    DrainingServer(config).run()
+
+
+if __name__ == "__main__":
+    if SEEDANCE_WORKERS <= 1:
+        _serve_worker(SEEDANCE_PORT)
+    else:
+        # 每个进程独立加载 Gradio 并监听自己的端口；任务状态通过 STATE 后端共享
+        ctx = multiprocessing.get_context("spawn")
+        workers = [
+            ctx.Process(target=_serve_worker, args=(SEEDANCE_PORT + i,), name=f"seedance-worker-{i}")
+            for i in range(SEEDANCE_WORKERS)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
\ No newline at end of file
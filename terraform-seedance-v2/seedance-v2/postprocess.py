@@ -0,0 +1,99 @@
+"""Video post-processing jobs, each run by the app in a short-lived worker process
+
+Kept apart from app.py so a worker starts with only what ffmpeg jobs need, not the UI,
+database and state-backend setup (a multiprocessing spawn worker would re-run app.py).
+Usage: python postprocess.py < job.json, printing the outputs as JSON.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+from typing import Dict, List
+
+import requests
+
+
+def worker_init():
+    # 降低后处理进程优先级，避免与请求处理争抢CPU
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def download(video_url: str, dest_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Stream a video to disk without holding it in memory"""
+    with requests.get(video_url, stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+        with open(dest_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+    return dest_path
+
+
+def run_ffmpeg(ffmpeg: str, args: List[str], timeout: int = 120):
+    """Run ffmpeg quietly; raises RuntimeError with the stderr tail on failure"""
+    command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y"] + args
+    try:
+        completed = subprocess.run(command, capture_output=True, timeout=timeout)
+    except FileNotFoundError as e:
+        raise RuntimeError(f"ffmpeg not found ({ffmpeg}); install ffmpeg or set FFMPEG_BINARY") from e
+    if completed.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {completed.stderr.decode(errors='replace')[-500:]}")
+
+
+def postprocess_video(task_id: str, video_url: str, output_dir: str, ffmpeg: str = "ffmpeg",
+                      transcode: bool = False, preview_bitrate: str = "600k") -> Dict[str, str]:
+    """Download a finished video and derive poster, animated preview and optional low-bitrate renditions
+
+    Nothing is left behind when a step fails.
+    """
+    task_dir = os.path.join(output_dir, task_id)
+    os.makedirs(task_dir, exist_ok=True)
+    try:
+        outputs = {"video": download(video_url, os.path.join(task_dir, "video.mp4"))}
+
+        poster_path = os.path.join(task_dir, "poster.jpg")
+        run_ffmpeg(ffmpeg, ["-i", outputs["video"], "-frames:v", "1", "-vf", "scale=480:-2", "-q:v", "3", poster_path])
+        outputs["poster"] = poster_path
+
+        # Short, small looping preview; fall back to GIF when ffmpeg lacks libwebp
+        preview_filter = "fps=8,scale=320:-2"
+        try:
+            preview_path = os.path.join(task_dir, "preview.webp")
+            run_ffmpeg(ffmpeg, ["-i", outputs["video"], "-t", "3", "-vf", preview_filter, "-loop", "0", "-an", preview_path])
+        except RuntimeError:
+            preview_path = os.path.join(task_dir, "preview.gif")
+            run_ffmpeg(ffmpeg, ["-i", outputs["video"], "-t", "3", "-vf", preview_filter, "-loop", "0", preview_path])
+        outputs["preview"] = preview_path
+
+        if transcode:
+            low_path = os.path.join(task_dir, "video_low.mp4")
+            run_ffmpeg(ffmpeg, ["-i", outputs["video"], "-c:v", "libx264", "-preset", "veryfast", "-b:v", preview_bitrate,
+                                "-vf", "scale=-2:480", "-c:a", "aac", "-b:a", "64k", "-movflags", "+faststart", low_path],
+                       timeout=600)
+            outputs["low_bitrate"] = low_path
+    except BaseException:
+        shutil.rmtree(task_dir, ignore_errors=True)
+        raise
+
+    return outputs
+
+
+def main():
+    """Run one job read as JSON from stdin and print its outputs as JSON"""
+    worker_init()
+    job = json.load(sys.stdin)
+    try:
+        outputs = postprocess_video(**job)
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        sys.exit(1)
+    json.dump(outputs, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
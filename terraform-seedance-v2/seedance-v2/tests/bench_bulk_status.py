@@ -0,0 +1,78 @@
+"""Benchmark bulk task status: upstream request count and latency per batch, against the mock ARK server
+
+Compares one GET per task, the paged list endpoint, and the fallback taken when listing is not
+supported (one failed list request, then per-task GETs). Run from the seedance-v2 directory:
+
+    python tests/bench_bulk_status.py --tasks 50 --latency 0.05
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TESTS_DIR)
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from mock_ark import MockArk  # noqa: E402
+
+MOCK_ARK = MockArk()
+os.environ.update({
+    "ARK_API_KEY": "bench-key",
+    "ARK_BASE_URL": MOCK_ARK.base_url,
+    "SEEDANCE_OUTPUT_DIR": tempfile.mkdtemp(prefix="seedance-bench-"),
+    "SEEDANCE_POSTPROCESS": "false",
+})
+
+import app as seedance  # noqa: E402
+
+
+def run(name: str, task_ids, rounds: int, bulk_list: bool, client_bulk) -> dict:
+    """Time `rounds` batch lookups with a fresh client; returns request count and latency per batch"""
+    MOCK_ARK.bulk_list = bulk_list
+    client = seedance.BytePlusVideoClient(api_key="bench-key", base_url=MOCK_ARK.base_url)
+    client.bulk_list_supported = client_bulk
+    with MOCK_ARK._lock:
+        MOCK_ARK.requests.clear()
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        results = client.get_tasks_status(task_ids)
+        timings.append(time.perf_counter() - started)
+        assert len(results) == len(task_ids) and not any("error" in status for status in results.values()), results
+    return {
+        "name": name,
+        "requests": MOCK_ARK.count("GET") / rounds,
+        "p50": statistics.median(timings) * 1000,
+        "max": max(timings) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=50, help="tasks looked up per batch")
+    parser.add_argument("--rounds", type=int, default=10, help="batches per mode")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server latency per request (seconds)")
+    args = parser.parse_args()
+
+    MOCK_ARK.reset(latency=args.latency)
+    task_ids = [MOCK_ARK.create({"model": "bench"})[1]["id"] for _ in range(args.tasks)]
+    rows = [
+        run("per-task GET", task_ids, args.rounds, bulk_list=True, client_bulk=False),
+        run("bulk list", task_ids, args.rounds, bulk_list=True, client_bulk=None),
+        run("list unsupported (fallback)", task_ids, args.rounds, bulk_list=False, client_bulk=None),
+    ]
+
+    print(f"{args.tasks} tasks per batch, {args.rounds} batches, {args.latency * 1000:.0f} ms server latency, "
+          f"page size {seedance.ARK_STATUS_PAGE_SIZE}, fetch concurrency {seedance.ARK_STATUS_FETCH_CONCURRENCY}")
+    print(f"{'mode':<30} {'requests/batch':>15} {'p50 ms':>9} {'max ms':>9}")
+    for row in rows:
+        print(f"{row['name']:<30} {row['requests']:>15.1f} {row['p50']:>9.1f} {row['max']:>9.1f}")
+    MOCK_ARK.close()
+
+
+if __name__ == "__main__":
+    main()
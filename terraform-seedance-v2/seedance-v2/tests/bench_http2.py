@@ -0,0 +1,192 @@
+"""Benchmark the ARK transports: unpooled requests, pooled HTTP/1.1 and HTTP/2 at many concurrent tasks
+
+Each simulated task creates one upstream task and then polls its status, all against a local TLS
+stub served by hypercorn (speaks h2 and http/1.1, counts client connections). Needs openssl on PATH
+and `pip install hypercorn "httpx[http2]"`. Run from the seedance-v2 directory:
+
+    python tests/bench_http2.py --tasks 200 --polls 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+WORK_DIR = tempfile.mkdtemp(prefix="seedance-bench-h2-")
+CERT_FILE = os.path.join(WORK_DIR, "cert.pem")
+KEY_FILE = os.path.join(WORK_DIR, "key.pem")
+
+
+class StubArk:
+    """ASGI stand-in for the ARK task endpoints with a fixed service time; remembers each client connection"""
+
+    def __init__(self, service_time: float):
+        self.service_time = service_time
+        self.connections = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                else:
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        self.connections.add(tuple(scope["client"]))
+        while (await receive()).get("more_body"):
+            pass
+        await asyncio.sleep(self.service_time)
+        if scope["method"] == "POST":
+            body = {"id": "cgt-" + uuid.uuid4().hex[:12]}
+        else:
+            body = {"id": scope["path"].rsplit("/", 1)[1], "status": "running"}
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(body).encode()})
+
+
+def serve(stub: StubArk, port: int) -> threading.Event:
+    """Serve the stub over TLS on a background thread; set the returned event to stop it"""
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.certfile = CERT_FILE
+    config.keyfile = KEY_FILE
+    config.keep_alive_timeout = 120
+    config.loglevel = "ERROR"
+    stop = threading.Event()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        await hypercorn_serve(stub, config, shutdown_trigger=lambda: loop.run_in_executor(None, stop.wait))
+
+    threading.Thread(target=asyncio.run, args=(run(),), daemon=True).start()
+    return stop
+
+
+def percentile(values, fraction: float) -> float:
+    return values[min(len(values) - 1, int(fraction * len(values)))] * 1000
+
+
+def run(name: str, client, stub: StubArk, tasks: int, polls: int, interval: float) -> dict:
+    """Run the simulated tasks through one client; returns request, error and connection counts and latencies"""
+    stub.connections.clear()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def timed(call, *args):
+        started = time.perf_counter()
+        result = call(*args)
+        elapsed = time.perf_counter() - started
+        with lock:
+            if "error" in result:
+                errors.append(result["error"])
+            else:
+                latencies.append(elapsed)
+        return result
+
+    def task():
+        created = timed(client._create_task, {"model": "bench", "content": []}, "bench task")
+        if "id" not in created:
+            return
+        for _ in range(polls):
+            time.sleep(interval)
+            timed(client.get_task_status, created["id"])
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=task) for _ in range(tasks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        "name": name,
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "connections": len(stub.connections),
+        "p50": percentile(latencies, 0.5) if latencies else 0,
+        "p99": percentile(latencies, 0.99) if latencies else 0,
+        "wall": time.perf_counter() - started,
+    }
+
+
+class UnpooledTransport:
+    """A new connection per request (module-level requests calls without a session)"""
+
+    http2 = False
+
+    def request(self, method: str, url: str, **kwargs):
+        return requests.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=200, help="concurrent simulated tasks")
+    parser.add_argument("--polls", type=int, default=10, help="status polls per task")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between a task's polls")
+    parser.add_argument("--service-time", type=float, default=0.02, help="stub response time (seconds)")
+    parser.add_argument("--port", type=int, default=8443)
+    args = parser.parse_args()
+
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", KEY_FILE, "-out", CERT_FILE],
+                   check=True, capture_output=True)
+    base_url = f"https://127.0.0.1:{args.port}"
+    os.environ.update({
+        "SSL_CERT_FILE": CERT_FILE,
+        "REQUESTS_CA_BUNDLE": CERT_FILE,
+        "ARK_API_KEY": "bench-key",
+        "ARK_BASE_URL": base_url,
+        "SEEDANCE_OUTPUT_DIR": WORK_DIR,
+        "SEEDANCE_POSTPROCESS": "false",
+    })
+    import app as seedance
+
+    stub = StubArk(args.service_time)
+    stop = serve(stub, args.port)
+    time.sleep(1)
+    pool_size = seedance.ARK_HTTP_POOL_SIZE
+    transports = [
+        ("unpooled HTTP/1.1", UnpooledTransport()),
+        (f"pooled HTTP/1.1 ({pool_size})", seedance.ArkTransport(pool_size)),
+        ("HTTP/2", seedance.ArkTransport(pool_size, http2=True, max_streams=seedance.ARK_HTTP2_MAX_STREAMS)),
+    ]
+    rows = []
+    for name, transport in transports:
+        if name == "HTTP/2" and not transport.http2:
+            print("HTTP/2 unavailable: pip install 'httpx[http2]'")
+            continue
+        client = seedance.BytePlusVideoClient(api_key="bench-key", base_url=base_url)
+        client.http = transport
+        rows.append(run(name, client, stub, args.tasks, args.polls, args.interval))
+    stop.set()
+
+    print(f"{args.tasks} concurrent tasks, 1 create + {args.polls} polls each, {args.service_time * 1000:.0f} ms service time")
+    print(f"{'transport':<24} {'requests':>9} {'errors':>7} {'connections':>12} {'p50 ms':>8} {'p99 ms':>8} {'wall s':>7}")
+    for row in rows:
+        print(f"{row['name']:<24} {row['requests']:>9} {row['errors']:>7} {row['connections']:>12} "
+              f"{row['p50']:>8.0f} {row['p99']:>8.0f} {row['wall']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
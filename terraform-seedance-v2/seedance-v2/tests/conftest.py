@@ -0,0 +1,73 @@
+"""Shared fixtures: a mock ARK server and the app configured against it
+
+Run from the seedance-v2 directory with `python -m pytest tests`.
+app.py reads its configuration at import time, so the environment is prepared here first.
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TESTS_DIR)
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from mock_ark import MockArk  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+MOCK_ARK = MockArk()
+APP_PORT = _free_port()
+CALLBACK_TOKEN = "test-callback-token"
+
+os.environ.update({
+    "ARK_API_KEY": "test-key",
+    "ARK_BASE_URL": MOCK_ARK.base_url,
+    "ARK_CALLBACK_URL": f"http://127.0.0.1:{APP_PORT}/ark/callback",
+    "ARK_CALLBACK_TOKEN": CALLBACK_TOKEN,
+    "SEEDANCE_OUTPUT_DIR": tempfile.mkdtemp(prefix="seedance-tests-"),
+    "SEEDANCE_POSTPROCESS": "false",
+    "SEEDANCE_SINGLE_FLIGHT": "false",
+})
+
+import app as seedance  # noqa: E402
+
+
+@pytest.fixture
+def mock_ark():
+    """The mock ARK server, with tasks, request log and settings reset for each test"""
+    MOCK_ARK.reset()
+    yield MOCK_ARK
+    MOCK_ARK.reset()
+
+
+@pytest.fixture(scope="session")
+def app_server():
+    """Base URL of the full app (routes plus UI) served by uvicorn on a background thread"""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(seedance.create_app(), host="127.0.0.1", port=APP_PORT, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 60
+    while not server.started:
+        if time.time() > deadline or not thread.is_alive():
+            raise RuntimeError("app server did not start")
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{APP_PORT}"
+    server.should_exit = True
+    thread.join(10)
+
+
+@pytest.fixture
+def callback_url(app_server):
+    return f"{app_server}/ark/callback?token={CALLBACK_TOKEN}"
@@ -0,0 +1,187 @@
+"""Local stand-in for the ARK video task API, used by the tests and benchmarks
+
+Tasks move queued -> running -> succeeded on a timer. When a task is created with a
+callback_url the server POSTs the final status there, optionally late or not at all.
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+VIDEO_BYTES = b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 1024
+
+
+class MockArk:
+    """Threaded HTTP/1.1 server speaking the subset of the ARK task API the app uses"""
+
+    def __init__(self, queue: float = 0.2, render: float = 0.5, latency: float = 0.0, port: int = 0):
+        self.queue = queue
+        self.render = render
+        # 每个请求额外的服务端延迟，模拟真实 API 的响应时间
+        self.latency = latency
+        self._defaults = {"queue": queue, "render": render, "latency": latency}
+        self.bulk_list = True
+        # 非 None 时所有任务 API 请求都以该状态码失败，模拟上游故障
+        self.fail_status = None
+        self.lose_callbacks = False
+        self.callback_delay = 0.0
+        self.tasks = {}
+        self.requests = []
+        self.callback_responses = []
+        self._lock = threading.Lock()
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body, content_type="application/json"):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _record(self, method) -> bool:
+                """Log the request and apply latency; False (after answering) when the API is set to fail"""
+                with mock._lock:
+                    mock.requests.append((method, self.path))
+                if mock.latency:
+                    time.sleep(mock.latency)
+                if mock.fail_status and self.path.startswith("/contents/"):
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                    self._send(mock.fail_status, {"error": {"message": f"mock failure {mock.fail_status}"}})
+                    return False
+                return True
+
+            def do_POST(self):
+                if not self._record("POST"):
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                code, body = mock.create(json.loads(self.rfile.read(length) or b"{}"))
+                self._send(code, body)
+
+            def do_GET(self):
+                if not self._record("GET"):
+                    return
+                code, body = mock.get(self.path)
+                self._send(code, body, "video/mp4" if isinstance(body, bytes) else "application/json")
+
+            def do_DELETE(self):
+                if not self._record("DELETE"):
+                    return
+                self._send(*mock.delete(self.path))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self, **settings):
+        """Forget tasks and requests and apply new settings (queue, render, bulk_list, ...)"""
+        with self._lock:
+            self.tasks.clear()
+            self.requests.clear()
+            self.callback_responses.clear()
+        for name, value in self._defaults.items():
+            setattr(self, name, value)
+        self.bulk_list = True
+        self.fail_status = None
+        self.lose_callbacks = False
+        self.callback_delay = 0.0
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def count(self, method: str, prefix: str = "/contents/generations/tasks") -> int:
+        """Requests seen so far with this method and path prefix"""
+        with self._lock:
+            return sum(1 for m, path in self.requests if m == method and path.startswith(prefix))
+
+    def video_url(self, task_id: str) -> str:
+        return f"{self.base_url}/video/{task_id}.mp4"
+
+    def create(self, payload):
+        task_id = "cgt-" + uuid.uuid4().hex[:12]
+        with self._lock:
+            self.tasks[task_id] = {"created": time.time(), "payload": payload, "cancelled": False}
+        if payload.get("callback_url"):
+            threading.Thread(target=self._deliver_callback, args=(task_id, payload["callback_url"]), daemon=True).start()
+        return 200, {"id": task_id}
+
+    def status(self, task_id: str):
+        task = self.tasks[task_id]
+        age = time.time() - task["created"]
+        if task["cancelled"]:
+            status = "cancelled"
+        elif age < self.queue:
+            status = "queued"
+        elif age < self.queue + self.render:
+            status = "running"
+        else:
+            status = "succeeded"
+        body = {"id": task_id, "model": task["payload"].get("model"), "status": status, "created_at": int(task["created"])}
+        if status == "succeeded":
+            body["content"] = {"video_url": self.video_url(task_id)}
+            body["usage"] = {"completion_tokens": 108900, "total_tokens": 108900}
+        return body
+
+    def get(self, path: str):
+        url = urlparse(path)
+        if url.path.startswith("/video/"):
+            return 200, VIDEO_BYTES
+        if url.path.startswith("/contents/generations/tasks/"):
+            task_id = url.path.rsplit("/", 1)[1]
+            if task_id not in self.tasks:
+                return 404, {"error": {"message": "task not found"}}
+            return 200, self.status(task_id)
+        if url.path == "/contents/generations/tasks":
+            if not self.bulk_list:
+                return 404, {"error": {"message": "not found"}}
+            query = parse_qs(url.query)
+            ids = [task_id for task_id in query.get("filter.task_ids", list(self.tasks)) if task_id in self.tasks]
+            size = int(query.get("page_size", ["10"])[0])
+            page = int(query.get("page_num", ["1"])[0])
+            items = [self.status(task_id) for task_id in ids[(page - 1) * size: page * size]]
+            return 200, {"items": items, "total": len(ids)}
+        return 404, {"error": {"message": "not found"}}
+
+    def delete(self, path: str):
+        task_id = urlparse(path).path.rsplit("/", 1)[1]
+        if task_id not in self.tasks:
+            return 404, {"error": {"message": "task not found"}}
+        self.tasks[task_id]["cancelled"] = True
+        return 200, {}
+
+    def _deliver_callback(self, task_id: str, callback_url: str):
+        time.sleep(self.queue + self.render + 0.05 + self.callback_delay)
+        if self.lose_callbacks or task_id not in self.tasks:
+            return
+        self.post_callback(callback_url, self.status(task_id))
+
+    def post_callback(self, callback_url: str, payload):
+        """POST a callback body to the app; returns (status_code, body)"""
+        request = urllib.request.Request(callback_url, data=json.dumps(payload).encode(),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                result = response.status, json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            result = e.code, json.loads(e.read() or b"{}")
+        with self._lock:
+            self.callback_responses.append((payload.get("id"), result))
+        return result
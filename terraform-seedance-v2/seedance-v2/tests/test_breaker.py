@@ -0,0 +1,119 @@
+"""ARK circuit breaker: trips on failures or slow calls, fails fast while open, probes with submissions only"""
+
+import time
+
+import app as seedance
+
+Breaker = seedance.CircuitBreaker
+
+
+def _client(mock_ark, **settings):
+    client = seedance.BytePlusVideoClient(api_key="test-key", base_url=mock_ark.base_url)
+    options = dict(failure_threshold=3, latency_threshold=2.0, recovery_timeout=0.3, half_open_probes=2)
+    options.update(settings)
+    client.breaker = Breaker(**options)
+    return client
+
+
+def _create(client) -> dict:
+    # The breaker guards the POST itself; going through the model lanes would only add rate-limit waits here
+    return client._create_task({"model": "breaker-test", "content": [{"type": "text", "text": "breaker test"}]}, "task")
+
+
+def _trip(client, mock_ark):
+    mock_ark.fail_status = 503
+    for _ in range(client.breaker.failure_threshold):
+        assert "error" in _create(client)
+    assert client.breaker.state == Breaker.OPEN
+    mock_ark.fail_status = None
+
+
+def test_consecutive_failures_trip_and_fail_fast(mock_ark):
+    client = _client(mock_ark)
+    mock_ark.fail_status = 503
+    for _ in range(2):
+        assert "error" in _create(client)
+    assert client.breaker.state == Breaker.CLOSED
+
+    assert "error" in _create(client)
+    assert client.breaker.state == Breaker.OPEN
+    assert client.breaker.last_error == "HTTP 503"
+
+    posts = mock_ark.count("POST")
+    result = _create(client)
+    assert "circuit open" in result["error"] and "retry in" in result["error"]
+    assert mock_ark.count("POST") == posts
+
+
+def test_success_resets_the_failure_count(mock_ark):
+    client = _client(mock_ark)
+    mock_ark.fail_status = 503
+    _create(client)
+    _create(client)
+    mock_ark.fail_status = None
+    assert "id" in _create(client)
+    mock_ark.fail_status = 503
+    _create(client)
+    _create(client)
+    assert client.breaker.state == Breaker.CLOSED
+
+
+def test_client_errors_do_not_trip(mock_ark):
+    client = _client(mock_ark)
+    mock_ark.fail_status = 400
+    for _ in range(5):
+        assert "error" in _create(client)
+    assert client.breaker.state == Breaker.CLOSED
+
+
+def test_slow_calls_trip(mock_ark):
+    client = _client(mock_ark, latency_threshold=0.2, failure_threshold=2)
+    mock_ark.latency = 0.3
+    _create(client)
+    _create(client)
+    assert client.breaker.state == Breaker.OPEN
+    assert client.breaker.last_error.startswith("slow response")
+
+
+def test_half_open_admits_limited_probes_and_closes_after_submissions(mock_ark):
+    client = _client(mock_ark)
+    _trip(client, mock_ark)
+    time.sleep(0.35)
+    assert client.breaker.state == Breaker.HALF_OPEN
+
+    # Status polls answered by ARK neither use probe slots nor close the breaker
+    task_id = mock_ark.create({"model": "test"})[1]["id"]
+    for _ in range(5):
+        assert "error" not in client.get_task_status(task_id)
+    assert client.breaker.state == Breaker.HALF_OPEN
+
+    assert "id" in _create(client)
+    assert client.breaker.state == Breaker.HALF_OPEN
+    assert "id" in _create(client)
+    assert client.breaker.state == Breaker.CLOSED
+
+
+def test_half_open_limits_concurrent_probes():
+    breaker = Breaker(failure_threshold=1, recovery_timeout=0.1, half_open_probes=2)
+    breaker.record_failure("boom")
+    time.sleep(0.15)
+    assert breaker.allow_request() and breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record_success(0.1, probe=True)
+    assert not breaker.allow_request()
+    breaker.record_success(0.1, probe=True)
+    assert breaker.state == Breaker.CLOSED and breaker.allow_request()
+
+
+def test_failed_probe_reopens(mock_ark):
+    client = _client(mock_ark)
+    _trip(client, mock_ark)
+    time.sleep(0.35)
+
+    mock_ark.fail_status = 503
+    assert "error" in _create(client)
+
+    assert client.breaker.state == Breaker.OPEN
+    assert client.breaker.trips == 2
+    assert client.breaker.retry_after() >= 1
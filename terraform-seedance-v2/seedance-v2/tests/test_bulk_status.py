@@ -0,0 +1,72 @@
+"""Bulk task status: list endpoint first, shared pool of per-task GETs as the fallback"""
+
+import threading
+import time
+
+import app as seedance
+
+
+def _client(mock_ark):
+    return seedance.BytePlusVideoClient(api_key="test-key", base_url=mock_ark.base_url)
+
+
+def _tasks(mock_ark, count: int):
+    return [mock_ark.create({"model": "test"})[1]["id"] for _ in range(count)]
+
+
+def test_bulk_listing_uses_one_request(mock_ark):
+    task_ids = _tasks(mock_ark, 12)
+
+    results = _client(mock_ark).get_tasks_status(task_ids)
+
+    assert set(results) == set(task_ids)
+    assert mock_ark.count("GET") == 1
+
+
+def test_fallback_reuses_shared_pool(mock_ark):
+    mock_ark.bulk_list = False
+    task_ids = _tasks(mock_ark, 12)
+    client = _client(mock_ark)
+
+    for _ in range(3):
+        results = client.get_tasks_status(task_ids)
+        assert set(results) == set(task_ids) and all(status["id"] in task_ids for status in results.values())
+
+    assert client.bulk_list_supported is False
+    # One failed listing, then per-task GETs on the shared pool rather than a new pool per call
+    assert mock_ark.count("GET") == 1 + 3 * len(task_ids)
+    names = [thread.name for thread in threading.enumerate()]
+    assert 0 < sum(name.startswith("ark-status") for name in names) <= seedance.ARK_STATUS_FETCH_CONCURRENCY
+    assert not any(name.startswith("ThreadPoolExecutor-") for name in names)
+
+
+def test_lone_poll_is_not_held_for_the_window(mock_ark, monkeypatch):
+    monkeypatch.setattr(seedance, "client", _client(mock_ark))
+    batcher = seedance.StatusBatcher(window=2, pollers=lambda: 1)
+    task_id = _tasks(mock_ark, 1)[0]
+
+    started = time.time()
+    assert batcher.get(task_id)["id"] == task_id
+    assert time.time() - started < 1
+
+
+def test_batch_flushes_once_every_poller_has_joined(mock_ark, monkeypatch):
+    monkeypatch.setattr(seedance, "client", _client(mock_ark))
+    task_ids = _tasks(mock_ark, 3)
+    batcher = seedance.StatusBatcher(window=2, pollers=lambda: len(task_ids))
+    lists = mock_ark.count("GET")
+    results = {}
+
+    def poll(task_id):
+        results[task_id] = batcher.get(task_id)
+
+    started = time.time()
+    threads = [threading.Thread(target=poll, args=(task_id,)) for task_id in task_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert time.time() - started < 1
+    assert all(results[task_id]["id"] == task_id for task_id in task_ids)
+    assert mock_ark.count("GET") - lists == 1
@@ -0,0 +1,116 @@
+"""ARK callback completion path: callbacks wake waiters, polling covers lost ones"""
+
+import threading
+import time
+
+import app as seedance
+
+
+def _noop_progress(*args, **kwargs):
+    pass
+
+
+def _until(condition, timeout: float = 10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not met in time"
+        time.sleep(0.05)
+
+
+def _start_task(prompt: str) -> str:
+    result = seedance.client.create_text_to_video_task(prompt)
+    assert "id" in result, result
+    return result["id"]
+
+
+def _wait(task_id: str, max_wait: float = 20):
+    started = time.time()
+    video_url, error = seedance.wait_for_video(task_id, _noop_progress, max_wait=max_wait, archive=False)
+    return video_url, error, time.time() - started
+
+
+def test_callback_wakes_waiter(app_server, mock_ark, monkeypatch):
+    monkeypatch.setattr(seedance, "ARK_CALLBACK_SAFETY_POLL_INTERVAL", 30)
+    task_id = _start_task("callback wakes waiter")
+
+    video_url, error, elapsed = _wait(task_id)
+
+    assert error is None
+    assert video_url == mock_ark.video_url(task_id)
+    assert elapsed < 5
+    _until(lambda: mock_ark.callback_responses)
+    assert mock_ark.callback_responses == [(task_id, (200, {"accepted": True, "message": "recorded"}))]
+    # One poll before waiting, one to confirm the callback
+    assert mock_ark.count("GET") <= 2
+
+
+def test_lost_callback_falls_back_to_polling(app_server, mock_ark, monkeypatch):
+    mock_ark.lose_callbacks = True
+    monkeypatch.setattr(seedance, "ARK_CALLBACK_SAFETY_POLL_INTERVAL", 1)
+    task_id = _start_task("lost callback")
+
+    video_url, error, _ = _wait(task_id)
+
+    assert error is None
+    assert video_url == mock_ark.video_url(task_id)
+    assert mock_ark.callback_responses == []
+
+
+def test_late_callback_is_acknowledged_without_refetch(app_server, mock_ark, monkeypatch):
+    mock_ark.callback_delay = 2
+    monkeypatch.setattr(seedance, "ARK_CALLBACK_SAFETY_POLL_INTERVAL", 1)
+    task_id = _start_task("late callback")
+
+    video_url, error, _ = _wait(task_id)
+    assert error is None and video_url == mock_ark.video_url(task_id)
+    polls = mock_ark.count("GET")
+
+    _until(lambda: mock_ark.callback_responses)
+    [(_, (code, body))] = mock_ark.callback_responses
+    # Nobody waits on the task any more: acknowledged so ARK stops retrying, and not fetched again
+    assert code == 200 and body["accepted"]
+    assert mock_ark.count("GET") == polls
+
+
+def test_forged_callback_cannot_inject_result(app_server, mock_ark, callback_url, monkeypatch):
+    mock_ark.render = 2
+    monkeypatch.setattr(seedance, "ARK_CALLBACK_SAFETY_POLL_INTERVAL", 30)
+    task_id = _start_task("forged callback")
+    forged = {"id": task_id, "status": "succeeded", "content": {"video_url": "https://attacker.example/x.mp4"}}
+    threading.Timer(0.5, mock_ark.post_callback, args=(callback_url, forged)).start()
+
+    video_url, error, elapsed = _wait(task_id)
+
+    # The forged body only woke the waiter; the upstream status said the task was still running
+    assert error is None
+    assert video_url == mock_ark.video_url(task_id)
+    assert elapsed >= mock_ark.queue + mock_ark.render
+
+
+def test_callback_with_bad_token_is_rejected(app_server, mock_ark):
+    code, body = mock_ark.post_callback(f"{app_server}/ark/callback?token=wrong", {"id": "cgt-x", "status": "succeeded"})
+    assert code == 403
+    assert mock_ark.count("GET") == 0
+
+
+def test_malformed_callback_is_rejected(mock_ark, callback_url):
+    code, _ = mock_ark.post_callback(callback_url, {"id": "cgt-x", "status": "done"})
+    assert code == 400
+
+
+def test_unknown_task_is_ignored(mock_ark, callback_url):
+    code, body = mock_ark.post_callback(callback_url, {"id": "cgt-unknown", "status": "succeeded"})
+    assert (code, body["message"]) == (200, "ignored unknown task")
+    assert mock_ark.count("GET") == 0
+
+
+def test_callback_route_is_hidden_when_disabled(mock_ark, callback_url, monkeypatch):
+    monkeypatch.setattr(seedance, "ARK_CALLBACK_ENABLED", False)
+    code, _ = mock_ark.post_callback(callback_url, {"id": "cgt-x", "status": "succeeded"})
+    assert code == 404
+
+
+def test_callback_url_requires_token(monkeypatch):
+    monkeypatch.setattr(seedance, "ARK_CALLBACK_TOKEN", None)
+    monkeypatch.setattr(seedance, "ARK_CALLBACK_ENABLED", False)
+    assert seedance._build_client().callback_url is None
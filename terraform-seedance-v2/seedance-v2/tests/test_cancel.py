@@ -0,0 +1,70 @@
+"""Cancelling a generation before its upstream task exists"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import app as seedance
+
+MODEL = "Bytedance-Seedance-1.0-Lite-t2v"
+
+
+def _noop_progress(*args, **kwargs):
+    pass
+
+
+def _generate_in_background(prompt: str, request):
+    outcome = {}
+
+    def run():
+        outcome["result"] = seedance.text_to_video(prompt, MODEL, progress=_noop_progress, request=request)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def test_cancel_during_submission_cancels_created_task(mock_ark):
+    mock_ark.latency = 1
+    request = SimpleNamespace(session_hash="cancel-during-submit")
+    thread, outcome = _generate_in_background("cancel during submission", request)
+    time.sleep(0.3)
+
+    message = seedance.cancel_generation(request, "text_to_video")
+    thread.join(10)
+
+    assert "no upstream task was running yet" in message
+    video, status = outcome["result"]
+    assert video is None and "cancelled" in status
+    assert mock_ark.count("POST") == 1
+    assert mock_ark.count("DELETE") == 1
+    assert all(task["cancelled"] for task in mock_ark.tasks.values())
+    assert seedance.LANES.lane(seedance.MODEL_SEEDANCE_LITE_T2V_API).active == 0
+
+
+def test_cancel_while_waiting_for_lane_skips_submission(mock_ark, monkeypatch):
+    lane = seedance.LANES.lane(seedance.MODEL_SEEDANCE_LITE_T2V_API)
+    monkeypatch.setattr(lane, "limit", 1)
+    assert lane.acquire(1)
+    request = SimpleNamespace(session_hash="cancel-in-lane")
+    thread, outcome = _generate_in_background("cancel while waiting for a lane", request)
+    time.sleep(0.3)
+
+    seedance.cancel_generation(request, "text_to_video")
+    lane.release()
+    thread.join(10)
+
+    video, status = outcome["result"]
+    assert video is None and "cancelled before submission" in status
+    assert mock_ark.count("POST") == 0
+    assert lane.active == 0
+
+
+def test_cancel_in_other_tab_does_not_apply(mock_ark):
+    request = SimpleNamespace(session_hash="cancel-other-tab")
+    seedance.cancel_generation(request, "image_to_video")
+
+    video, status = seedance.text_to_video("other tab cancelled", MODEL, progress=_noop_progress, request=request)
+
+    assert video == mock_ark.video_url(next(iter(mock_ark.tasks))), status
+    assert mock_ark.count("DELETE") == 0
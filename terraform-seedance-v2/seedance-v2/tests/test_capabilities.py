@@ -0,0 +1,103 @@
+"""Requests are preflighted against the capability matrix, and the UI offers only what the validator accepts"""
+
+import pytest
+from PIL import Image
+
+import app as seedance
+
+validate = seedance.validate_generation_request
+PRO = seedance.MODEL_SEEDANCE_PRO_API
+LITE_T2V = seedance.MODEL_SEEDANCE_LITE_T2V_API
+LITE_I2V = seedance.MODEL_SEEDANCE_LITE_I2V_API
+
+
+def _image(tmp_path, width: int, height: int, name: str = "frame.png") -> str:
+    path = str(tmp_path / name)
+    Image.new("RGB", (width, height), "white").save(path)
+    return path
+
+
+@pytest.mark.parametrize("model_id, mode", [
+    (PRO, "image_to_video"), (LITE_I2V, "image_to_video"), (LITE_I2V, "first_last_frame"),
+])
+def test_first_frame_modes_reject_a_fixed_ratio(model_id, mode):
+    assert validate(model_id, mode, "720p", 5, "adaptive") is None
+    error = validate(model_id, mode, "720p", 5, "16:9")
+    assert error.startswith("Aspect ratio 16:9 is not supported") and "adaptive" in error
+
+
+def test_image_refs_accept_fixed_ratios_but_not_adaptive():
+    assert validate(LITE_I2V, "image_refs", "720p", 5, "16:9") is None
+    assert "not supported" in validate(LITE_I2V, "image_refs", "720p", 5, "adaptive")
+
+
+def test_too_many_reference_images():
+    images = [("reference_image", f"https://example.com/{index}.png") for index in range(5)]
+    assert validate(LITE_I2V, "image_refs", "720p", 5, "16:9", images[:4]) is None
+    assert validate(LITE_I2V, "image_refs", "720p", 5, "16:9", images) == "Maximum 4 reference images are supported"
+
+
+@pytest.mark.parametrize("resolution, duration, expected", [
+    ("1440p", 5, "Resolution 1440p is not supported"),
+    ("720p", 2, "Duration 2s is not supported"),
+    ("720p", 13, "Duration 13s is not supported"),
+])
+def test_unsupported_resolution_or_duration(resolution, duration, expected):
+    assert validate(LITE_T2V, "text_to_video", resolution, duration, "16:9").startswith(expected)
+
+
+def test_unknown_model_and_unsupported_mode():
+    assert validate("no-such-model", "text_to_video", "720p", 5) == "Unknown model: no-such-model"
+    assert validate(LITE_T2V, "image_to_video", "720p", 5) == f"Model {LITE_T2V} does not support image-to-video"
+
+
+def test_local_images_are_checked_against_the_limits(tmp_path):
+    ok = _image(tmp_path, 640, 480)
+    small = _image(tmp_path, 200, 480, "small.png")
+    assert validate(LITE_I2V, "image_to_video", "720p", 5, "adaptive", [("first_frame", ok)]) is None
+    error = validate(LITE_I2V, "image_to_video", "720p", 5, "adaptive", [("first_frame", small)])
+    assert error.startswith("first frame image is 200x480")
+
+
+def test_invalid_request_never_reaches_ark(mock_ark):
+    client = seedance.BytePlusVideoClient(api_key="test-key", base_url=mock_ark.base_url)
+    result = client.create_image_to_video_task(image_url="https://example.com/frame.png", prompt="prompt",
+                                               model="Bytedance-Seedance-1.0-Lite-i2v", ratio="16:9")
+    assert result["error"].startswith("Invalid parameters: Aspect ratio 16:9")
+    assert mock_ark.count("POST") == 0
+
+
+@pytest.mark.parametrize("mode, model_name", [
+    (mode, model_name)
+    for mode, models in seedance.client.models.items()
+    for model_name in [*models, seedance.AUTO_MODEL]
+    if model_name != seedance.AUTO_MODEL or mode in ("text_to_video", "image_to_video")
+])
+def test_ui_choices_match_the_validator(mode, model_name):
+    model_id = seedance._model_id_for(mode, model_name)
+    choices = seedance.capability_choices(model_id, mode)
+    caps = seedance.get_model_capabilities(model_id)
+
+    # Every combination the controls can produce passes the preflight...
+    for resolution in choices["resolutions"]:
+        for duration in range(choices["min_duration"], choices["max_duration"] + 1):
+            for ratio in choices["ratios"]:
+                assert validate(model_id, mode, resolution, duration, ratio) is None, (resolution, duration, ratio)
+    # ...and nothing the preflight accepts is missing from them
+    assert choices["resolutions"] == caps["resolutions"]
+    assert set(range(choices["min_duration"], choices["max_duration"] + 1)) == set(caps["durations"])
+    other_ratios = {"21:9", "adaptive", *seedance._STANDARD_RATIOS} - set(choices["ratios"])
+    assert all(validate(model_id, mode, "720p", 5, ratio) for ratio in other_ratios)
+
+
+@pytest.mark.parametrize("mode, model_name", [
+    ("text_to_video", "Bytedance-Seedance-1.0-Lite-t2v"),
+    ("image_to_video", "Bytedance-Seedance-1.0-pro"),
+    ("image_to_video", seedance.AUTO_MODEL),
+])
+def test_switching_model_keeps_controls_valid(mode, model_name):
+    resolution, duration, ratio = seedance.update_parameter_controls(mode, model_name, "1440p", 30, "16:9")
+    model_id = seedance._model_id_for(mode, model_name)
+
+    assert validate(model_id, mode, resolution["value"], duration["value"], ratio["value"]) is None
+    assert resolution["choices"] == seedance.capability_choices(model_id, mode)["resolutions"]
@@ -0,0 +1,91 @@
+"""History and deferred jobs are private to the user who started them"""
+
+import sqlite3
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+import app as seedance
+
+
+def _record(store, task_id: str, user_key: str, prompt: str):
+    store.record_start(task_id, "session", "text_to_video", "model", prompt, {}, user_key)
+
+
+def test_history_pages_and_search_are_per_user(tmp_path):
+    store = seedance.HistoryStore(str(tmp_path / "history.db"))
+    _record(store, "cgt-alice-1", "browser:alice", "a red fox in the snow")
+    _record(store, "cgt-bob-1", "browser:bob", "a red car at night")
+    _record(store, "cgt-alice-2", "browser:alice", "a blue whale")
+
+    assert [row["task_id"] for row in store.page("browser:alice")] == ["cgt-alice-2", "cgt-alice-1"]
+    assert [row["task_id"] for row in store.page("browser:bob", query="red")] == ["cgt-bob-1"]
+    assert store.page("browser:carol") == []
+    assert len(store.page(None)) == 3
+
+    store.fts = False
+    assert [row["task_id"] for row in store.page("browser:alice", query="red")] == ["cgt-alice-1"]
+
+
+def test_existing_history_gains_owner_column(tmp_path):
+    path = str(tmp_path / "history.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE generations (id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT NOT NULL UNIQUE, "
+                     "session_id TEXT, mode TEXT, model TEXT, prompt TEXT, params TEXT, status TEXT, created_at REAL)")
+        conn.execute("INSERT INTO generations (task_id, prompt) VALUES ('cgt-old', 'from before owners')")
+
+    store = seedance.HistoryStore(path)
+    _record(store, "cgt-new", "browser:alice", "after the upgrade")
+
+    assert [row["task_id"] for row in store.page("browser:alice")] == ["cgt-new"]
+    assert [row["task_id"] for row in store.page(None)] == ["cgt-new", "cgt-old"]
+
+
+def test_user_key_prefers_login_then_browser_cookie():
+    assert seedance._user_key(SimpleNamespace(username="ann", cookies={"seedance_uid": "x"})) == "user:ann"
+    assert seedance._user_key(SimpleNamespace(username=None, cookies={"seedance_uid": "x"})) == "browser:x"
+    assert seedance._user_key(SimpleNamespace(session_hash="abc")) == "session:abc"
+    assert seedance._user_key(SimpleNamespace(session_hash="deferred:1", user_key="browser:x")) == "browser:x"
+
+
+def test_deferred_jobs_are_per_user(tmp_path):
+    queue = seedance.DeferredQueue(str(tmp_path / "deferred.db"), str(tmp_path / "jobs"), max_load=0, windows="",
+                                   concurrency=1, interval=1, max_attempts=1)
+    alice = queue.submit("text_to_video", "model", "alice's job", {}, user_key="browser:alice")
+    bob = queue.submit("text_to_video", "model", "bob's job", {}, user_key="browser:bob")
+
+    assert [job["id"] for job in queue.jobs(user_key="browser:alice")] == [alice]
+    assert queue.jobs(user_key="browser:bob")[0]["position"] == 2
+    assert queue.get(bob, "browser:alice") is None
+    assert queue.cancel(bob, "browser:alice") == f"❌ No deferred job #{bob}"
+    assert queue.get(bob)["status"] == "pending"
+
+
+def test_browser_gets_id_cookie(app_server):
+    with urllib.request.urlopen(f"{app_server}/healthz", timeout=10) as response:
+        cookie = response.headers["set-cookie"]
+    assert cookie.startswith("seedance_uid=") and "HttpOnly" in cookie
+
+    request = urllib.request.Request(f"{app_server}/healthz", headers={"Cookie": cookie.split(";")[0]})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        assert response.headers["set-cookie"] is None
+
+
+def test_row_is_finished_when_waiting_raises(monkeypatch, tmp_path):
+    store = seedance.HistoryStore(str(tmp_path / "history.db"))
+    monkeypatch.setattr(seedance, "HISTORY", store)
+
+    def broken_poll(*args, **kwargs):
+        raise RuntimeError("status decoder crashed")
+
+    monkeypatch.setattr(seedance, "_poll_until_done", broken_poll)
+    request = SimpleNamespace(session_hash="session-raise", username=None, cookies={})
+
+    with pytest.raises(RuntimeError):
+        seedance.wait_for_video("cgt-raises", lambda *args, **kwargs: None, max_wait=5, request=request,
+                                mode="text_to_video", model="model")
+
+    row = store.get("cgt-raises")
+    assert row["status"] == "error" and "status decoder crashed" in row["error"]
+    assert not seedance.IN_FLIGHT.tasks(session_id="session-raise")
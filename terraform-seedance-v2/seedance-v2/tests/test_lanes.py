@@ -0,0 +1,42 @@
+"""Model lanes: in-flight cap plus a submission rate bucket in the state backend"""
+
+import threading
+import time
+
+import app as seedance
+
+
+def test_slow_token_bucket_does_not_block_the_lane(monkeypatch):
+    lane = seedance.ModelLane("lane-slow-bucket", limit=2, rate=10, burst=10)
+    assert lane.acquire(1)
+    taking = threading.Event()
+
+    def slow_take_token(key, rate, burst):
+        taking.set()
+        time.sleep(0.5)
+        return True
+
+    monkeypatch.setattr(seedance.STATE, "take_token", slow_take_token)
+    waiter = threading.Thread(target=lane.acquire, args=(5,))
+    waiter.start()
+    taking.wait(5)
+
+    started = time.monotonic()
+    lane.release()
+    assert time.monotonic() - started < 0.2
+    waiter.join(5)
+    assert lane.active == 1 and lane.waiting == 0
+
+
+def test_waits_for_token_refill_and_returns_unused_slot(monkeypatch):
+    lane = seedance.ModelLane("lane-no-tokens", limit=1, rate=20, burst=1)
+    tokens = iter([False, False, True])
+    monkeypatch.setattr(seedance.STATE, "take_token", lambda key, rate, burst: next(tokens))
+
+    assert lane.acquire(5)
+    assert lane.active == 1
+
+    monkeypatch.setattr(seedance.STATE, "take_token", lambda key, rate, burst: False)
+    lane.release()
+    assert not lane.acquire(0.2)
+    assert lane.active == 0 and lane.waiting == 0
@@ -0,0 +1,37 @@
+"""Tasks left behind by a shutdown are resumed once, by their owner"""
+
+import time
+
+import app as seedance
+
+
+def _leftover(history, task_id: str, session_id: str):
+    history.record_start(task_id, session_id, "text_to_video", "model", "prompt", {}, "browser:test")
+    task = seedance.InFlightTask(task_id, session_id, "text_to_video", "model")
+    task.archive = True
+    return task
+
+
+def test_deferred_tasks_are_left_to_the_deferred_queue(monkeypatch, tmp_path):
+    history = seedance.HistoryStore(str(tmp_path / "history.db"))
+    monkeypatch.setattr(seedance, "HISTORY", history)
+    resumed = []
+    monkeypatch.setattr(seedance.LIFECYCLE, "_resume", lambda row: resumed.append(row["task_id"]))
+
+    seedance.LIFECYCLE.record_leftovers([
+        _leftover(history, "cgt-interactive", "session-1"),
+        _leftover(history, "cgt-deferred", f"{seedance.DEFERRED_SESSION_PREFIX}7"),
+    ])
+    assert history.get("cgt-interactive")["status"] == "interrupted"
+    assert history.get("cgt-deferred")["status"] == "queued"
+
+    # Rows flagged by an older version are skipped as well
+    history.mark_interrupted(["cgt-deferred"])
+    seedance.LIFECYCLE.resume_interrupted()
+
+    # Resumes run on background threads
+    deadline = time.time() + 5
+    while not resumed and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    assert resumed == ["cgt-interactive"]
@@ -0,0 +1,48 @@
+"""Handlers running at the same time each see only their own DEBUG LOGS"""
+
+import io
+import sys
+import threading
+import time
+
+import app as seedance
+
+
+@seedance.capture_logs_wrapper
+def _chatty_handler(name: str, barrier: threading.Barrier):
+    for step in range(5):
+        print(f"{name} step {step}")
+        if step == 0:
+            barrier.wait(5)
+        time.sleep(0.01)
+    print(f"{name} warning", file=sys.stderr)
+    return None, f"{name} done"
+
+
+def test_concurrent_handlers_capture_only_their_own_output():
+    barrier = threading.Barrier(8)
+    statuses = {}
+
+    def run(name):
+        statuses[name] = _chatty_handler(name, barrier)[1]
+
+    threads = [threading.Thread(target=run, args=(f"user{index}",)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    for name, status in statuses.items():
+        logs = status.split("DEBUG LOGS:\n", 1)[1]
+        assert logs.count("step") == 5 and f"{name} warning" in logs
+        assert all(line.startswith(f"{name} ") for line in logs.splitlines() if line)
+    assert len(statuses) == 8
+
+
+def test_output_outside_capture_reaches_the_real_stream(capsys):
+    with seedance.OUTPUT_CAPTURE.capture(io.StringIO()) as buffer:
+        print("captured")
+    print("not captured")
+
+    assert buffer.getvalue() == "captured\n"
+    assert "not captured" in capsys.readouterr().out
@@ -0,0 +1,68 @@
+"""Post-processing: ffmpeg detection, worker processes and output retention"""
+
+import os
+import stat
+import time
+
+import app as seedance
+
+
+def _fake_ffmpeg(tmp_path, exit_code: int = 0) -> str:
+    """A stand-in ffmpeg that writes a small file to its output path (the last argument)"""
+    path = tmp_path / "ffmpeg"
+    path.write_text(f'#!/bin/sh\nfor last; do :; done\necho frame > "$last"\nexit {exit_code}\n')
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_auto_mode_needs_ffmpeg(monkeypatch, tmp_path):
+    monkeypatch.setattr(seedance, "FFMPEG_BINARY", str(tmp_path / "missing-ffmpeg"))
+    assert not seedance.postprocess_available("auto")
+    assert not seedance.postprocess_available("true")
+
+    monkeypatch.setattr(seedance, "FFMPEG_BINARY", _fake_ffmpeg(tmp_path))
+    assert seedance.postprocess_available("auto")
+    assert not seedance.postprocess_available("false")
+
+
+def test_disabled_processor_skips_jobs(mock_ark, tmp_path):
+    processor = seedance.PostProcessor(output_dir=str(tmp_path / "videos"), enabled=False)
+    assert processor.submit("cgt-off", mock_ark.video_url("cgt-off")) is None
+    assert mock_ark.count("GET", "/video/") == 0
+
+
+def test_job_produces_outputs(mock_ark, monkeypatch, tmp_path):
+    monkeypatch.setattr(seedance, "FFMPEG_BINARY", _fake_ffmpeg(tmp_path))
+    processor = seedance.PostProcessor(output_dir=str(tmp_path / "videos"))
+
+    outputs = processor.submit("cgt-ok", mock_ark.video_url("cgt-ok")).result(30)
+
+    assert set(outputs) == {"video", "poster", "preview"}
+    assert all(os.path.exists(path) for path in outputs.values())
+
+
+def test_failed_job_leaves_nothing_behind(mock_ark, monkeypatch, tmp_path):
+    monkeypatch.setattr(seedance, "FFMPEG_BINARY", _fake_ffmpeg(tmp_path, exit_code=1))
+    processor = seedance.PostProcessor(output_dir=str(tmp_path / "videos"))
+
+    error = processor.submit("cgt-fail", mock_ark.video_url("cgt-fail")).exception(30)
+
+    assert isinstance(error, RuntimeError)
+    assert os.listdir(tmp_path / "videos") == []
+
+
+def test_sweep_removes_oldest_outputs_over_budget(tmp_path):
+    output_dir = tmp_path / "videos"
+    now = time.time()
+    for age, name in [(300, "oldest"), (200, "older"), (100, "newest")]:
+        task_dir = output_dir / name
+        task_dir.mkdir(parents=True)
+        (task_dir / "video.mp4").write_bytes(b"\0" * 1000)
+        os.utime(task_dir, (now - age, now - age))
+    processor = seedance.PostProcessor(output_dir=str(output_dir), max_bytes=2500, max_age=3600)
+
+    assert processor.sweep() == ["oldest"]
+    assert sorted(os.listdir(output_dir)) == ["newest", "older"]
+
+    processor.max_age = 150
+    assert processor.sweep() == ["older"]
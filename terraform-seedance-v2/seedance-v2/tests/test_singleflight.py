@@ -0,0 +1,87 @@
+"""Identical concurrent submissions share one upstream task, and each user still gets a History row"""
+
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import app as seedance
+
+MODEL = "Bytedance-Seedance-1.0-Lite-t2v"
+
+
+def _noop_progress(*args, **kwargs):
+    pass
+
+
+def _request(name: str):
+    return SimpleNamespace(session_hash=f"sf-{name}", username=None, cookies={seedance.SEEDANCE_USER_COOKIE: name})
+
+
+def _wait_for(predicate, timeout: float = 5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.02)
+    assert predicate()
+
+
+def test_shared_task_survives_one_callers_cancel(mock_ark, monkeypatch, tmp_path):
+    monkeypatch.setattr(seedance, "SEEDANCE_SINGLE_FLIGHT", True)
+    history = seedance.HistoryStore(str(tmp_path / "history.db"))
+    monkeypatch.setattr(seedance, "HISTORY", history)
+    mock_ark.latency = 0.3
+    mock_ark.render = 2
+    requests_by_user = {"alice": _request("alice"), "bob": _request("bob")}
+    results = {}
+
+    def submit(name):
+        results[name] = seedance.text_to_video("single flight", MODEL, progress=_noop_progress,
+                                               request=requests_by_user[name])
+
+    threads = {name: threading.Thread(target=submit, args=(name,)) for name in requests_by_user}
+    threads["alice"].start()
+    time.sleep(0.1)
+    threads["bob"].start()
+    _wait_for(lambda: all(seedance.IN_FLIGHT.tasks(session_id=f"sf-{name}") for name in requests_by_user))
+    task_id = seedance.IN_FLIGHT.tasks(session_id="sf-alice")[0].task_id
+    assert seedance.IN_FLIGHT.tasks(session_id="sf-bob")[0].task_id == task_id
+
+    message = seedance.cancel_generation(requests_by_user["alice"], "text_to_video")
+    assert "still running for other requests" in message
+    for thread in threads.values():
+        thread.join(30)
+
+    assert results["bob"][0] == mock_ark.video_url(task_id)
+    assert results["alice"][0] is None
+    assert mock_ark.count("POST") == 1 and mock_ark.count("DELETE") == 0
+
+    rows = {name: history.page(f"browser:{name}") for name in requests_by_user}
+    assert [row["task_id"] for row in rows["alice"]] == [task_id]
+    assert [row["task_id"] for row in rows["bob"]] == [task_id]
+    assert rows["alice"][0]["status"] == "cancelled"
+    assert rows["bob"][0]["status"] == "succeeded"
+
+
+def test_history_keyed_on_task_id_alone_is_rebuilt(tmp_path):
+    path = str(tmp_path / "history.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE generations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT UNIQUE NOT NULL, session_id TEXT, mode TEXT, model TEXT,
+        prompt TEXT, params TEXT, status TEXT, created_at REAL, finished_at REAL, queue_seconds REAL,
+        render_seconds REAL, video_url TEXT, video_path TEXT, poster_path TEXT, preview_path TEXT, error TEXT
+    );
+    """)
+    conn.executescript(seedance.HistoryStore.FTS_SCHEMA)
+    conn.execute("INSERT INTO generations (id, task_id, prompt, status) VALUES (7, 'cgt-old', 'old sunset', 'succeeded')")
+    conn.commit()
+    conn.close()
+
+    history = seedance.HistoryStore(path)
+    history.record_start("cgt-shared", "s1", "text_to_video", "model", "shared prompt", {}, "browser:a")
+    history.record_start("cgt-shared", "s2", "text_to_video", "model", "shared prompt", {}, "browser:b")
+    history.record_start("cgt-shared", "s2", "text_to_video", "model", "shared prompt", {}, "browser:b")
+
+    assert history.get("cgt-old")["id"] == 7
+    assert [row["task_id"] for row in history.page(None, query="sunset")] == ["cgt-old"]
+    assert len(history.page("browser:a")) == 1 and len(history.page("browser:b")) == 1
@@ -0,0 +1,55 @@
+"""Usage is charged to and throttled per user, and each user only sees their own"""
+
+from types import SimpleNamespace
+
+import app as seedance
+
+USAGE = {"total_tokens": 1000, "completion_tokens": 1000}
+
+
+def _noop_progress(*args, **kwargs):
+    pass
+
+
+def _ledger(tmp_path, soft_limit: int = 1500):
+    return seedance.UsageLedger(str(tmp_path / "usage.db"), prices={}, window=3600, soft_limit=soft_limit,
+                                throttle_seconds=10, throttle_max=60)
+
+
+def test_soft_limit_follows_the_user_across_sessions(tmp_path):
+    ledger = _ledger(tmp_path)
+    ledger.record("cgt-1", "session-before-reload", "text_to_video", "model", "720p", 5, USAGE, "browser:alice")
+    ledger.record("cgt-2", "session-after-reload", "text_to_video", "model", "720p", 5, USAGE, "browser:alice")
+    ledger.record("cgt-3", "session-bob", "text_to_video", "model", "720p", 5, USAGE, "browser:bob")
+
+    assert ledger.user_tokens("browser:alice") == 2000
+    assert ledger.throttle_delay("browser:alice")[0] > 0
+    assert ledger.throttle_delay("browser:bob") == (0.0, 1000)
+
+
+def test_usage_tab_shows_only_the_callers_usage(monkeypatch, tmp_path):
+    ledger = _ledger(tmp_path)
+    monkeypatch.setattr(seedance, "USAGE", ledger)
+    ledger.record("cgt-a", "session-a", "text_to_video", "model-a", "720p", 5, USAGE, "browser:alice")
+    ledger.record("cgt-b", "session-b", "text_to_video", "model-b", "1080p", 5, USAGE, "browser:bob")
+
+    info, by_model = seedance.load_usage_summary("Last hour", SimpleNamespace(username=None, cookies={"seedance_uid": "alice"}))
+
+    assert [row[0] for row in by_model] == ["model-a"]
+    assert "session-b" not in info and "1 tasks" in info
+    admin = ledger.summary(1)
+    assert {row["user_key"] for row in admin["top_users"]} == {"browser:alice", "browser:bob"}
+    assert {row["session_id"] for row in admin["top_sessions"]} == {"session-a", "session-b"}
+
+
+def test_deferred_job_usage_is_charged_to_its_owner(mock_ark, monkeypatch, tmp_path):
+    ledger = _ledger(tmp_path)
+    monkeypatch.setattr(seedance, "USAGE", ledger)
+    task_id = seedance.client.create_text_to_video_task("deferred usage")["id"]
+    request = SimpleNamespace(session_hash=f"{seedance.DEFERRED_SESSION_PREFIX}42", user_key="browser:owner")
+
+    video_url, error = seedance.wait_for_video(task_id, _noop_progress, max_wait=20, request=request,
+                                               mode="text_to_video", model="model", archive=False)
+
+    assert error is None and video_url
+    assert ledger.user_tokens("browser:owner") > 0
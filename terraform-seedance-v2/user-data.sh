@@ -19,6 +19,10 @@ apt-get update >> /var/log/seedance-init.log 2>&1
 echo "Installing essential packages..."
 apt-get install -y curl wget >> /var/log/seedance-init.log 2>&1
 
+# ffmpeg is used for storyboard chaining and video post-processing (posters/previews)
+echo "Installing ffmpeg..."
+apt-get install -y ffmpeg >> /var/log/seedance-init.log 2>&1
+
 # Set a basic hostname
 echo "seedance-v2" > /etc/hostname
 